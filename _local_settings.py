@@ -20,6 +20,9 @@ APP_SETTINGS = LocalSettingsClass(
     application_index_path='/',
 )
 
+# application_token, который Битрикс24 передает в исходящих событиях (выдается при установке приложения)
+BITRIX_APPLICATION_TOKEN = 'your-application-token'
+
 # Настройки базы данных
 DATABASES = {
     'default': {
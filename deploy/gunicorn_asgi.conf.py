@@ -0,0 +1,29 @@
+"""
+Профиль gunicorn с воркерами uvicorn для асинхронного режима:
+gunicorn -c deploy/gunicorn_asgi.conf.py tz2.asgi:application
+
+Требует PUBLIC_VIEWS_ASYNC = True в local_settings.py.
+"""
+import multiprocessing
+import os
+
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Воркер с зависшим запросом перезапускается, а не держит слот бесконечно
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Перезапуск воркеров ограничивает рост памяти процессов
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def worker_exit(server, worker):
+    # Сбросить накопленные в памяти счетчики сканирований до остановки воркера
+    from main_app.utils.scan_buffer import scan_counter
+    
+    scan_counter.flush()
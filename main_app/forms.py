@@ -5,6 +5,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from .models import Product
 from .utils.bitrix_api import BitrixProductService
+from .utils import qr_bulk
 
 
 class ProductSearchForm(forms.Form):
@@ -12,7 +13,7 @@ class ProductSearchForm(forms.Form):
     
     SEARCH_CHOICES = [
         ('id', 'Поиск по ID'),
-        ('name', 'Поиск по названию'),
+        ('name', 'Поиск по названию и описанию'),
     ]
     
     search_type = forms.ChoiceField(
@@ -140,3 +141,62 @@ class QRCodeGenerateForm(forms.Form):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['product'].queryset = Product.objects.filter(is_active=True).order_by('name')
+
+
+class QRBulkGenerateForm(forms.Form):
+    """Форма массовой генерации QR-кодов"""
+    
+    scope = forms.ChoiceField(
+        choices=[
+            (qr_bulk.SCOPE_IDS, 'Товары по ID в Битрикс24'),
+            (qr_bulk.SCOPE_QUERY, 'Товары по поисковому запросу'),
+            (qr_bulk.SCOPE_ACTIVE, 'Все активные товары'),
+        ],
+        initial=qr_bulk.SCOPE_IDS,
+        widget=forms.RadioSelect,
+        label='Товары'
+    )
+    
+    bitrix_ids = forms.CharField(
+        required=False,
+        label='ID товаров',
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 3,
+            'placeholder': 'ID через запятую, пробел или с новой строки'
+        })
+    )
+    
+    query = forms.CharField(
+        max_length=255,
+        required=False,
+        label='Поиск по названию и описанию',
+        widget=forms.TextInput(attrs={'class': 'form-control'})
+    )
+    
+    output = forms.ChoiceField(
+        choices=[
+            (qr_bulk.OUTPUT_ZIP, 'ZIP-архив PNG-файлов'),
+            (qr_bulk.OUTPUT_PDF, 'PDF с листами наклеек для печати'),
+        ],
+        initial=qr_bulk.OUTPUT_ZIP,
+        label='Результат',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    
+    def clean_bitrix_ids(self):
+        """Разбор списка ID"""
+        value = self.cleaned_data.get('bitrix_ids', '')
+        try:
+            return sorted({int(item) for item in value.replace(',', ' ').split()})
+        except ValueError:
+            raise ValidationError('ID товаров должны быть числами')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        scope = cleaned_data.get('scope')
+        if scope == qr_bulk.SCOPE_IDS and not cleaned_data.get('bitrix_ids'):
+            self.add_error('bitrix_ids', 'Укажите хотя бы один ID товара')
+        if scope == qr_bulk.SCOPE_QUERY and not cleaned_data.get('query'):
+            self.add_error('query', 'Укажите поисковый запрос')
+        return cleaned_data
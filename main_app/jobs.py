@@ -0,0 +1,148 @@
+"""
+Очередь фоновых задач на базе таблицы BackgroundJob (без Redis и брокеров).
+
+Задачи ставятся в очередь через enqueue_job и выполняются воркером
+manage.py run_jobs. Обработчики регистрируются декоратором job_handler.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+
+# Если воркер не подавал сигнал дольше этого времени, задача считается брошенной
+JOB_STALE_AFTER = timedelta(minutes=10)
+
+JOB_HANDLERS = {}
+
+logger = logging.getLogger(__name__)
+
+
+def job_handler(kind):
+    """Зарегистрировать обработчик задач указанного типа"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue_job(kind, lock_key=None, user_token=None, **params):
+    """
+    Поставить задачу в очередь.
+    
+    Если активная задача с тем же lock_key уже есть, новая не создается.
+    Возвращает кортеж (задача, создана ли она).
+    """
+    try:
+        with transaction.atomic():
+            job = BackgroundJob.objects.create(
+                kind=kind,
+                lock_key=lock_key,
+                user_token=user_token,
+                params=params,
+            )
+        return job, True
+    except IntegrityError:
+        job = BackgroundJob.objects.filter(lock_key=lock_key, status__in=BackgroundJob.ACTIVE_STATUSES).first()
+        if job is None:
+            raise
+        return job, False
+
+
+def claim_next_job():
+    """
+    Забрать самую старую задачу из очереди.
+    
+    Захват делается условным UPDATE по статусу, поэтому несколько воркеров
+    не возьмут одну задачу даже на базах без SELECT ... FOR UPDATE.
+    """
+    candidates = (
+        BackgroundJob.objects.filter(status=BackgroundJob.STATUS_QUEUED)
+        .order_by('created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        now = timezone.now()
+        claimed = BackgroundJob.objects.filter(id=job_id, status=BackgroundJob.STATUS_QUEUED).update(
+            status=BackgroundJob.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+        )
+        if claimed:
+            return BackgroundJob.objects.select_related('user_token').get(id=job_id)
+    return None
+
+
+def fail_stale_jobs():
+    """Пометить ошибкой задачи, воркер которых перестал подавать сигнал"""
+    return BackgroundJob.objects.filter(
+        status=BackgroundJob.STATUS_RUNNING,
+        heartbeat_at__lt=timezone.now() - JOB_STALE_AFTER,
+    ).update(
+        status=BackgroundJob.STATUS_FAILED,
+        error='Воркер перестал отвечать',
+        finished_at=timezone.now(),
+    )
+
+
+class JobProgress:
+    """Запись прогресса задачи; каждое обновление заодно служит сигналом жизни воркера"""
+    
+    def __init__(self, job):
+        self.job = job
+    
+    def __call__(self, **values):
+        self.job.progress.update(values)
+        self.job.heartbeat_at = timezone.now()
+        BackgroundJob.objects.filter(id=self.job.id).update(
+            progress=self.job.progress,
+            heartbeat_at=self.job.heartbeat_at,
+        )
+
+
+def run_job(job):
+    """Выполнить захваченную задачу и сохранить итоговый статус"""
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise Exception(f"Нет обработчика для задач типа {job.kind}")
+        handler(job, JobProgress(job))
+    except Exception as e:
+        logger.exception("Фоновая задача #%s завершилась ошибкой", job.id)
+        job.status = BackgroundJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.status = BackgroundJob.STATUS_DONE
+    
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'progress', 'finished_at'])
+    return job
+
+
+def product_sync_lock_key(portal_domain):
+    return f'{BackgroundJob.KIND_PRODUCT_SYNC}:{portal_domain}'
+
+
+@job_handler(BackgroundJob.KIND_PRODUCT_SYNC)
+def run_product_sync(job, progress):
+    """Синхронизация товаров с Битрикс24"""
+    from .utils.bitrix_api import BitrixProductService
+    
+    if job.user_token is None:
+        raise Exception("Токен пользователя для синхронизации не найден")
+    
+    service = BitrixProductService(job.user_token)
+    service.sync_products_to_local(full=job.params.get('full', False), progress=progress)
+
+
+@job_handler(BackgroundJob.KIND_QR_BULK)
+def run_qr_bulk(job, progress):
+    """Массовая генерация QR-кодов в ZIP или PDF"""
+    from .utils.qr_bulk import generate_bulk
+    
+    output_format = job.params.get('output', 'zip')
+    output = generate_bulk(job.params, f'qr_bulk/qr_job_{job.id}.{output_format}', progress)
+    progress(stage='done', output=output)
@@ -0,0 +1,112 @@
+"""
+Бенчмарк синхронизации и создания товаров на локальной замене Битрикс24:
+python manage.py bench_bitrix_sync --sizes 1000,10000,100000
+
+Работает в отдельной тестовой базе, рабочие данные не затрагиваются.
+"""
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+
+from main_app.models import Product, ProductSyncState
+from main_app.utils.bitrix_api import BitrixProductService
+from main_app.utils.bitrix_fake import FakeBitrixPortal
+
+
+class Command(BaseCommand):
+    help = 'Измерить sync_products_to_local и add_products на локальной замене REST API Битрикс24'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Размеры каталога через запятую')
+        parser.add_argument('--latency', type=float, default=0.05, help='Задержка одного HTTP-запроса, с')
+        parser.add_argument('--page-size', type=int, default=50, help='Размер страницы crm.product.list')
+        parser.add_argument('--portal-rate', type=float, default=None, help='Лимит портала, запросов в секунду')
+        parser.add_argument('--portal-burst', type=int, default=50, help='Запас запросов портала')
+        parser.add_argument('--client-rate', type=float, default=None, help='Переопределить BITRIX_RATE_LIMIT клиента')
+        parser.add_argument('--create', type=int, default=500, help='Сколько товаров создавать через add_products')
+        parser.add_argument('--no-memory', action='store_true', help='Не измерять пиковую память (tracemalloc замедляет прогон)')
+        parser.add_argument('--keepdb', action='store_true', help='Не пересоздавать тестовую базу')
+        parser.add_argument('--json', dest='json_path', help='Сохранить результаты в JSON (для сравнения в CI)')
+    
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = []
+            for size in [int(size) for size in options['sizes'].split(',') if size]:
+                results.extend(self.run_size(size, options))
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+        
+        self.print_table(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+    
+    def run_size(self, size, options):
+        Product.objects.all().delete()
+        ProductSyncState.objects.all().delete()
+        
+        portal = FakeBitrixPortal(
+            catalog_size=size,
+            latency=options['latency'],
+            page_size=options['page_size'],
+            rate=options['portal_rate'],
+            burst=options['portal_burst'],
+            domain=f'bench-{size}-{time.monotonic_ns()}.bitrix24.local',
+        )
+        service = BitrixProductService(portal)
+        if options['client_rate']:
+            service.client.bucket.rate = options['client_rate']
+        
+        results = [
+            self.measure(size, 'sync_full', portal, options, lambda: service.sync_products_to_local(full=True)),
+            self.measure(size, 'sync_unchanged', portal, options, lambda: service.sync_products_to_local(full=True)),
+        ]
+        
+        for bitrix_id in range(1, size + 1, max(1, size // 100)):
+            portal.touch(bitrix_id, NAME=f'Измененный товар {bitrix_id}')
+        results.append(self.measure(size, 'sync_delta_1pct', portal, options, lambda: service.sync_products_to_local()))
+        
+        products = [{'name': f'Новый товар {index}', 'price': index} for index in range(options['create'])]
+        results.append(self.measure(size, f'add_products_{len(products)}', portal, options, lambda: service.add_products(products)))
+        return results
+    
+    def measure(self, size, scenario, portal, options, func):
+        calls_before = portal.calls
+        throttled_before = portal.throttled
+        
+        if not options['no_memory']:
+            tracemalloc.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        wall = time.perf_counter() - started
+        peak = None
+        if not options['no_memory']:
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        
+        return {
+            'size': size,
+            'scenario': scenario,
+            'wall_s': round(wall, 3),
+            'queries': len(queries),
+            'peak_mb': round(peak, 2) if peak is not None else None,
+            'rest_calls': portal.calls - calls_before,
+            'throttled': portal.throttled - throttled_before,
+        }
+    
+    def print_table(self, results):
+        header = f"{'size':>8}  {'scenario':<20} {'wall, s':>9} {'queries':>8} {'peak, MB':>9} {'REST':>6} {'429':>5}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            peak = '-' if row['peak_mb'] is None else f"{row['peak_mb']:.2f}"
+            self.stdout.write(
+                f"{row['size']:>8}  {row['scenario']:<20} {row['wall_s']:>9.3f} {row['queries']:>8} "
+                f"{peak:>9} {row['rest_calls']:>6} {row['throttled']:>5}"
+            )
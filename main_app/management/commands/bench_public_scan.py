@@ -0,0 +1,167 @@
+"""
+Бенчмарк публичной страницы товара под параллельными сканированиями:
+python manage.py bench_public_scan --requests 20000 --concurrency 64
+
+Сравнивает синхронное представление через WSGI-обработчик (пул потоков, как
+у gunicorn --threads) и асинхронное через ASGI-обработчик (одна петля
+событий, как у uvicorn). Работает в отдельной тестовой базе.
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.urls import path
+
+from main_app import views
+from main_app.models import Product, QRCodeLink
+from main_app.utils.signer import signer
+from main_app.utils.token_cache import token_cache
+
+
+def bench_urlconf(name, view):
+    """URLconf из одного маршрута публичной страницы для заданного режима"""
+    urlconf = ModuleType(f'bench_public_scan_{name}')
+    urlconf.urlpatterns = [path('product/<str:token>/', view)]
+    return urlconf
+
+
+MODES = {
+    'wsgi': bench_urlconf('wsgi', views.product_view_by_token),
+    'asgi': bench_urlconf('asgi', views.aproduct_view_by_token),
+}
+
+
+class Command(BaseCommand):
+    help = 'Сравнить пропускную способность и p99 публичной страницы товара под WSGI и ASGI'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--links', type=int, default=1000, help='Сколько QR-ссылок создать')
+        parser.add_argument('--requests', type=int, default=5000, help='Сколько запросов выполнить в каждом режиме')
+        parser.add_argument('--concurrency', type=int, default=64, help='Одновременных запросов (потоков для WSGI)')
+        parser.add_argument('--db-latency', type=float, default=0.0, help='Искусственная задержка каждого SQL-запроса, с')
+        parser.add_argument('--cold', action='store_true', help='Сбрасывать кеши перед каждым запросом (каждый скан идет в базу)')
+        parser.add_argument('--modes', default='wsgi,asgi', help='Режимы через запятую')
+        parser.add_argument('--keepdb', action='store_true', help='Не пересоздавать тестовую базу')
+        parser.add_argument('--json', dest='json_path', help='Сохранить результаты в JSON')
+    
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        delay = self.install_db_latency(options['db_latency'])
+        try:
+            urls = self.create_links(options['links'])
+            results = []
+            for mode in [mode for mode in options['modes'].split(',') if mode]:
+                with override_settings(ROOT_URLCONF=MODES[mode], ALLOWED_HOSTS=['*']):
+                    results.append(self.run_mode(mode, urls, options))
+        finally:
+            connection_created.disconnect(delay)
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+        
+        self.print_table(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+    
+    def install_db_latency(self, latency):
+        """Добавить задержку в каждое подключение к базе, включая открытые в потоках"""
+        def wrapper(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+        
+        def delay(sender, connection, **kwargs):
+            if latency:
+                connection.execute_wrappers.append(wrapper)
+        
+        connection_created.connect(delay)
+        if connection.connection is not None:
+            delay(None, connection)
+        return delay
+    
+    def create_links(self, count):
+        Product.objects.bulk_create(
+            Product(bitrix_id=index, name=f'Товар {index}', price=index) for index in range(1, count + 1)
+        )
+        QRCodeLink.objects.bulk_create(QRCodeLink(product=product) for product in Product.objects.all())
+        return [f'/product/{signer.create_link_token(link_id)}/' for link_id in QRCodeLink.objects.values_list('id', flat=True)]
+    
+    def reset_caches(self):
+        token_cache.clear()
+        cache.clear()
+    
+    def run_mode(self, mode, urls, options):
+        self.reset_caches()
+        total = options['requests']
+        targets = [urls[index % len(urls)] for index in range(total)]
+        runner = self.run_wsgi if mode == 'wsgi' else self.run_asgi
+        
+        started = time.perf_counter()
+        latencies, errors = runner(targets, options)
+        wall = time.perf_counter() - started
+        
+        latencies.sort()
+        return {
+            'mode': mode,
+            'requests': total,
+            'concurrency': options['concurrency'],
+            'cold': options['cold'],
+            'wall_s': round(wall, 3),
+            'rps': round(total / wall, 1),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[int((len(latencies) - 1) * 0.99)] * 1000, 2),
+            'errors': errors,
+        }
+    
+    def run_wsgi(self, targets, options):
+        local = threading.local()
+        
+        def fetch(url):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            if options['cold']:
+                self.reset_caches()
+            started = time.perf_counter()
+            status = local.client.get(url).status_code
+            return time.perf_counter() - started, status
+        
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(fetch, targets))
+        return [latency for latency, _ in results], sum(1 for _, status in results if status != 200)
+    
+    def run_asgi(self, targets, options):
+        async def main():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            
+            async def fetch(url):
+                # Как и ASGIHandler, каждый запрос получает свой поток для синхронных вызовов ORM
+                async with semaphore, ThreadSensitiveContext():
+                    if options['cold']:
+                        self.reset_caches()
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    return time.perf_counter() - started, response.status_code
+            
+            return await asyncio.gather(*[fetch(url) for url in targets])
+        
+        results = asyncio.run(main())
+        return [latency for latency, _ in results], sum(1 for _, status in results if status != 200)
+    
+    def print_table(self, results):
+        header = f"{'mode':<6} {'requests':>9} {'conc':>5} {'cold':>5} {'wall, s':>9} {'rps':>9} {'p50, ms':>9} {'p99, ms':>9} {'errors':>7}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<6} {row['requests']:>9} {row['concurrency']:>5} {str(row['cold']):>5} {row['wall_s']:>9.3f} "
+                f"{row['rps']:>9.1f} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['errors']:>7}"
+            )
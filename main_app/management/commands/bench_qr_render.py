@@ -0,0 +1,124 @@
+"""
+Микробенчмарк генерации QR-кодов:
+python manage.py bench_qr_render --codes 2000
+
+Сравнивает прежнюю реализацию generate_qr_code (qrcode.make с подбором
+версии от 1 и PIL-картинка через make_image) с быстрым кодировщиком из
+utils/qr_encoder по времени и размеру PNG на один код. Проверяет, что обе
+реализации дают одинаковую матрицу.
+"""
+import json
+import random
+import statistics
+import string
+import time
+from io import BytesIO
+
+import qrcode
+from django.core.management.base import BaseCommand
+
+from main_app.utils.qr_encoder import QR_PNG_COMPRESS_LEVEL, matrix_to_png, qr_matrix
+from main_app.utils.qr_generator import ERROR_CORRECTION_LEVELS, generate_product_qr_url
+
+
+def reference_qr_code(url, size=10, border=4, error_correction='L'):
+    """Прежняя реализация generate_qr_code"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        box_size=size,
+        border=border,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    
+    img_buffer = BytesIO()
+    img.save(img_buffer, format='PNG')
+    img_buffer.seek(0)
+    
+    return img_buffer
+
+
+def reference_matrix(url, border, error_correction):
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECTION_LEVELS[error_correction], border=border)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def sample_payloads(count, seed=0):
+    """URL публичной страницы с токенами той же длины, что у signer"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + '-_:'
+    return [
+        generate_product_qr_url(''.join(rng.choice(alphabet) for _ in range(rng.randint(20, 60))))
+        for _ in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Сравнить время и размер PNG прежней и быстрой генерации QR-кодов'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--codes', type=int, default=1000, help='Сколько кодов сгенерировать в каждом режиме')
+        parser.add_argument('--size', type=int, default=10, help='Размер модуля в пикселях')
+        parser.add_argument('--border', type=int, default=4, help='Ширина рамки в модулях')
+        parser.add_argument('--error-correction', default='L', choices=sorted(ERROR_CORRECTION_LEVELS))
+        parser.add_argument(
+            '--compress-levels', default=f'1,{QR_PNG_COMPRESS_LEVEL},9',
+            help='Уровни zlib для быстрого PNG через запятую',
+        )
+        parser.add_argument('--json', dest='json_path', help='Сохранить результаты в JSON')
+    
+    def handle(self, *args, **options):
+        payloads = sample_payloads(options['codes'])
+        size, border, level = options['size'], options['border'], options['error_correction']
+        
+        mismatches = sum(
+            1 for url in payloads[:200]
+            if qr_matrix(url, border, ERROR_CORRECTION_LEVELS[level]) != reference_matrix(url, border, level)
+        )
+        if mismatches:
+            self.stderr.write(f'Матрицы отличаются у {mismatches} кодов из {min(len(payloads), 200)}')
+        
+        results = [self.measure('reference', payloads, lambda url: reference_qr_code(url, size, border, level))]
+        for compress_level in [int(value) for value in options['compress_levels'].split(',') if value]:
+            results.append(self.measure(
+                f'fast z{compress_level}',
+                payloads,
+                lambda url: matrix_to_png(qr_matrix(url, border, ERROR_CORRECTION_LEVELS[level]), size, compress_level),
+            ))
+        
+        self.print_table(results)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, ensure_ascii=False, indent=2)
+    
+    def measure(self, mode, payloads, render):
+        render(payloads[0])
+        timings = []
+        sizes = []
+        for url in payloads:
+            started = time.perf_counter()
+            image = render(url)
+            timings.append(time.perf_counter() - started)
+            sizes.append(len(image.getvalue()))
+        return {
+            'mode': mode,
+            'codes': len(payloads),
+            'ms_per_code': statistics.mean(timings) * 1000,
+            'p99_ms': sorted(timings)[int(len(timings) * 0.99) - 1] * 1000 if len(timings) > 1 else timings[0] * 1000,
+            'bytes_per_code': statistics.mean(sizes),
+        }
+    
+    def print_table(self, results):
+        header = f"{'mode':<10} {'codes':>7} {'ms/code':>9} {'p99, ms':>9} {'bytes/code':>11}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<10} {row['codes']:>7} {row['ms_per_code']:>9.2f} {row['p99_ms']:>9.2f} "
+                f"{row['bytes_per_code']:>11.0f}"
+            )
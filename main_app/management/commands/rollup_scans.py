@@ -0,0 +1,30 @@
+"""
+Свертка журнала сканирований в итоги и очистка старых сканирований:
+python manage.py rollup_scans
+
+Воркер run_jobs делает то же самое раз в QR_SCAN_ROLLUP_INTERVAL секунд;
+команда нужна для запуска по cron без воркера и для ручного пересчета.
+"""
+from django.core.management.base import BaseCommand
+
+from main_app.models import QRScanRollupState
+from main_app.utils.scan_rollup import prune_scan_events, rollup_scans
+
+
+class Command(BaseCommand):
+    help = 'Свернуть журнал сканирований QR-кодов в почасовые и дневные итоги'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать итоги по всему хранимому журналу')
+        parser.add_argument('--no-prune', action='store_true', help='Не удалять сканирования старше срока хранения')
+    
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            QRScanRollupState.objects.filter(id=1).update(rolled_up_to=None)
+        
+        hours = rollup_scans()
+        self.stdout.write(f'Почасовых итогов пересчитано: {hours}')
+        
+        if not options['no_prune']:
+            deleted = prune_scan_events()
+            self.stdout.write(f'Удалено старых сканирований: {deleted}')
@@ -0,0 +1,92 @@
+"""
+Воркер фоновых задач: python manage.py run_jobs
+"""
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from main_app.jobs import claim_next_job, fail_stale_jobs, run_job
+from main_app.utils.bitrix_events import EVENT_POLL_INTERVAL, apply_pending_product_events
+from main_app.utils.qr_bulk import expire_bulk_outputs
+from main_app.utils.scan_rollup import QR_SCAN_ROLLUP_INTERVAL, prune_scan_events, rollup_scans
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Выполнять фоновые задачи из очереди BackgroundJob'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и завершиться')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Пауза между опросами пустой очереди, с')
+    
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        next_rollup = 0
+        
+        # События Битрикс24 по товарам применяются в отдельном потоке, чтобы
+        # каталог отставал на секунды даже во время долгой задачи
+        events_thread = None
+        if not options['once']:
+            events_thread = threading.Thread(target=self.drain_events, name='bitrix-events', daemon=True)
+            events_thread.start()
+        
+        while not self.stopping.is_set():
+            close_old_connections()
+            fail_stale_jobs()
+            
+            if options['once']:
+                self.apply_events()
+            
+            if time.monotonic() >= next_rollup:
+                next_rollup = time.monotonic() + QR_SCAN_ROLLUP_INTERVAL
+                try:
+                    rollup_scans()
+                    prune_scan_events()
+                except Exception:
+                    logger.exception("Ошибка свертки журнала сканирований")
+                try:
+                    expire_bulk_outputs()
+                except Exception:
+                    logger.exception("Ошибка удаления устаревших результатов массовой генерации")
+            
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                self.stopping.wait(options['sleep'])
+                continue
+            
+            self.stdout.write(f'Задача #{job.id} ({job.kind}) запущена')
+            job = run_job(job)
+            self.stdout.write(f'Задача #{job.id} завершена: {job.get_status_display()}')
+        
+        if events_thread is not None:
+            events_thread.join()
+    
+    def drain_events(self):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                self.apply_events()
+                self.stopping.wait(EVENT_POLL_INTERVAL)
+        finally:
+            connection.close()
+    
+    @staticmethod
+    def apply_events():
+        try:
+            apply_pending_product_events()
+        except Exception:
+            logger.exception("Ошибка применения событий Битрикс24 по товарам")
+    
+    def stop(self, signum, frame):
+        """Дождаться окончания текущей задачи и выйти"""
+        self.stopping.set()
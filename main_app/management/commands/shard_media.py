@@ -0,0 +1,73 @@
+"""
+Перенос медиафайлов из плоских каталогов qr_codes/ и products/ в шарды:
+python manage.py shard_media --batch-size 500
+
+Строки обходятся окнами по id, файлы копируются потоком через хранилище,
+ссылки в базе переписываются в транзакции окна, а старые файлы удаляются
+после ее фиксации. Повторный запуск продолжает с того же места: уже
+перенесенные имена пропускаются.
+"""
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_app.utils.media import MEDIA_REFERENCES, is_sharded, name_key, shard_name
+
+
+class Command(BaseCommand):
+    help = 'Перенести файлы QR-кодов и товаров в каталоги-шарды'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Сколько строк переносить за одну транзакцию')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, что будет перенесено')
+    
+    def handle(self, *args, **options):
+        for prefix, model_label, field in MEDIA_REFERENCES:
+            model = apps.get_model(model_label)
+            moved, missing = self.shard_field(model, field, prefix, options['batch_size'], options['dry_run'])
+            self.stdout.write(f'{model_label}.{field}: перенесено {moved}, файлов не найдено {missing}')
+    
+    def shard_field(self, model, field, prefix, batch_size, dry_run):
+        storage = model._meta.get_field(field).storage
+        has_digest = any(model_field.name == 'digest' for model_field in model._meta.fields)
+        columns = ['id', field] + (['digest'] if has_digest else [])
+        rows = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).order_by('id')
+        
+        moved = missing = 0
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id).values_list(*columns)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            
+            renames = {}
+            for row in batch:
+                name = row[1]
+                if is_sharded(name) or name in renames:
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                key = row[2] if has_digest else name_key(name)
+                renames[name] = shard_name(prefix, key, os.path.splitext(name)[1])
+            if dry_run or not renames:
+                moved += len(renames)
+                continue
+            
+            for old_name, new_name in renames.items():
+                # После сбоя между копированием и обновлением базы копия уже может лежать на месте
+                if not storage.exists(new_name):
+                    with storage.open(old_name) as source:
+                        renames[old_name] = storage.save(new_name, source)
+            
+            with transaction.atomic():
+                for old_name, new_name in renames.items():
+                    # Один файл может упоминаться в нескольких полях (QRImage и QRCodeLink)
+                    for _, other_label, other_field in MEDIA_REFERENCES:
+                        apps.get_model(other_label).objects.filter(**{other_field: old_name}).update(**{other_field: new_name})
+                transaction.on_commit(lambda names=list(renames): [storage.delete(name) for name in names])
+            moved += len(renames)
+        return moved, missing
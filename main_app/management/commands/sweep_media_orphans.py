@@ -0,0 +1,55 @@
+"""
+Удаление медиафайлов, на которые не ссылается ни одна строка базы:
+python manage.py sweep_media_orphans --dry-run
+
+Хранилище обходится генератором, имена сверяются с базой пачками, поэтому
+память не зависит от числа файлов. Свежие файлы не трогаются: они могут
+принадлежать транзакции, которая еще не зафиксирована.
+"""
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main_app.utils.media import MEDIA_REFERENCES, referenced_names, walk_storage
+
+
+class Command(BaseCommand):
+    help = 'Удалить файлы QR-кодов и товаров без ссылок из базы'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько имен сверять с базой за один запрос')
+        parser.add_argument('--min-age', type=int, default=24, help='Не удалять файлы моложе стольких часов')
+        parser.add_argument('--dry-run', action='store_true', help='Только вывести найденные файлы')
+    
+    def handle(self, *args, **options):
+        threshold = timezone.now() - timedelta(hours=options['min_age'])
+        scanned = removed = 0
+        for prefix in sorted({prefix for prefix, _, _ in MEDIA_REFERENCES}):
+            batch = []
+            for name in walk_storage(default_storage, prefix):
+                batch.append(name)
+                if len(batch) >= options['batch_size']:
+                    removed += self.sweep(batch, threshold, options['dry_run'])
+                    scanned += len(batch)
+                    batch = []
+            if batch:
+                removed += self.sweep(batch, threshold, options['dry_run'])
+                scanned += len(batch)
+        
+        action = 'Найдено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(f'Проверено файлов: {scanned}. {action} без ссылок: {removed}')
+    
+    def sweep(self, names, threshold, dry_run):
+        orphans = set(names) - referenced_names(names)
+        removed = 0
+        for name in sorted(orphans):
+            if default_storage.get_modified_time(name) > threshold:
+                continue
+            if dry_run:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            removed += 1
+        return removed
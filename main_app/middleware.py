@@ -0,0 +1,90 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+
+from .utils import metrics
+
+
+logger = logging.getLogger('main_app.slow_requests')
+
+# Имя URL для запросов, не сопоставленных ни одному маршруту
+UNMATCHED_VIEW = '<unmatched>'
+
+# Сам эндпоинт метрик не учитывается
+METRICS_VIEW = 'main_app:metrics'
+
+
+class PerformanceMiddleware:
+    """
+    Время запроса, SQL, шаблонов, Битрикс24 и QR-кодов по именам URL
+    (см. utils.metrics). При METRICS_SAMPLE_RATE = 0 исключается из цепочки.
+    """
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        if not metrics.METRICS_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = metrics.METRICS_SAMPLE_RATE
+        self.slow_seconds = (
+            metrics.METRICS_SLOW_REQUEST_MS / 1000 if metrics.METRICS_SLOW_REQUEST_MS is not None else None
+        )
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        metrics.install_query_timer()
+    
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        request_metrics, token = metrics.start_request(self.slow_seconds is not None)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, time.perf_counter() - started, request_metrics)
+        return response
+    
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        request_metrics, token = metrics.start_request(self.slow_seconds is not None)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        self.record(request, time.perf_counter() - started, request_metrics)
+        return response
+    
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+    
+    def record(self, request, elapsed, request_metrics):
+        match = request.resolver_match
+        view = match.view_name if match is not None else UNMATCHED_VIEW
+        if view == METRICS_VIEW:
+            return
+        metrics.registry.record(view, elapsed, request_metrics)
+        if self.slow_seconds is not None and elapsed >= self.slow_seconds:
+            self.log_slow(request, view, elapsed, request_metrics)
+    
+    def log_slow(self, request, view, elapsed, request_metrics):
+        sections = request_metrics.sections
+        lines = [
+            f'Медленный запрос {request.method} {request.path} ({view}): {elapsed * 1000:.0f} мс, '
+            f'SQL {request_metrics.queries} за {request_metrics.query_time * 1000:.0f} мс, '
+            f'шаблоны {sections["template"][1] * 1000:.0f} мс, '
+            f'Битрикс24 {sections["bitrix"][0]} за {sections["bitrix"][1] * 1000:.0f} мс, '
+            f'QR {sections["qr"][0]} за {sections["qr"][1] * 1000:.0f} мс'
+        ]
+        for seconds, count, sql in request_metrics.top_statements():
+            lines.append(f'  {seconds * 1000:.1f} мс, {count}x: {sql[:500]}')
+        logger.warning('\n'.join(lines))
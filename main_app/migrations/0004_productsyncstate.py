@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0003_remove_product_preview_image_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "portal_domain",
+                    models.CharField(
+                        max_length=255, unique=True, verbose_name="Домен портала"
+                    ),
+                ),
+                (
+                    "last_modified",
+                    models.DateTimeField(
+                        blank=True,
+                        null=True,
+                        verbose_name="Максимальный DATE_MODIFY последней синхронизации",
+                    ),
+                ),
+                (
+                    "last_synced_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Последняя синхронизация"
+                    ),
+                ),
+                (
+                    "last_reconciled_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Последняя сверка удаленных"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Состояние синхронизации",
+                "verbose_name_plural": "Состояния синхронизации",
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0005_backgroundjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                default="",
+                max_length=32,
+                verbose_name="Хеш синхронизированных полей",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0006_product_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingProductEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "portal_domain",
+                    models.CharField(max_length=255, verbose_name="Домен портала"),
+                ),
+                ("bitrix_id", models.IntegerField(verbose_name="ID в Битрикс24")),
+                (
+                    "event",
+                    models.CharField(
+                        choices=[
+                            ("ONCRMPRODUCTADD", "Товар добавлен"),
+                            ("ONCRMPRODUCTUPDATE", "Товар изменен"),
+                            ("ONCRMPRODUCTDELETE", "Товар удален"),
+                        ],
+                        max_length=32,
+                        verbose_name="Событие",
+                    ),
+                ),
+                ("received_at", models.DateTimeField(verbose_name="Время получения")),
+            ],
+            options={
+                "verbose_name": "Событие по товару",
+                "verbose_name_plural": "События по товарам",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="pendingproductevent",
+            constraint=models.UniqueConstraint(
+                fields=("portal_domain", "bitrix_id"),
+                name="main_app_product_event_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:44
+
+import base64
+import struct
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+# Копия формата компактного токена версии 1 на момент миграции (main_app.utils.signer),
+# чтобы последующие изменения модуля не меняли результат миграции
+COMPACT_TOKEN_HEADER = 1 << 4 | 1
+COMPACT_TOKEN_PAYLOAD = struct.Struct(">BII")
+COMPACT_TOKEN_MAC_SIZE = 6
+
+
+def compact_token(qr_link_id, issued_at):
+    payload = COMPACT_TOKEN_PAYLOAD.pack(
+        COMPACT_TOKEN_HEADER, qr_link_id, int(issued_at.timestamp())
+    )
+    mac = salted_hmac(
+        "main_app.compact_token",
+        payload,
+        secret=settings.SECRET_KEY,
+        algorithm="sha256",
+    ).digest()[:COMPACT_TOKEN_MAC_SIZE]
+    return base64.urlsafe_b64encode(payload + mac).decode("ascii")
+
+
+def issue_compact_tokens(apps, schema_editor):
+    """Перенести старые токены в legacy_token и выпустить всем ссылкам компактные"""
+    QRCodeLink = apps.get_model("main_app", "QRCodeLink")
+    last_id = 0
+    while True:
+        links = list(
+            QRCodeLink.objects.filter(id__gt=last_id, legacy_token__isnull=True)
+            .only("id", "signed_token", "created_at")
+            .order_by("id")[:1000]
+        )
+        if not links:
+            break
+        for link in links:
+            link.legacy_token = link.signed_token
+            link.signed_token = compact_token(link.id, link.created_at)
+        QRCodeLink.objects.bulk_update(links, ["legacy_token", "signed_token"])
+        last_id = links[-1].id
+
+
+def restore_legacy_tokens(apps, schema_editor):
+    QRCodeLink = apps.get_model("main_app", "QRCodeLink")
+    QRCodeLink.objects.filter(legacy_token__isnull=False).update(
+        signed_token=models.F("legacy_token")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0007_pendingproductevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="qrcodelink",
+            name="legacy_token",
+            field=models.TextField(
+                blank=True,
+                help_text="Длинный токен TimestampSigner, выданный до перехода на компактные токены",
+                null=True,
+                unique=True,
+                verbose_name="Токен старого формата",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="qrcodelink",
+            name="signed_token",
+            field=models.TextField(
+                blank=True,
+                null=True,
+                unique=True,
+                verbose_name="Подписанный токен",
+            ),
+        ),
+        migrations.RunPython(issue_compact_tokens, restore_legacy_tokens),
+        migrations.AlterField(
+            model_name="qrcodelink",
+            name="signed_token",
+            field=models.CharField(
+                blank=True,
+                max_length=32,
+                null=True,
+                unique=True,
+                verbose_name="Подписанный токен",
+            ),
+        ),
+    ]
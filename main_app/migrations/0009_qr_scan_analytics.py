@@ -0,0 +1,193 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0008_compact_qr_tokens"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QRScanRollupState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "rolled_up_to",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Часы начиная с этого пересчитываются при следующем запуске rollup_scans",
+                        null=True,
+                        verbose_name="Свернуто до",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Дата обновления"),
+                ),
+            ],
+            options={
+                "verbose_name": "Состояние свертки сканирований",
+                "verbose_name_plural": "Состояние свертки сканирований",
+            },
+        ),
+        migrations.CreateModel(
+            name="QRScanEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "scanned_at",
+                    models.DateTimeField(
+                        db_index=True, verbose_name="Время сканирования"
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="main_app.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "qr_link",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="scan_events",
+                        to="main_app.qrcodelink",
+                        verbose_name="QR-ссылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сканирование QR-кода",
+                "verbose_name_plural": "Сканирования QR-кодов",
+            },
+        ),
+        migrations.CreateModel(
+            name="QRScanDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="День")),
+                (
+                    "count",
+                    models.PositiveIntegerField(default=0, verbose_name="Сканирований"),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="main_app.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "qr_link",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="scan_daily",
+                        to="main_app.qrcodelink",
+                        verbose_name="QR-ссылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сканирования за день",
+                "verbose_name_plural": "Сканирования по дням",
+            },
+        ),
+        migrations.CreateModel(
+            name="QRScanHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(verbose_name="Час")),
+                (
+                    "count",
+                    models.PositiveIntegerField(default=0, verbose_name="Сканирований"),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="main_app.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "qr_link",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="scan_hourly",
+                        to="main_app.qrcodelink",
+                        verbose_name="QR-ссылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Сканирования за час",
+                "verbose_name_plural": "Сканирования по часам",
+                "indexes": [
+                    models.Index(
+                        fields=["product", "hour"], name="main_app_scan_hourly_prod_idx"
+                    ),
+                    models.Index(fields=["hour"], name="main_app_scan_hourly_hour_idx"),
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="qrscanhourly",
+            constraint=models.UniqueConstraint(
+                fields=("qr_link", "hour"), name="main_app_scan_hourly_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="qrscandaily",
+            index=models.Index(
+                fields=["product", "day"], name="main_app_scan_daily_prod_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="qrscandaily",
+            constraint=models.UniqueConstraint(
+                fields=("qr_link", "day"), name="main_app_scan_daily_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0009_qr_scan_analytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QRScanSketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="День")),
+                ("registers", models.BinaryField(verbose_name="Регистры HyperLogLog")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="main_app.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "qr_link",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="scan_sketches",
+                        to="main_app.qrcodelink",
+                        verbose_name="QR-ссылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Уникальные посетители за день",
+                "verbose_name_plural": "Уникальные посетители по дням",
+                "indexes": [
+                    models.Index(
+                        fields=["product", "day"], name="main_app_scan_sketch_prod_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="qrscansketch",
+            constraint=models.UniqueConstraint(
+                fields=("qr_link", "day"), name="main_app_scan_sketch_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0010_qrscansketch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QRImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        max_length=64, unique=True, verbose_name="Хеш параметров"
+                    ),
+                ),
+                (
+                    "image",
+                    models.ImageField(
+                        upload_to="qr_codes/", verbose_name="Изображение"
+                    ),
+                ),
+                (
+                    "ref_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Количество ссылок"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Изображение QR-кода",
+                "verbose_name_plural": "Изображения QR-кодов",
+            },
+        ),
+        migrations.AddField(
+            model_name="qrcodelink",
+            name="qr_image",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Общий файл из хранилища QRImage; qr_code_image указывает на тот же файл",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="qr_links",
+                to="main_app.qrimage",
+                verbose_name="Файл QR-кода",
+            ),
+        ),
+    ]
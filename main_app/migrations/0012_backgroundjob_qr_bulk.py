@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0011_qrimage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="backgroundjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("product_sync", "Синхронизация товаров"),
+                    ("qr_bulk", "Массовая генерация QR-кодов"),
+                ],
+                max_length=32,
+                verbose_name="Тип задачи",
+            ),
+        ),
+    ]
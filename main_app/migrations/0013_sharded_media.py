@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:04
+
+from django.db import migrations, models
+import main_app.utils.media
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0012_backgroundjob_qr_bulk"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="detail_image",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to=main_app.utils.media.ShardedUploadTo("products"),
+                verbose_name="Изображение товара",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="qrcodelink",
+            name="qr_code_image",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                upload_to=main_app.utils.media.ShardedUploadTo("qr_codes"),
+                verbose_name="Изображение QR-кода",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="qrimage",
+            name="image",
+            field=models.ImageField(
+                upload_to=main_app.utils.media.ShardedUploadTo("qr_codes"),
+                verbose_name="Изображение",
+            ),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:20
+
+from django.db import migrations
+
+TRGM_INDEXES = [
+    ("main_app_product_name_trgm", "name"),
+    ("main_app_product_description_trgm", "description"),
+]
+
+
+def create_trgm_indexes(apps, schema_editor):
+    """GIN-индексы pg_trgm для поиска товаров; на других базах поиск идет по индексу в памяти"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in TRGM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON main_app_product "
+            f"USING gin ({column} gin_trgm_ops)"
+        )
+
+
+def drop_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRGM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0013_sharded_media"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trgm_indexes, drop_trgm_indexes),
+    ]
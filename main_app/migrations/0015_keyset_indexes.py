@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0014_product_search_trgm"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["sort_order", "name", "id"], name="main_app_product_keyset_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="qrcodelink",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="main_app_qrlink_keyset_idx"
+            ),
+        ),
+    ]
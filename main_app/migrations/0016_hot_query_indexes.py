@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+# icontains на PostgreSQL - это UPPER(col::text) LIKE UPPER(%s); без индекса по тому же
+# выражению условие поиска товаров уходит в последовательное сканирование
+UPPER_TRGM_INDEXES = [
+    ("main_app_product_name_upper_trgm", "name"),
+    ("main_app_product_description_upper_trgm", "description"),
+]
+
+
+def create_upper_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in UPPER_TRGM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON main_app_product "
+            f"USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+        )
+
+
+def drop_upper_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in UPPER_TRGM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0015_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="product",
+            name="main_app_product_keyset_idx",
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["is_active", "sort_order", "name", "id"],
+                name="main_app_product_active_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="qrcodelink",
+            index=models.Index(
+                fields=["product", "is_active"], name="main_app_qrlink_product_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="qrcodelink",
+            index=models.Index(
+                fields=["expires_at"], name="main_app_qrlink_expires_idx"
+            ),
+        ),
+        migrations.RunPython(create_upper_trgm_indexes, drop_upper_trgm_indexes),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_app", "0016_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogGeneration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "generation",
+                    models.PositiveBigIntegerField(default=0, verbose_name="Поколение"),
+                ),
+            ],
+            options={
+                "verbose_name": "Поколение каталога",
+                "verbose_name_plural": "Поколение каталога",
+            },
+        ),
+    ]
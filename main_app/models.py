@@ -3,6 +3,8 @@ from django.utils import timezone
 from django.core.validators import MinValueValidator
 import uuid
 
+from .utils.media import PRODUCTS_PREFIX, QR_CODES_PREFIX, ShardedUploadTo
+
 
 class Product(models.Model):
     """Модель товара, синхронизированная с Битрикс24"""
@@ -22,12 +24,18 @@ class Product(models.Model):
     # Дополнительные поля
     photo_url = models.URLField(blank=True, null=True, verbose_name="URL фото")
     detail_image = models.ImageField(
-        upload_to='products/', 
+        upload_to=ShardedUploadTo(PRODUCTS_PREFIX),
         blank=True, 
         null=True,
         verbose_name="Изображение товара"
     )
     sort_order = models.IntegerField(default=500, verbose_name="Порядок сортировки")
+    content_hash = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        verbose_name="Хеш синхронизированных полей"
+    )
     
     # Метаданные
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
@@ -38,11 +46,37 @@ class Product(models.Model):
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ['sort_order', 'name']
+        indexes = [
+            # Каталог: активные товары постранично по ключу (sort_order, name, id)
+            models.Index(fields=['is_active', 'sort_order', 'name', 'id'], name='main_app_product_active_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} (ID: {self.bitrix_id})"
 
 
+class QRImage(models.Model):
+    """
+    Файл QR-кода, адресуемый по содержимому.
+    
+    digest - хеш параметров отрисовки (данные, размер модуля, рамка, уровень
+    коррекции, формат), поэтому одинаковый QR-код рисуется и хранится один раз.
+    ref_count - число QR-ссылок, использующих файл.
+    """
+    
+    digest = models.CharField(max_length=64, unique=True, verbose_name="Хеш параметров")
+    image = models.ImageField(upload_to=ShardedUploadTo(QR_CODES_PREFIX), verbose_name="Изображение")
+    ref_count = models.PositiveIntegerField(default=0, verbose_name="Количество ссылок")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    
+    class Meta:
+        verbose_name = "Изображение QR-кода"
+        verbose_name_plural = "Изображения QR-кодов"
+    
+    def __str__(self):
+        return self.image.name
+
+
 class QRCodeLink(models.Model):
     """Модель для отслеживания сгенерированных QR-ссылок"""
     
@@ -55,13 +89,35 @@ class QRCodeLink(models.Model):
     )
     
     # Данные ссылки
-    signed_token = models.TextField(unique=True, verbose_name="Подписанный токен")
+    signed_token = models.CharField(
+        max_length=32,
+        unique=True,
+        blank=True,
+        null=True,
+        verbose_name="Подписанный токен"
+    )
+    legacy_token = models.TextField(
+        unique=True,
+        blank=True,
+        null=True,
+        verbose_name="Токен старого формата",
+        help_text="Длинный токен TimestampSigner, выданный до перехода на компактные токены"
+    )
     qr_code_image = models.ImageField(
-        upload_to='qr_codes/', 
+        upload_to=ShardedUploadTo(QR_CODES_PREFIX),
         blank=True, 
         null=True,
         verbose_name="Изображение QR-кода"
     )
+    qr_image = models.ForeignKey(
+        QRImage,
+        on_delete=models.PROTECT,
+        related_name='qr_links',
+        blank=True,
+        null=True,
+        verbose_name="Файл QR-кода",
+        help_text="Общий файл из хранилища QRImage; qr_code_image указывает на тот же файл"
+    )
     
     # Статистика использования
     access_count = models.PositiveIntegerField(default=0, verbose_name="Количество обращений")
@@ -76,18 +132,315 @@ class QRCodeLink(models.Model):
         verbose_name = "QR-ссылка"
         verbose_name_plural = "QR-ссылки"
         ordering = ['-created_at']
+        indexes = [
+            # Постраничный вывод списка QR-кодов по ключу (-created_at, -id)
+            models.Index(fields=['-created_at', '-id'], name='main_app_qrlink_keyset_idx'),
+            # Ссылки товара (активные - для публичной страницы и статистики товара)
+            models.Index(fields=['product', 'is_active'], name='main_app_qrlink_product_idx'),
+            models.Index(fields=['expires_at'], name='main_app_qrlink_expires_idx'),
+        ]
     
     def __str__(self):
         return f"QR для {self.product.name} (создана: {self.created_at.strftime('%d.%m.%Y %H:%M')})"
     
     def increment_access(self):
-        """Увеличить счетчик обращений"""
+        """
+        Увеличить счетчик обращений атомарным UPDATE, не теряя параллельные обращения.
+        Публичная страница использует буфер utils.scan_buffer.scan_counter.
+        """
+        now = timezone.now()
+        QRCodeLink.objects.filter(pk=self.pk).update(access_count=models.F('access_count') + 1, last_accessed=now)
         self.access_count += 1
-        self.last_accessed = timezone.now()
-        self.save(update_fields=['access_count', 'last_accessed'])
+        self.last_accessed = now
     
     def is_expired(self):
         """Проверить, истекла ли ссылка"""
         if not self.expires_at:
             return False
         return timezone.now() > self.expires_at
+
+
+class ProductSyncState(models.Model):
+    """Состояние инкрементальной синхронизации товаров для портала Битрикс24"""
+    
+    portal_domain = models.CharField(max_length=255, unique=True, verbose_name="Домен портала")
+    last_modified = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Максимальный DATE_MODIFY последней синхронизации"
+    )
+    last_synced_at = models.DateTimeField(blank=True, null=True, verbose_name="Последняя синхронизация")
+    last_reconciled_at = models.DateTimeField(blank=True, null=True, verbose_name="Последняя сверка удаленных")
+    
+    class Meta:
+        verbose_name = "Состояние синхронизации"
+        verbose_name_plural = "Состояния синхронизации"
+    
+    def __str__(self):
+        return f"Синхронизация {self.portal_domain}"
+
+
+class CatalogGeneration(models.Model):
+    """
+    Поколение каталога товаров: одна строка, счетчик растет при каждом
+    изменении товаров. По нему ключуются кеш и ETag автокомплита, поэтому
+    он хранится в базе и виден всем процессам (веб-воркерам и run_jobs).
+    """
+    
+    generation = models.PositiveBigIntegerField(default=0, verbose_name="Поколение")
+    
+    class Meta:
+        verbose_name = "Поколение каталога"
+        verbose_name_plural = "Поколение каталога"
+    
+    def __str__(self):
+        return f"Поколение каталога {self.generation}"
+
+
+class BackgroundJob(models.Model):
+    """Фоновая задача, которую выполняет воркер manage.py run_jobs"""
+    
+    KIND_PRODUCT_SYNC = 'product_sync'
+    KIND_QR_BULK = 'qr_bulk'
+    KIND_CHOICES = [
+        (KIND_PRODUCT_SYNC, 'Синхронизация товаров'),
+        (KIND_QR_BULK, 'Массовая генерация QR-кодов'),
+    ]
+    
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершена'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+    
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES, verbose_name="Тип задачи")
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+        verbose_name="Статус"
+    )
+    lock_key = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        verbose_name="Ключ блокировки",
+        help_text="Одновременно может быть только одна активная задача с таким ключом"
+    )
+    user_token = models.ForeignKey(
+        'bitrix24.BitrixUserToken',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='+',
+        verbose_name="Токен пользователя"
+    )
+    params = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    progress = models.JSONField(default=dict, blank=True, verbose_name="Прогресс")
+    error = models.TextField(blank=True, null=True, verbose_name="Ошибка")
+    
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Начало выполнения")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Окончание выполнения")
+    heartbeat_at = models.DateTimeField(blank=True, null=True, verbose_name="Последний сигнал воркера")
+    
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='main_app_job_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['lock_key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='main_app_job_single_active_lock',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.get_status_display()})"
+    
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+
+class PendingProductEvent(models.Model):
+    """
+    Необработанное событие Битрикс24 по товару.
+    
+    На один товар хранится одна строка, поэтому серия событий по одному ID
+    схлопывается в последнее из них.
+    """
+    
+    EVENT_ADD = 'ONCRMPRODUCTADD'
+    EVENT_UPDATE = 'ONCRMPRODUCTUPDATE'
+    EVENT_DELETE = 'ONCRMPRODUCTDELETE'
+    EVENT_CHOICES = [
+        (EVENT_ADD, 'Товар добавлен'),
+        (EVENT_UPDATE, 'Товар изменен'),
+        (EVENT_DELETE, 'Товар удален'),
+    ]
+    
+    portal_domain = models.CharField(max_length=255, verbose_name="Домен портала")
+    bitrix_id = models.IntegerField(verbose_name="ID в Битрикс24")
+    event = models.CharField(max_length=32, choices=EVENT_CHOICES, verbose_name="Событие")
+    received_at = models.DateTimeField(verbose_name="Время получения")
+    
+    class Meta:
+        verbose_name = "Событие по товару"
+        verbose_name_plural = "События по товарам"
+        constraints = [
+            models.UniqueConstraint(fields=['portal_domain', 'bitrix_id'], name='main_app_product_event_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event} {self.bitrix_id} ({self.portal_domain})"
+
+
+class QRScanEvent(models.Model):
+    """
+    Одно сканирование QR-ссылки (журнал только на добавление).
+    
+    Пишется пачками из буфера utils.scan_buffer, сворачивается в QRScanHourly
+    и QRScanDaily и удаляется после QR_SCAN_EVENT_RETENTION_DAYS.
+    """
+    
+    qr_link = models.ForeignKey(
+        QRCodeLink,
+        on_delete=models.CASCADE,
+        related_name='scan_events',
+        verbose_name="QR-ссылка"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    scanned_at = models.DateTimeField(db_index=True, verbose_name="Время сканирования")
+    
+    class Meta:
+        verbose_name = "Сканирование QR-кода"
+        verbose_name_plural = "Сканирования QR-кодов"
+    
+    def __str__(self):
+        return f"Скан ссылки #{self.qr_link_id} в {self.scanned_at}"
+
+
+class QRScanHourly(models.Model):
+    """Число сканирований QR-ссылки за час"""
+    
+    qr_link = models.ForeignKey(
+        QRCodeLink,
+        on_delete=models.CASCADE,
+        related_name='scan_hourly',
+        verbose_name="QR-ссылка"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    hour = models.DateTimeField(verbose_name="Час")
+    count = models.PositiveIntegerField(default=0, verbose_name="Сканирований")
+    
+    class Meta:
+        verbose_name = "Сканирования за час"
+        verbose_name_plural = "Сканирования по часам"
+        constraints = [
+            models.UniqueConstraint(fields=['qr_link', 'hour'], name='main_app_scan_hourly_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'hour'], name='main_app_scan_hourly_prod_idx'),
+            models.Index(fields=['hour'], name='main_app_scan_hourly_hour_idx'),
+        ]
+
+
+class QRScanDaily(models.Model):
+    """Число сканирований QR-ссылки за день (по TIME_ZONE проекта)"""
+    
+    qr_link = models.ForeignKey(
+        QRCodeLink,
+        on_delete=models.CASCADE,
+        related_name='scan_daily',
+        verbose_name="QR-ссылка"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    day = models.DateField(verbose_name="День")
+    count = models.PositiveIntegerField(default=0, verbose_name="Сканирований")
+    
+    class Meta:
+        verbose_name = "Сканирования за день"
+        verbose_name_plural = "Сканирования по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['qr_link', 'day'], name='main_app_scan_daily_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='main_app_scan_daily_prod_idx'),
+        ]
+
+
+class QRScanRollupState(models.Model):
+    """Докуда журнал сканирований уже свернут в почасовые и дневные итоги (одна строка)"""
+    
+    rolled_up_to = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Свернуто до",
+        help_text="Часы начиная с этого пересчитываются при следующем запуске rollup_scans"
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    
+    class Meta:
+        verbose_name = "Состояние свертки сканирований"
+        verbose_name_plural = "Состояние свертки сканирований"
+
+
+class QRScanSketch(models.Model):
+    """
+    Скетч HyperLogLog уникальных посетителей QR-ссылки за день.
+    
+    Посетители не хранятся: в скетч попадает только соленый хеш, а скетчи за
+    несколько дней или всех ссылок товара объединяются без сырых данных
+    (см. utils.visitors).
+    """
+    
+    qr_link = models.ForeignKey(
+        QRCodeLink,
+        on_delete=models.CASCADE,
+        related_name='scan_sketches',
+        verbose_name="QR-ссылка"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Товар"
+    )
+    day = models.DateField(verbose_name="День")
+    registers = models.BinaryField(verbose_name="Регистры HyperLogLog")
+    
+    class Meta:
+        verbose_name = "Уникальные посетители за день"
+        verbose_name_plural = "Уникальные посетители по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['qr_link', 'day'], name='main_app_scan_sketch_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'day'], name='main_app_scan_sketch_prod_idx'),
+        ]
@@ -0,0 +1,47 @@
+"""
+Обработчики сигналов: сброс кешей при изменении товаров и QR-ссылок, освобождение файлов
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, QRCodeLink
+from .signals import products_changed
+from .utils.media import delete_file_on_commit
+from .utils.qr_store import release_qr_image
+from .utils.search_cache import bump_catalog_generation
+from .utils.token_cache import token_cache
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_saved(sender, instance, **kwargs):
+    token_cache.invalidate_products([instance.id])
+    transaction.on_commit(bump_catalog_generation)
+
+
+# Поколение каталога растет после фиксации, иначе автокомплит успеет закешировать старые данные под новым номером
+@receiver(products_changed)
+def products_synced(sender, bitrix_ids, **kwargs):
+    product_ids = Product.objects.filter(bitrix_id__in=bitrix_ids).values_list('id', flat=True)
+    token_cache.invalidate_products(list(product_ids))
+    transaction.on_commit(bump_catalog_generation)
+
+
+@receiver([post_save, post_delete], sender=QRCodeLink)
+def qr_link_saved(sender, instance, **kwargs):
+    token_cache.invalidate_links([instance.id])
+
+
+@receiver(post_delete, sender=QRCodeLink)
+def qr_link_deleted(sender, instance, **kwargs):
+    if instance.qr_image_id:
+        release_qr_image(instance.qr_image_id)
+    elif instance.qr_code_image:
+        # Собственный файл ссылки, созданный до общего хранилища QRImage
+        delete_file_on_commit(instance.qr_code_image.storage, instance.qr_code_image.name)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    if instance.detail_image:
+        delete_file_on_commit(instance.detail_image.storage, instance.detail_image.name)
@@ -0,0 +1,9 @@
+"""
+Сигналы приложения main_app
+"""
+from django.dispatch import Signal
+
+
+# Товары изменились вне обычного save() (синхронизация, события Битрикс24).
+# Аргументы: bitrix_ids - список ID товаров в Битрикс24.
+products_changed = Signal()
@@ -0,0 +1,26 @@
+from django import template
+from django.utils.html import format_html
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def sparkline(values, width=120, height=24, color='#0d6efd'):
+    """Мини-график ряда значений в виде inline SVG"""
+    values = list(values or [])
+    if not values:
+        return ''
+    
+    top = max(values) or 1
+    step = width / max(len(values) - 1, 1)
+    points = ' '.join(
+        f'{index * step:.1f},{height - 1 - value / top * (height - 2):.1f}'
+        for index, value in enumerate(values)
+    )
+    return format_html(
+        '<svg class="sparkline" width="{}" height="{}" viewBox="0 0 {} {}" role="img">'
+        '<title>Всего: {}, максимум: {}</title>'
+        '<polyline fill="none" stroke="{}" stroke-width="1.5" points="{}"/></svg>',
+        width, height, width, height, sum(values), max(values), color, points,
+    )
@@ -1,3 +1,1010 @@
-from django.test import TestCase
+"""
+Регрессионные тесты горячих запросов: число SQL-запросов на представление и
+планы запросов (индексы вместо последовательного сканирования). Дальше -
+тесты поведения отдельных механизмов, по классу на механизм.
 
-# Create your tests here.
+Данные - синтетический каталог из нескольких тысяч товаров и QR-ссылок.
+Проверки планов выполняются только на PostgreSQL: запросы представления
+перехватываются и прогоняются через EXPLAIN с enable_seqscan = off, так что
+последовательное сканирование в плане означает, что ни один индекс не
+подходит для запроса.
+"""
+import base64
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import factory
+import qrcode
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import jobs, views
+from .jobs import JOB_STALE_AFTER, claim_next_job, enqueue_job, fail_stale_jobs, product_sync_lock_key
+from .middleware import PerformanceMiddleware
+from .models import BackgroundJob, CatalogGeneration, PendingProductEvent, Product, ProductSyncState, QRCodeLink, QRImage
+from .signals import products_changed
+from .utils import metrics, qr_bulk, visitors
+from .utils.bitrix_api import BitrixBatch, BitrixBatchError, BitrixProductService, BitrixRestClient
+from .utils.bitrix_events import EVENT_COALESCE_WINDOW, apply_pending_product_events
+from .utils.bitrix_fake import FakeBitrixPortal
+from .utils.hll import HLL_REGISTERS, HyperLogLog, merge_all
+from .utils.media import MEDIA_REFERENCES, QR_CODES_PREFIX, is_sharded, shard_name
+from .utils.pagination import CURSOR_SALT, KeysetPaginator
+from .utils.product_search import product_index, search_products
+from .utils.qr_encoder import qr_matrix
+from .utils.qr_generator import ERROR_CORRECTION_LEVELS, generate_product_qr_url
+from .utils.qr_render import render_cache
+from .utils.qr_store import acquire_qr_image
+from .utils.scan_buffer import ScanCounterBuffer
+from .utils.search_cache import _generation, bump_catalog_generation, catalog_generation
+from .utils.signer import COMPACT_TOKEN_PAYLOAD, TokenSigner, signer
+from .utils.token_cache import token_cache
+
+
+PRODUCTS = 3000
+QR_LINKS = 6000
+
+# Таблицы, по которым горячие запросы не должны идти последовательным сканированием
+HOT_TABLES = ['main_app_product', 'main_app_qrcodelink']
+
+
+class ProductFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Product
+    
+    bitrix_id = factory.Sequence(lambda n: n + 1)
+    name = factory.Sequence(lambda n: f'Товар {n} {["телефон", "чехол", "кабель", "наушники"][n % 4]}')
+    description = factory.Sequence(lambda n: f'Описание товара {n}' if n % 3 else '')
+    price = factory.Sequence(lambda n: n % 1000 + 1)
+    sort_order = factory.Sequence(lambda n: [100, 500, 900][n % 3])
+    is_active = factory.Sequence(lambda n: n % 10 != 0)
+
+
+class QRCodeLinkFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = QRCodeLink
+    
+    product = factory.SubFactory(ProductFactory)
+    is_active = factory.Sequence(lambda n: n % 7 != 0)
+
+
+def undecorated(view):
+    """Представление без main_auth: авторизация Битрикс24 в тестах не нужна"""
+    return inspect.unwrap(view)
+
+
+def bitrix_user_token():
+    return SimpleNamespace(user=SimpleNamespace(portal=SimpleNamespace(domain='test.bitrix24.ru')))
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class HotQueryTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        products = Product.objects.bulk_create(ProductFactory.build_batch(PRODUCTS))
+        links = QRCodeLink.objects.bulk_create([
+            QRCodeLinkFactory.build(product=products[index % len(products)]) for index in range(QR_LINKS)
+        ])
+        for link in links:
+            link.signed_token = signer.create_link_token(link.id)
+        QRCodeLink.objects.bulk_update(links, ['signed_token'], batch_size=1000)
+        # Активная ссылка на опубликованный товар: состояние фабрик зависит от порядка тестов
+        cls.link = next(link for link in reversed(links) if link.is_active and link.product.is_active)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {", ".join(HOT_TABLES)}')
+    
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+        token_cache.clear()
+        product_index.clear()
+        _generation.clear()
+    
+    def get(self, path, data=None):
+        request = self.factory.get(path, data or {})
+        request.bitrix_user_token = bitrix_user_token()
+        return request
+    
+    def capture(self, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = func(*args, **kwargs)
+        self.assertIn(response.status_code, (200, 304))
+        return response, [query['sql'] for query in context.captured_queries]
+    
+    def assertUsesIndexes(self, queries):
+        """Ни один SELECT по горячим таблицам не должен требовать последовательного сканирования"""
+        checked = 0
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                for sql in queries:
+                    if not sql.startswith('SELECT') or not any(table in sql for table in HOT_TABLES):
+                        continue
+                    cursor.execute(f'EXPLAIN {sql}')
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    for table in HOT_TABLES:
+                        self.assertNotIn(f'Seq Scan on {table}', plan, f'{sql}\n\n{plan}')
+                    checked += 1
+            finally:
+                cursor.execute('RESET enable_seqscan')
+        self.assertTrue(checked, 'Представление не выполнило ни одного запроса к горячим таблицам')
+
+
+class ProductListTests(HotQueryTestCase):
+
+    def test_query_count(self):
+        view = undecorated(views.product_list)
+        # Страница товаров, оценка общего числа, последняя задача синхронизации
+        with self.assertNumQueries(3):
+            response = view(self.get('/'))
+        self.assertContains(response, 'Следующая')
+    
+    def test_deep_page_query_count(self):
+        view = undecorated(views.product_list)
+        paginator = views.KeysetPaginator(
+            Product.objects.filter(is_active=True), views.PRODUCT_LIST_ORDERING, 20,
+        )
+        cursor = paginator.last_cursor()
+        with self.assertNumQueries(3):
+            view(self.get('/', {'cursor': cursor}))
+    
+    def test_search_query_count(self):
+        view = undecorated(views.product_list)
+        # Без PostgreSQL добавляются проверка актуальности и построение индекса триграмм
+        expected = 3 if connection.vendor == 'postgresql' else 5
+        with self.assertNumQueries(expected):
+            view(self.get('/', {'search_type': 'name', 'search_query': 'телефон'}))
+    
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_uses_indexes(self):
+        view = undecorated(views.product_list)
+        _, queries = self.capture(view, self.get('/'))
+        self.assertUsesIndexes(queries)
+        _, queries = self.capture(view, self.get('/', {'search_type': 'name', 'search_query': 'телфон'}))
+        self.assertUsesIndexes(queries)
+
+
+class QRListTests(HotQueryTestCase):
+
+    def test_query_count(self):
+        view = undecorated(views.qr_list)
+        # Страница ссылок вместе с товарами, дневная статистика, оценка общего числа
+        with self.assertNumQueries(3):
+            response = view(self.get('/'))
+        self.assertContains(response, 'Следующая')
+    
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_uses_indexes(self):
+        _, queries = self.capture(undecorated(views.qr_list), self.get('/'))
+        self.assertUsesIndexes(queries)
+
+
+@mock.patch.object(views.scan_counter, 'record')
+class ProductViewByTokenTests(HotQueryTestCase):
+
+    def test_query_count(self, record):
+        request = self.get('/')
+        # Ссылка вместе с товаром одним запросом, затем товар для отрисовки страницы
+        with self.assertNumQueries(2):
+            views.product_view_by_token(request, self.link.signed_token)
+        record.assert_called_once()
+        
+        # Повторное сканирование: токен и страница уже в кеше, база не нужна
+        with self.assertNumQueries(0):
+            views.product_view_by_token(self.get('/'), self.link.signed_token)
+    
+    def test_expired_link_not_found(self, record):
+        link = QRCodeLinkFactory(product=self.link.product, is_active=True, expires_at=timezone.now())
+        link.signed_token = signer.create_link_token(link.id)
+        link.save(update_fields=['signed_token'])
+        with self.assertRaises(Http404):
+            views.product_view_by_token(self.get('/'), link.signed_token)
+        record.assert_not_called()
+        
+        # Истекшая ссылка остается в кеше токенов, повторное сканирование не идет в базу
+        with self.assertNumQueries(0), self.assertRaises(Http404):
+            views.product_view_by_token(self.get('/'), link.signed_token)
+    
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_uses_indexes(self, record):
+        _, queries = self.capture(views.product_view_by_token, self.get('/'), self.link.signed_token)
+        self.assertUsesIndexes(queries)
+
+
+@mock.patch.object(_generation, 'ttl', None)
+class ProductSearchAPITests(HotQueryTestCase):
+
+    def search(self, query):
+        return views.ProductSearchAPI.as_view()(self.get(reverse('main_app:product_search_api'), {'q': query}))
+    
+    def test_query_count(self):
+        # Поколение каталога, затем сам поиск
+        expected = 2 if connection.vendor == 'postgresql' else 4
+        with self.assertNumQueries(expected):
+            response = self.search('теле')
+        self.assertTrue(response.content)
+        
+        # Повторный запрос (в том числе в другом регистре) отдается из кеша
+        with self.assertNumQueries(0):
+            self.search('теле')
+            self.search('ТЕЛЕ ')
+    
+    async def test_async_view_matches_sync(self):
+        request = self.get(reverse('main_app:product_search_api'), {'q': 'наушн'})
+        response = await views.AsyncProductSearchAPI.as_view()(request)
+        _generation.clear()
+        await sync_to_async(cache.clear)()
+        self.assertEqual(response.content, (await sync_to_async(self.search)('наушн')).content)
+        self.assertEqual(response['ETag'], (await sync_to_async(self.search)('наушн'))['ETag'])
+    
+    def test_generation_shared_through_database(self):
+        etag = self.search('теле')['ETag']
+        
+        # Изменение каталога в другом процессе видно, когда истекает память процесса
+        bump_catalog_generation()
+        generation = catalog_generation()
+        CatalogGeneration.objects.update(generation=generation + 1)
+        self.assertEqual(catalog_generation(), generation)
+        _generation.clear()
+        self.assertEqual(catalog_generation(), generation + 1)
+        self.assertNotEqual(self.search('теле')['ETag'], etag)
+    
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется только на PostgreSQL')
+    def test_uses_indexes(self):
+        _, queries = self.capture(self.search, 'наушнки')
+        self.assertUsesIndexes(queries)
+
+
+class ScanCounterBufferTests(TestCase):
+
+    def setUp(self):
+        self.link = QRCodeLinkFactory(signed_token='token')
+        self.buffer = ScanCounterBuffer()
+        # Без фонового потока: сброс вызывается тестом
+        self.buffer.pid = os.getpid()
+    
+    def test_flush_adds_to_stored_counter(self):
+        QRCodeLink.objects.filter(id=self.link.id).update(access_count=5)
+        when = timezone.now()
+        self.buffer.record(self.link.id, when - timedelta(seconds=1))
+        self.buffer.record(self.link.id, when)
+        
+        self.assertEqual(self.buffer.flush(), 2)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.access_count, 7)
+        self.assertEqual(self.link.last_accessed, when)
+        self.assertEqual(self.buffer.flush(), 0)
+    
+    def test_failed_flush_restores_counters(self):
+        self.buffer.record(self.link.id)
+        with mock.patch.object(QRCodeLink.objects, 'filter', side_effect=DatabaseError):
+            with self.assertLogs('main_app.utils.scan_buffer', 'ERROR'):
+                self.assertEqual(self.buffer.flush(), 0)
+        
+        # Обращения, пришедшие после ошибки, складываются с возвращенными в буфер
+        self.buffer.record(self.link.id)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.access_count, 2)
+
+
+def hashes(first, last):
+    return [int.from_bytes(hashlib.sha256(str(value).encode()).digest()[:8], 'big') for value in range(first, last)]
+
+
+class HyperLogLogTests(SimpleTestCase):
+
+    def sketch(self, values):
+        sketch = HyperLogLog()
+        for hashed in values:
+            sketch.add(hashed)
+        return sketch
+    
+    def assertEstimate(self, estimate, expected):
+        # Стандартная ошибка около 2.3%, допускаем три сигмы
+        self.assertLess(abs(estimate - expected) / expected, 0.07, estimate)
+    
+    def test_count(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEqual(self.sketch(hashes(0, 10) * 3).count(), 10)
+        self.assertEstimate(self.sketch(hashes(0, 20000)).count(), 20000)
+    
+    def test_merge_counts_union(self):
+        left = self.sketch(hashes(0, 6000))
+        right = self.sketch(hashes(4000, 10000))
+        merged = merge_all([left.to_bytes(), right.to_bytes()])
+        self.assertEstimate(merged.count(), 10000)
+        
+        # Слияние идемпотентно и не зависит от порядка
+        self.assertEqual(merged.to_bytes(), HyperLogLog(right.to_bytes()).merge(left).merge(left).to_bytes())
+    
+    def test_rejects_wrong_size(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog.from_bytes(bytes(HLL_REGISTERS - 1))
+
+
+class VisitorHashTests(SimpleTestCase):
+
+    def request(self, forwarded):
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=forwarded, HTTP_USER_AGENT='ua')
+    
+    def test_ignores_client_forwarded_header(self):
+        # Без доверенных прокси подставленный клиентом заголовок не создает новых посетителей
+        self.assertEqual(visitors.visitor_hash(self.request('1.1.1.1')), visitors.visitor_hash(self.request('2.2.2.2')))
+    
+    @mock.patch.object(visitors, 'TRUSTED_PROXY_COUNT', 1)
+    def test_trusts_only_proxy_hop(self):
+        self.assertEqual(visitors.client_address(self.request('1.1.1.1, 203.0.113.5')), '203.0.113.5')
+        self.assertEqual(
+            visitors.visitor_hash(self.request('1.1.1.1, 203.0.113.5')),
+            visitors.visitor_hash(self.request('2.2.2.2, 203.0.113.5')),
+        )
+        self.assertEqual(visitors.client_address(self.request('')), '10.0.0.1')
+
+
+class CompactTokenTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        token = signer.create_link_token(123456)
+        self.assertEqual(len(token), 20)
+        self.assertEqual(signer.verify_link_token(token), 123456)
+    
+    def test_rejects_tampered_token(self):
+        token = signer.create_link_token(42)
+        for index in range(len(token)):
+            replacement = 'A' if token[index] != 'A' else 'B'
+            tampered = token[:index] + replacement + token[index + 1:]
+            self.assertIsNone(signer.verify_link_token(tampered), tampered)
+        self.assertIsNone(signer.verify_link_token(token[:-1]))
+        self.assertIsNone(signer.verify_link_token('!' * 20))
+    
+    def test_rejects_foreign_link(self):
+        # Подпись одной ссылки не подходит к ID другой
+        raw = base64.urlsafe_b64decode(signer.create_link_token(42))
+        header, _, issued = COMPACT_TOKEN_PAYLOAD.unpack(raw[:COMPACT_TOKEN_PAYLOAD.size])
+        forged = COMPACT_TOKEN_PAYLOAD.pack(header, 43, issued) + raw[COMPACT_TOKEN_PAYLOAD.size:]
+        self.assertIsNone(signer.verify_link_token(base64.urlsafe_b64encode(forged).decode()))
+        
+        # Токен, выпущенный с другим ключом
+        self.assertIsNone(signer.verify_link_token(TokenSigner('another-secret').create_link_token(42)))
+    
+    def test_rejects_expired_token(self):
+        token = signer.create_link_token(42, issued_at=timezone.now() - timedelta(days=400))
+        self.assertIsNone(signer.verify_link_token(token))
+
+
+class BitrixBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.portal = FakeBitrixPortal(catalog_size=200, domain='batch.bitrix24.local')
+        self.portal.delete(7)
+    
+    def test_results_demultiplexed(self):
+        client = BitrixRestClient(self.portal)
+        batch = BitrixBatch(client)
+        ids = list(range(1, 121))
+        calls = [batch.add('crm.product.get', {'id': bitrix_id}) for bitrix_id in ids]
+        batch.execute()
+        
+        # 120 команд уходят тремя конвертами по 50
+        self.assertEqual(self.portal.method_calls['batch'], 3)
+        for bitrix_id, call in zip(ids, calls):
+            if bitrix_id == 7:
+                with self.assertRaises(BitrixBatchError) as error:
+                    call.get()
+                self.assertEqual(error.exception.error, 'NOT_FOUND')
+            else:
+                self.assertEqual(int(call.get()['ID']), bitrix_id)
+    
+    def test_get_products_by_id(self):
+        products = BitrixProductService(self.portal).get_products_by_id([5, 7, 150])
+        self.assertEqual(int(products[5]['ID']), 5)
+        self.assertIsNone(products[7])
+        self.assertEqual(int(products[150]['ID']), 150)
+
+
+class ContentHashSkipTests(TestCase):
+
+    def setUp(self):
+        self.portal = FakeBitrixPortal(catalog_size=120, domain='sync.bitrix24.local')
+        self.service = BitrixProductService(self.portal)
+        self.changed = []
+        products_changed.connect(self.collect)
+        self.addCleanup(products_changed.disconnect, self.collect)
+    
+    def collect(self, sender, bitrix_ids, **kwargs):
+        self.changed.extend(bitrix_ids)
+    
+    def updated_at(self):
+        return dict(Product.objects.values_list('bitrix_id', 'updated_at'))
+    
+    def test_unchanged_products_are_not_written(self):
+        self.assertEqual(self.service.sync_products_to_local(full=True), (120, 0))
+        before = self.updated_at()
+        self.changed.clear()
+        
+        self.portal.touch(10, NAME='Новое название')
+        self.assertEqual(self.service.sync_products_to_local(full=True), (0, 1))
+        after = self.updated_at()
+        self.assertEqual([bitrix_id for bitrix_id in before if before[bitrix_id] != after[bitrix_id]], [10])
+        self.assertEqual(self.changed, [10])
+        self.assertEqual(Product.objects.get(bitrix_id=10).name, 'Новое название')
+        self.assertIsNotNone(ProductSyncState.objects.get(portal_domain='sync.bitrix24.local').last_modified)
+    
+    def test_replayed_event_is_not_a_change(self):
+        self.service.sync_products_to_local(full=True)
+        self.changed.clear()
+        product_data = self.service.get_products_by_id([3])[3]
+        self.assertEqual(self.service.upsert_products([product_data]), (0, 0))
+        self.assertEqual(self.changed, [])
+    
+    def test_concurrent_insert_is_upserted(self):
+        # Поток событий успел создать товар между выборкой существующих и вставкой
+        self.service.sync_products_to_local(full=True)
+        self.portal.touch(3, NAME='Из события')
+        product_data = self.service.get_products_by_id([3])[3]
+        with mock.patch('django.db.models.query.QuerySet.in_bulk', return_value={}):
+            self.service.upsert_products([product_data])
+        self.assertEqual(Product.objects.filter(bitrix_id=3).count(), 1)
+        self.assertEqual(Product.objects.get(bitrix_id=3).name, 'Из события')
+
+
+class KeysetPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        names = ['Телефон', 'Телефоны', 'Телфон', 'Чехол для телефона', 'Кабель']
+        # Повторяющиеся названия и порядок сортировки: границы страниц проходят внутри групп равных значений
+        Product.objects.bulk_create([
+            Product(
+                bitrix_id=index + 1,
+                name=names[index % len(names)],
+                description='Подходит к телефону' if index % 3 == 0 else '',
+                price=100,
+                sort_order=[100, 500][index % 2],
+            )
+            for index in range(47)
+        ])
+    
+    def setUp(self):
+        product_index.clear()
+    
+    def walk(self, paginator, cursor, attribute):
+        pages = []
+        while cursor is not None or not pages:
+            page = paginator.get_page(cursor)
+            pages.append([row.id for row in page])
+            cursor = getattr(page, attribute)
+        return pages
+    
+    def assertWalks(self, queryset, ordering, per_page=5):
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        expected = list(queryset.order_by(*ordering).values_list('id', flat=True))
+        self.assertGreater(len(expected), per_page * 2)
+        
+        forward = self.walk(paginator, None, 'next_cursor')
+        self.assertEqual(sum(forward, []), expected)
+        self.assertTrue(all(len(page) == per_page for page in forward[:-1]))
+        
+        # От последней страницы назад: страницы в том же порядке строк, первая - полная
+        backward = self.walk(paginator, paginator.last_cursor(), 'previous_cursor')
+        self.assertEqual(sum(reversed(backward), []), expected)
+        self.assertEqual(backward[0], expected[-per_page:])
+        self.assertTrue(all(len(page) == per_page for page in backward[:-1]))
+        
+        # Шаг вперед и обратно возвращает ту же страницу
+        second = paginator.get_page(paginator.get_page().next_cursor)
+        self.assertEqual([row.id for row in paginator.get_page(second.previous_cursor)], expected[:per_page])
+        self.assertFalse(paginator.get_page(second.previous_cursor).has_previous)
+        return paginator
+    
+    def test_catalog_ordering(self):
+        self.assertWalks(Product.objects.filter(is_active=True), views.PRODUCT_LIST_ORDERING)
+    
+    def test_search_ordering(self):
+        queryset = search_products(Product.objects.filter(is_active=True), 'телефон')
+        ordering = ['-search_rank'] + views.PRODUCT_LIST_ORDERING
+        paginator = self.assertWalks(queryset, ordering, per_page=4)
+        
+        # Курсор несет дробную релевантность граничной строки
+        _, values = paginator.decode(paginator.get_page().next_cursor)
+        self.assertIsInstance(values[0], float)
+        self.assertGreater(len(set(queryset.values_list('search_rank', flat=True))), 2)
+    
+    def test_bad_cursor_gives_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), views.PRODUCT_LIST_ORDERING, 5)
+        first = [row.id for row in paginator.get_page()]
+        cursor = paginator.get_page().next_cursor
+        foreign = KeysetPaginator(Product.objects.all(), ['-id'], 5).get_page().next_cursor
+        unsigned = signing.dumps(['n', [500, 'Телефон', 10]], salt='another')
+        
+        for bad in (cursor[:-3] + 'abc', foreign, unsigned, 'garbage', signing.dumps('n', salt=CURSOR_SALT)):
+            page = paginator.get_page(bad)
+            self.assertEqual([row.id for row in page], first, bad)
+            self.assertFalse(page.has_previous)
+
+
+@override_settings(BITRIX_APPLICATION_TOKEN='application-token')
+class BitrixProductEventTests(TestCase):
+
+    def post(self, event, bitrix_id, application_token='application-token', domain='events.bitrix24.local'):
+        request = RequestFactory().post(reverse('main_app:bitrix_product_event'), {
+            'event': event,
+            'data[FIELDS][ID]': bitrix_id,
+            'auth[application_token]': application_token,
+            'auth[domain]': domain,
+        })
+        return views.bitrix_product_event(request)
+    
+    def age_events(self):
+        # События старше окна схлопывания готовы к применению
+        PendingProductEvent.objects.update(received_at=timezone.now() - EVENT_COALESCE_WINDOW * 2)
+    
+    def test_rejects_wrong_application_token(self):
+        for application_token in ('another-token', ''):
+            response = self.post(PendingProductEvent.EVENT_UPDATE, 1, application_token=application_token)
+            self.assertEqual(response.status_code, 403)
+        self.assertFalse(PendingProductEvent.objects.exists())
+    
+    def test_update_then_delete_coalesced(self):
+        self.assertEqual(self.post(PendingProductEvent.EVENT_UPDATE, 5).status_code, 200)
+        self.assertEqual(self.post('onCrmProductDelete', 5).status_code, 200)
+        self.assertEqual(
+            list(PendingProductEvent.objects.values_list('portal_domain', 'bitrix_id', 'event')),
+            [('events.bitrix24.local', 5, PendingProductEvent.EVENT_DELETE)],
+        )
+    
+    def test_events_of_portal_without_token_dropped(self):
+        portal = FakeBitrixPortal(catalog_size=20, domain='events.bitrix24.local')
+        BitrixProductService(portal).sync_products_to_local(full=True)
+        portal.touch(4, NAME='Изменен в Битрикс24')
+        portal.delete(5)
+        self.post(PendingProductEvent.EVENT_UPDATE, 4)
+        self.post(PendingProductEvent.EVENT_DELETE, 5)
+        self.post(PendingProductEvent.EVENT_UPDATE, 4, domain='removed.bitrix24.local')
+        self.age_events()
+        
+        tokens = {'events.bitrix24.local': portal}
+        with mock.patch('main_app.utils.bitrix_api.get_portal_token', side_effect=tokens.get):
+            with self.assertLogs('main_app.utils.bitrix_events', 'WARNING'):
+                self.assertEqual(apply_pending_product_events(), 2)
+        
+        self.assertFalse(PendingProductEvent.objects.exists())
+        self.assertEqual(Product.objects.get(bitrix_id=4).name, 'Изменен в Битрикс24')
+        self.assertFalse(Product.objects.get(bitrix_id=5).is_active)
+
+
+class BackgroundJobQueueTests(TestCase):
+
+    def enqueue(self, portal_domain='jobs.bitrix24.local'):
+        return enqueue_job(BackgroundJob.KIND_PRODUCT_SYNC, lock_key=product_sync_lock_key(portal_domain))
+    
+    def test_single_active_job_per_lock_key(self):
+        job, created = self.enqueue()
+        self.assertTrue(created)
+        self.assertEqual(self.enqueue(), (job, False))
+        
+        # Выполняющаяся задача тоже держит ключ, у другого портала ключ свой
+        claim_next_job()
+        self.assertEqual(self.enqueue(), (job, False))
+        self.assertTrue(self.enqueue('other.bitrix24.local')[1])
+        
+        # После завершения ключ свободен
+        BackgroundJob.objects.filter(id=job.id).update(status=BackgroundJob.STATUS_DONE)
+        next_job, created = self.enqueue()
+        self.assertTrue(created)
+        self.assertNotEqual(next_job.id, job.id)
+    
+    def test_claim_skips_job_taken_by_another_worker(self):
+        first, _ = self.enqueue('first.bitrix24.local')
+        second, _ = self.enqueue('second.bitrix24.local')
+        now = timezone.now
+        
+        def claimed_elsewhere():
+            # Другой воркер захватывает первую задачу между выборкой кандидатов и UPDATE
+            BackgroundJob.objects.filter(id=first.id).update(status=BackgroundJob.STATUS_RUNNING)
+            return now()
+        
+        with mock.patch.object(jobs.timezone, 'now', side_effect=claimed_elsewhere):
+            job = claim_next_job()
+        self.assertEqual(job.id, second.id)
+        self.assertEqual(job.status, BackgroundJob.STATUS_RUNNING)
+        self.assertIsNotNone(job.heartbeat_at)
+        self.assertIsNone(claim_next_job())
+    
+    def test_stale_job_released(self):
+        job, _ = self.enqueue()
+        claim_next_job()
+        self.assertEqual(fail_stale_jobs(), 0)
+        
+        BackgroundJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - JOB_STALE_AFTER * 2)
+        self.assertEqual(fail_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_FAILED)
+        self.assertIsNotNone(job.finished_at)
+        
+        # Брошенная задача больше не держит ключ: синхронизацию можно запустить заново
+        retry, created = self.enqueue()
+        self.assertTrue(created)
+        self.assertEqual(claim_next_job().id, retry.id)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+@mock.patch.object(views.scan_counter, 'record')
+class ProductPageValidatorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.link = QRCodeLinkFactory(is_active=True, product__is_active=True)
+        self.link.signed_token = signer.create_link_token(self.link.id)
+        self.link.save(update_fields=['signed_token'])
+    
+    def scan(self, **headers):
+        return views.product_view_by_token(RequestFactory().get('/', **headers), self.link.signed_token)
+    
+    def test_not_modified_still_counts_scan(self, record):
+        response = self.scan()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        
+        response = self.scan(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(record.call_count, 2)
+        record.assert_called_with(self.link.id, product_id=self.link.product_id, visitor=mock.ANY)
+    
+    def test_product_edit_changes_etag(self, record):
+        etag = self.scan()['ETag']
+        product = self.link.product
+        product.name = 'Новое название'
+        product.save()
+        
+        response = self.scan(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Новое название')
+
+
+class TemporaryMediaTestCase(TestCase):
+    """Медиафайлы теста пишутся во временный каталог"""
+    
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class QRImageStoreTests(TemporaryMediaTestCase):
+
+    def link(self, qr_image):
+        return QRCodeLinkFactory(is_active=True, qr_image=qr_image, qr_code_image=qr_image.image.name)
+    
+    def test_shared_file_deleted_with_last_reference(self):
+        first = acquire_qr_image('https://example.com/p/token')
+        second = acquire_qr_image('https://example.com/p/token')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(QRImage.objects.get(id=first.id).ref_count, 2)
+        self.assertNotEqual(acquire_qr_image('https://example.com/p/other').id, first.id)
+        
+        name = first.image.name
+        links = [self.link(first), self.link(second)]
+        with self.captureOnCommitCallbacks(execute=True):
+            links[0].delete()
+        self.assertEqual(QRImage.objects.get(id=first.id).ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+        
+        # Файл удаляется только после фиксации транзакции, удалившей последнюю ссылку
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            links[1].delete()
+        self.assertFalse(QRImage.objects.filter(id=first.id).exists())
+        self.assertTrue(default_storage.exists(name))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(default_storage.exists(name))
+
+
+@mock.patch.object(qr_bulk, 'QR_BULK_WORKERS', 2)
+class QRBulkGenerationTests(TemporaryMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = ProductFactory.create_batch(30, is_active=True)
+        self.existing = QRCodeLinkFactory(product=self.products[0], is_active=True)
+        self.existing.signed_token = signer.create_link_token(self.existing.id)
+        self.existing.save(update_fields=['signed_token'])
+        self.progress = []
+    
+    def generate(self, output_format):
+        params = {'scope': qr_bulk.SCOPE_ACTIVE, 'output': output_format}
+        name = qr_bulk.generate_bulk(params, f'qr_bulk/test.{output_format}', lambda **values: self.progress.append(values))
+        self.assertEqual(self.progress[-1], {'stage': 'save', 'done': 30, 'total': 30})
+        with default_storage.open(name) as output:
+            return output.read()
+    
+    def test_zip_output(self):
+        with zipfile.ZipFile(BytesIO(self.generate(qr_bulk.OUTPUT_ZIP))) as archive:
+            names = archive.namelist()
+            self.assertTrue(all(archive.read(name).startswith(b'\x89PNG') for name in names))
+        self.assertEqual(len(names), 30)
+        
+        # Действующая ссылка переиспользуется, остальным товарам ссылки создаются
+        self.assertIn(f'qr_{self.products[0].bitrix_id}_{self.existing.id}.png', names)
+        self.assertEqual(QRCodeLink.objects.count(), 30)
+        self.assertFalse(QRCodeLink.objects.filter(signed_token__isnull=True).exists())
+    
+    def test_pdf_output(self):
+        content = self.generate(qr_bulk.OUTPUT_PDF)
+        self.assertTrue(content.startswith(b'%PDF'))
+        # 30 наклеек - два листа по LABELS_PER_PAGE
+        self.assertEqual(len(re.findall(rb'/Type\s*/Page\b', content)), 2)
+    
+    def test_expired_outputs_deleted(self):
+        old_name = default_storage.save('qr_bulk/old.zip', ContentFile(b'old'))
+        new_name = default_storage.save('qr_bulk/new.zip', ContentFile(b'new'))
+        finished = timezone.now() - qr_bulk.QR_BULK_OUTPUT_TTL
+        old, new = [
+            BackgroundJob.objects.create(
+                kind=BackgroundJob.KIND_QR_BULK,
+                status=BackgroundJob.STATUS_DONE,
+                progress={'stage': 'done', 'output': name},
+                finished_at=finished_at,
+            )
+            for name, finished_at in ((old_name, finished - timedelta(hours=1)), (new_name, finished + timedelta(hours=1)))
+        ]
+        
+        self.assertEqual(qr_bulk.expire_bulk_outputs(), 1)
+        old.refresh_from_db()
+        self.assertEqual(old.progress, {'stage': 'done', 'expired': True})
+        self.assertFalse(default_storage.exists(old_name))
+        new.refresh_from_db()
+        self.assertEqual(new.progress['output'], new_name)
+        self.assertTrue(default_storage.exists(new_name))
+        self.assertEqual(qr_bulk.expire_bulk_outputs(), 0)
+
+
+class QRImageViewTests(TestCase):
+
+    def setUp(self):
+        render_cache.clear()
+        self.link = QRCodeLinkFactory(is_active=True)
+        self.link.signed_token = signer.create_link_token(self.link.id)
+        self.link.save(update_fields=['signed_token'])
+    
+    def get(self, image_format='png', link_id=None, headers=None, **params):
+        request = RequestFactory().get('/', params, **(headers or {}))
+        request.bitrix_user_token = bitrix_user_token()
+        return undecorated(views.qr_image)(request, link_id or self.link.id, image_format)
+    
+    def test_not_modified_skips_rendering(self):
+        response = self.get(size=8)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+        
+        with mock.patch.object(views, 'render_qr') as render:
+            response = self.get(size=8, headers={'HTTP_IF_NONE_MATCH': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+        
+        # ETag зависит от параметров отрисовки
+        self.assertNotEqual(self.get(size=9)['ETag'], self.get(size=8)['ETag'])
+        self.assertNotEqual(self.get('svg', size=8)['ETag'], self.get(size=8)['ETag'])
+        self.assertEqual(self.get('svg')['Content-Type'], 'image/svg+xml')
+    
+    def test_rejects_bad_parameters(self):
+        for params in ({'size': 'big'}, {'border': '1.5'}, {'size': 0}, {'size': 41}, {'border': -1}, {'border': 11}):
+            self.assertEqual(self.get(**params).status_code, 400, params)
+        with self.assertRaises(Http404):
+            self.get('gif')
+        with self.assertRaises(Http404):
+            self.get(link_id=self.link.id + 1000)
+
+
+class QREncoderTests(SimpleTestCase):
+
+    def reference_matrix(self, data, border, error_correction):
+        qr = qrcode.QRCode(error_correction=error_correction, border=border)
+        qr.add_data(data)
+        qr.make(fit=True)
+        return qr.get_matrix()
+    
+    def test_matches_qrcode(self):
+        # Версии от 1 до 21 (с 7-й в матрице есть блок номера версии) и все режимы кодирования
+        payloads = ['7', '0123456789' * 3, 'HTTPS://EXAMPLE.COM/P/ABC', generate_product_qr_url('A' * 20)]
+        payloads += ['https://example.com/' + 'x-ß_' * length for length in (10, 40, 75)]
+        for data in payloads:
+            for level, error_correction in ERROR_CORRECTION_LEVELS.items():
+                for border in (0, 4):
+                    with self.subTest(length=len(data), level=level, border=border):
+                        self.assertEqual(
+                            qr_matrix(data, border, error_correction),
+                            self.reference_matrix(data, border, error_correction),
+                        )
+
+
+class MediaShardingTests(TemporaryMediaTestCase):
+
+    def save(self, name, age_hours=0):
+        name = default_storage.save(name, ContentFile(name.encode()))
+        if age_hours:
+            modified = time.time() - age_hours * 3600
+            os.utime(default_storage.path(name), (modified, modified))
+        return name
+    
+    def test_shard_media_moves_files_and_references(self):
+        qr_name = self.save('qr_codes/qr_flat.png')
+        photo_name = self.save('products/photo.jpg')
+        digest = 'ab12' * 16
+        qr_image = QRImage.objects.create(digest=digest, image=qr_name, ref_count=1)
+        link = QRCodeLinkFactory(qr_image=qr_image, qr_code_image=qr_name)
+        product = ProductFactory(detail_image=photo_name)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('shard_media', stdout=StringIO())
+        
+        sharded = shard_name(QR_CODES_PREFIX, digest, '.png')
+        qr_image.refresh_from_db()
+        link.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual(qr_image.image.name, sharded)
+        self.assertEqual(link.qr_code_image.name, sharded)
+        self.assertTrue(is_sharded(product.detail_image.name))
+        with default_storage.open(sharded) as moved:
+            self.assertEqual(moved.read(), qr_name.encode())
+        self.assertFalse(default_storage.exists(qr_name))
+        self.assertFalse(default_storage.exists(photo_name))
+        
+        # Повторный запуск ничего не переносит
+        output = StringIO()
+        call_command('shard_media', stdout=output)
+        self.assertEqual(output.getvalue().count('перенесено 0'), len(MEDIA_REFERENCES))
+    
+    def test_sweep_keeps_fresh_and_referenced_files(self):
+        orphan = self.save('qr_codes/ab/cd/orphan.png', age_hours=48)
+        fresh = self.save('qr_codes/ab/cd/fresh.png')
+        referenced = self.save('qr_codes/ab/cd/referenced.png', age_hours=48)
+        photo = self.save('products/ef/01/photo.jpg', age_hours=48)
+        QRImage.objects.create(digest='cd34' * 16, image=referenced, ref_count=1)
+        ProductFactory(detail_image=photo)
+        
+        output = StringIO()
+        call_command('sweep_media_orphans', '--dry-run', stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[0], orphan)
+        self.assertTrue(default_storage.exists(orphan))
+        
+        call_command('sweep_media_orphans', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        for name in (fresh, referenced, photo):
+            self.assertTrue(default_storage.exists(name), name)
+        
+        # С --min-age 0 свежий файл без ссылок тоже удаляется
+        call_command('sweep_media_orphans', '--min-age', '0', stdout=StringIO())
+        self.assertFalse(default_storage.exists(fresh))
+        self.assertTrue(default_storage.exists(referenced))
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+    
+    def scrape(self, remote_addr='127.0.0.1', **headers):
+        return views.metrics(RequestFactory().get('/metrics/', REMOTE_ADDR=remote_addr, **headers))
+    
+    @mock.patch.object(views, 'METRICS_SAMPLE_RATE', 0)
+    def test_disabled_at_zero_sample_rate(self):
+        with self.assertRaises(Http404):
+            self.scrape()
+        with mock.patch.object(metrics, 'METRICS_SAMPLE_RATE', 0), self.assertRaises(MiddlewareNotUsed):
+            PerformanceMiddleware(lambda request: HttpResponse())
+    
+    @mock.patch.object(views, 'METRICS_SAMPLE_RATE', 1)
+    @override_settings(METRICS_TOKEN=None)
+    def test_local_only_without_token(self):
+        self.assertEqual(self.scrape().status_code, 200)
+        self.assertEqual(self.scrape('::1').status_code, 200)
+        self.assertEqual(self.scrape('10.0.0.5').status_code, 403)
+        # Заголовок от клиента не делает запрос локальным
+        self.assertEqual(self.scrape('10.0.0.5', HTTP_X_FORWARDED_FOR='127.0.0.1').status_code, 403)
+    
+    @mock.patch.object(views, 'METRICS_SAMPLE_RATE', 1)
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_bearer_token(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.scrape('10.0.0.5', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-store', response['Cache-Control'])
+    
+    @mock.patch.object(metrics, 'METRICS_SAMPLE_RATE', 1)
+    def test_middleware_records_view(self):
+        def view(request):
+            with metrics.timed('bitrix'):
+                pass
+            return HttpResponse()
+        
+        request = RequestFactory().get('/products/')
+        request.resolver_match = SimpleNamespace(view_name='main_app:product_list')
+        PerformanceMiddleware(view)(request)
+        
+        stat = metrics.registry.snapshot()['main_app:product_list']
+        self.assertEqual(stat['count'], 1)
+        self.assertEqual(stat['sections']['bitrix'][0], 1)
+        self.assertIn('app_bitrix_api_calls_total{view="main_app:product_list"} 1', metrics.registry.exposition())
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+@mock.patch.object(_generation, 'ttl', None)
+class SearchPrefixNarrowingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        products = [
+            Product(bitrix_id=index + 1, name=f'Чехол {name}', price=100, sort_order=sort_order)
+            for index, (name, sort_order) in enumerate(
+                (f'модель {index}', [900, 500, 100][index % 3]) for index in range(12)
+            )
+        ]
+        # Для префикса "чех" лучшее совпадение по названию, для "чехол" - только по описанию
+        products.append(Product(bitrix_id=100, name='Чехия, магнит', description='Подойдет как чехол', price=100, sort_order=100))
+        Product.objects.bulk_create(products)
+    
+    def setUp(self):
+        cache.clear()
+        product_index.clear()
+        _generation.clear()
+    
+    def search(self, query):
+        request = RequestFactory().get(reverse('main_app:product_search_api'), {'q': query})
+        return json.loads(views.ProductSearchAPI.as_view()(request).content)['results']
+    
+    def test_narrowed_results_match_cold_search(self):
+        prefix = self.search('чех')
+        self.assertEqual(prefix[0]['bitrix_id'], 100)
+        
+        # Выдача отбирается из списка префикса в памяти, без поиска в базе
+        with self.assertNumQueries(0):
+            narrowed = self.search('чехол')
+        
+        cache.clear()
+        self.assertEqual(narrowed, self.search('чехол'))
+        self.assertNotIn(100, [product['bitrix_id'] for product in narrowed])
+    
+    def test_no_narrowing_without_enough_best_matches(self):
+        self.search('чех')
+        # Запрос совпадает с названием только у одного товара: нужен поиск в базе
+        with CaptureQueriesContext(connection) as context:
+            narrowed = self.search('чехол модель 1')
+        self.assertTrue(context.captured_queries)
+        cache.clear()
+        self.assertEqual(narrowed, self.search('чехол модель 1'))
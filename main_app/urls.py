@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -11,13 +12,28 @@ urlpatterns = [
     path('products/', views.product_list, name='product_list'),
     path('products/create/', views.product_create, name='product_create'),
     path('products/sync/', views.sync_products, name='sync_products'),
+    path('products/sync/status/', views.sync_status, name='sync_status'),
     
     # QR-коды
     path('qr/generate/', views.qr_generate, name='qr_generate'),
     path('qr/result/<int:qr_link_id>/', views.qr_result, name='qr_result'),
     path('qr/list/', views.qr_list, name='qr_list'),
+    path('qr/<int:qr_link_id>/image.<str:image_format>', views.qr_image, name='qr_image'),
+    path('qr/bulk/', views.qr_bulk_generate, name='qr_bulk_generate'),
+    path('qr/bulk/<int:job_id>/status/', views.qr_bulk_status, name='qr_bulk_status'),
+    path('qr/bulk/<int:job_id>/download/', views.qr_bulk_download, name='qr_bulk_download'),
     
     
     # API
-    path('api/product-search/', views.ProductSearchAPI.as_view(), name='product_search_api'),
+    path(
+        'api/product-search/',
+        (views.AsyncProductSearchAPI if settings.PUBLIC_VIEWS_ASYNC else views.ProductSearchAPI).as_view(),
+        name='product_search_api',
+    ),
+    
+    # События Битрикс24
+    path('bitrix/events/', views.bitrix_product_event, name='bitrix_product_event'),
+    
+    # Метрики производительности (Prometheus)
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -1,21 +1,406 @@
 """
 Утилиты для работы с API Битрикс24
 """
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+
 from django.conf import settings
-from main_app.models import Product
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from main_app.models import Product, ProductSyncState
+from main_app.signals import products_changed
+from main_app.utils.metrics import timed
 from integration_utils.bitrix24.models import BitrixUserToken
 
 
+# Поля товара, которые запрашиваются у Битрикс24 при синхронизации
+PRODUCT_SYNC_SELECT = ['ID', 'NAME', 'DESCRIPTION', 'PRICE', 'CURRENCY_ID', 'SORT', 'DATE_MODIFY']
+
+# Поля модели Product, которые перезаписываются синхронизацией
+PRODUCT_SYNC_MODEL_FIELDS = ['name', 'description', 'price', 'currency', 'sort_order', 'is_active']
+
+# Поля, по которым считается Product.content_hash
+PRODUCT_HASH_FIELDS = ['name', 'description', 'price', 'currency', 'sort_order']
+
+# Сколько товаров накапливать перед записью в базу одной пачкой
+SYNC_CHUNK_SIZE = 500
+
+# DATE_MODIFY хранится с точностью до секунды, поэтому фильтр по водяному знаку
+# берется с небольшим перекрытием, чтобы не потерять товары, измененные в ту же секунду
+SYNC_WATERMARK_OVERLAP = timedelta(seconds=5)
+
+# Как часто запускать сверку удаленных в Битрикс24 товаров
+PRODUCT_RECONCILE_INTERVAL = getattr(settings, 'PRODUCT_RECONCILE_INTERVAL', timedelta(hours=1))
+
+# Размер страницы списочных методов REST API Битрикс24
+BITRIX_PAGE_SIZE = 50
+
+# Максимальное количество команд в одном вызове batch
+BATCH_MAX_COMMANDS = 50
+
+# Лимиты REST API Битрикс24: около 2 запросов в секунду с запасом на всплеск
+BITRIX_RATE_LIMIT = getattr(settings, 'BITRIX_RATE_LIMIT', 2.0)
+BITRIX_RATE_BURST = getattr(settings, 'BITRIX_RATE_BURST', 50)
+
+# Сколько независимых запросов выполнять параллельно
+BITRIX_MAX_WORKERS = getattr(settings, 'BITRIX_MAX_WORKERS', 4)
+
+# Повторы при QUERY_LIMIT_EXCEEDED: экспоненциальная задержка с джиттером
+BITRIX_MAX_RETRIES = getattr(settings, 'BITRIX_MAX_RETRIES', 6)
+BITRIX_BACKOFF_BASE = 0.5
+BITRIX_BACKOFF_MAX = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+def get_portal_domain(user_token):
+    """Домен портала, к которому относится токен пользователя"""
+    try:
+        return user_token.user.portal.domain
+    except AttributeError:
+        return settings.APP_SETTINGS.portal_domain
+
+
+def get_portal_token(portal_domain=None):
+    """Действующий токен администратора портала для фоновых вызовов REST API"""
+    tokens = BitrixUserToken.objects.filter(is_active=True, user__is_admin=True)
+    if portal_domain:
+        tokens = tokens.filter(user__portal__domain=portal_domain)
+    return tokens.order_by('-id').first()
+
+
+def product_content_hash(fields):
+    """Компактный хеш синхронизируемых полей товара"""
+    values = [str(fields[name]) for name in PRODUCT_HASH_FIELDS]
+    values[PRODUCT_HASH_FIELDS.index('price')] = str(Decimal(fields['price']).quantize(Decimal('0.01')))
+    payload = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def build_query(params, prefix=None):
+    """
+    Сериализовать вложенные параметры так же, как PHP http_build_query:
+    {'filter': {'>ID': 5}} -> 'filter[>ID]=5'
+    """
+    pairs = []
+    if isinstance(params, dict):
+        items = params.items()
+    else:
+        items = enumerate(params)
+    
+    for key, value in items:
+        name = f'{prefix}[{key}]' if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            pairs.append(build_query(value, name))
+        elif value is None:
+            pairs.append(urlencode({name: ''}))
+        elif isinstance(value, bool):
+            pairs.append(urlencode({name: 'Y' if value else 'N'}))
+        else:
+            pairs.append(urlencode({name: value}))
+    
+    return '&'.join(pair for pair in pairs if pair)
+
+
+def is_throttled(error):
+    """Проверить, что Битрикс24 отказал из-за превышения лимита запросов"""
+    if isinstance(error, dict):
+        return error.get('error') == 'QUERY_LIMIT_EXCEEDED'
+    return getattr(error, 'error', None) == 'QUERY_LIMIT_EXCEEDED' or 'QUERY_LIMIT_EXCEEDED' in str(error)
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше capacity"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Дождаться свободного токена и забрать его"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def drain(self):
+        """Обнулить запас после отказа сервера, чтобы не продолжать всплеск"""
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+# Общие лимитеры на процесс: все клиенты одного портала делят одну квоту
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_portal_bucket(portal_domain):
+    with _buckets_lock:
+        if portal_domain not in _buckets:
+            _buckets[portal_domain] = TokenBucket(BITRIX_RATE_LIMIT, BITRIX_RATE_BURST)
+        return _buckets[portal_domain]
+
+
+class BitrixRestClient:
+    """
+    Обертка над BitrixUserToken.call_api_method с учетом лимитов Битрикс24.
+    
+    Каждый вызов проходит через общий для портала token bucket, при
+    QUERY_LIMIT_EXCEEDED повторяется с экспоненциальной задержкой и
+    джиттером. Латентность вызовов пишется в лог и копится в stats.
+    """
+    
+    def __init__(self, user_token, max_workers=BITRIX_MAX_WORKERS, max_retries=BITRIX_MAX_RETRIES):
+        self.user_token = user_token
+        self.bucket = get_portal_bucket(get_portal_domain(user_token))
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+    
+    def call_api_method(self, method, params=None):
+        """Вызвать метод REST API с ограничением частоты и повторами"""
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                with timed('bitrix'):
+                    response = self.user_token.call_api_method(method, params)
+            except Exception as e:
+                if not is_throttled(e) or attempt >= self.max_retries:
+                    self._record(method, time.monotonic() - started, error=True)
+                    raise
+                response = e
+            
+            elapsed = time.monotonic() - started
+            if isinstance(response, Exception) or is_throttled(response):
+                if attempt >= self.max_retries:
+                    self._record(method, elapsed, error=True)
+                    return response
+                self._record(method, elapsed, retried=True)
+                self.bucket.drain()
+                delay = random.uniform(0, min(BITRIX_BACKOFF_MAX, BITRIX_BACKOFF_BASE * 2 ** attempt))
+                logger.warning("Битрикс24: QUERY_LIMIT_EXCEEDED на %s, повтор через %.2f с", method, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            
+            self._record(method, elapsed)
+            return response
+    
+    def map(self, func, items):
+        """
+        Выполнить func для каждого элемента в пуле потоков.
+        
+        В работе одновременно не больше max_workers задач, результаты
+        отдаются в исходном порядке по мере готовности.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = deque()
+            for item in items:
+                futures.append(executor.submit(self._run_in_thread, func, item))
+                if len(futures) >= self.max_workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+    
+    @staticmethod
+    def _run_in_thread(func, item):
+        try:
+            return func(item)
+        finally:
+            # Соединение с БД, открытое в рабочем потоке (например при обновлении токена), не должно утечь
+            connection.close()
+    
+    def _record(self, method, elapsed, retried=False, error=False):
+        logger.debug("Битрикс24: %s за %.3f с", method, elapsed)
+        with self.stats_lock:
+            stat = self.stats.setdefault(method, {'calls': 0, 'retries': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+            stat['calls'] += 1
+            stat['retries'] += int(retried)
+            stat['errors'] += int(error)
+            stat['total_time'] += elapsed
+            stat['max_time'] = max(stat['max_time'], elapsed)
+
+
+class BitrixBatchError(Exception):
+    """Ошибка отдельной команды внутри batch-запроса"""
+    
+    def __init__(self, error, description=''):
+        self.error = error
+        self.description = description
+        super().__init__(f"{error}: {description}" if description else error)
+
+
+class BitrixBatchCall:
+    """Отложенный вызов метода, результат которого появится после выполнения batch"""
+    
+    def __init__(self, method, params=None):
+        self.method = method
+        self.params = params or {}
+        self.result = None
+        self.error = None
+        self.total = None
+        self.next = None
+        self.done = False
+    
+    def command(self):
+        """Строка команды в формате batch: method?param=value"""
+        query = build_query(self.params)
+        return f'{self.method}?{query}' if query else self.method
+    
+    def get(self):
+        """Вернуть результат команды или выбросить ее ошибку"""
+        if not self.done:
+            raise BitrixBatchError('NOT_EXECUTED', f'Команда {self.method} еще не выполнена')
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class BitrixBatch:
+    """
+    Очередь вызовов REST API, отправляемых пачками через метод batch.
+    
+    Команды копятся через add(), execute() режет очередь на конверты по
+    BATCH_MAX_COMMANDS команд, отправляет их и раскладывает результаты и
+    ошибки обратно по объектам BitrixBatchCall.
+    """
+    
+    def __init__(self, client, halt=False):
+        self.client = client
+        self.halt = halt
+        self.pending = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+    
+    def add(self, method, params=None):
+        """Поставить вызов в очередь"""
+        call = BitrixBatchCall(method, params)
+        self.pending.append(call)
+        return call
+    
+    def execute(self):
+        """Отправить все накопленные вызовы"""
+        pending, self.pending = self.pending, []
+        for offset in range(0, len(pending), BATCH_MAX_COMMANDS):
+            self._send(pending[offset:offset + BATCH_MAX_COMMANDS])
+        return pending
+    
+    def _send(self, calls):
+        cmd = {f'cmd{index}': call.command() for index, call in enumerate(calls)}
+        response = self.client.call_api_method('batch', {'halt': int(self.halt), 'cmd': cmd})
+        
+        if 'result' not in response:
+            raise Exception("Неверный ответ API Битрикс24 на batch")
+        
+        # Пустые секции PHP отдает списком, а не объектом
+        payload = response['result']
+        results = payload.get('result') or {}
+        errors = payload.get('result_error') or {}
+        totals = payload.get('result_total') or {}
+        nexts = payload.get('result_next') or {}
+        
+        for index, call in enumerate(calls):
+            key = f'cmd{index}'
+            call.done = True
+            if key in errors:
+                error = errors[key]
+                call.error = BitrixBatchError(error.get('error', 'ERROR'), error.get('error_description', ''))
+            elif key in results:
+                call.result = results[key]
+                call.total = totals.get(key)
+                call.next = nexts.get(key)
+            else:
+                # При halt=1 команды после ошибочной не выполняются
+                call.error = BitrixBatchError('NOT_EXECUTED', f'Команда {call.method} не была выполнена')
+
+
 class BitrixProductService:
     """Сервис для работы с товарами через integration_utils"""
     
     def __init__(self, user_token: BitrixUserToken):
         self.user_token = user_token
+        self.portal_domain = get_portal_domain(user_token)
+        self.client = BitrixRestClient(user_token)
+        self.last_total = 0
     
     def add_product(self, name, price, currency='RUB', description=None, sort=500, detail_image=None):
         """
         Добавить товар в Битрикс24
         """
+        fields = self._product_add_fields(name, price, currency, description, sort, detail_image)
+        return self.client.call_api_method('crm.product.add', {'fields': fields})
+    
+    def add_products(self, products):
+        """
+        Добавить несколько товаров одним или несколькими batch-запросами.
+        
+        products - список словарей с аргументами add_product. Возвращает список
+        BitrixBatchCall в том же порядке; call.get() отдает ID товара или
+        выбрасывает BitrixBatchError.
+        
+        Форма создания товара добавляет по одному товару и вызывает
+        add_product; пакетного создания в интерфейсе пока нет, поэтому
+        add_products используется только в bench_bitrix_sync.
+        """
+        batch = BitrixBatch(self.client)
+        calls = [
+            batch.add('crm.product.add', {'fields': self._product_add_fields(**product)})
+            for product in products
+        ]
+        batch.execute()
+        return calls
+    
+    def get_products_by_id(self, bitrix_ids):
+        """
+        Получить карточки товаров по списку ID через batch (crm.product.get).
+        
+        Возвращает словарь {bitrix_id: данные товара или None, если товар удален}.
+        """
+        batch = BitrixBatch(self.client)
+        calls = {bitrix_id: batch.add('crm.product.get', {'id': bitrix_id}) for bitrix_id in bitrix_ids}
+        batch.execute()
+        
+        products = {}
+        for bitrix_id, call in calls.items():
+            try:
+                products[bitrix_id] = call.get()
+            except BitrixBatchError as e:
+                if e.error != 'NOT_FOUND' and 'not found' not in e.description.lower():
+                    raise
+                products[bitrix_id] = None
+        return products
+    
+    @staticmethod
+    def _product_add_fields(name, price, currency='RUB', description=None, sort=500, detail_image=None):
+        """Поля для crm.product.add"""
         fields = {
             'NAME': name,
             'CURRENCY_ID': currency,
@@ -40,10 +425,10 @@ class BitrixProductService:
                 
             except Exception as e:
                 print(f"Ошибка при подготовке изображения для загрузки: {e}")
-
-        return self.user_token.call_api_method('crm.product.add', {'fields': fields})
+        
+        return fields
     
-    def get_products(self, filter_params=None, select_fields=None, order=None):
+    def get_products(self, filter_params=None, select_fields=None, order=None, start=None):
         """
         Получить список товаров из Битрикс24
         """
@@ -58,47 +443,268 @@ class BitrixProductService:
         if order:
             params['order'] = order
         
-        return self.user_token.call_api_method('crm.product.list', params)
-
+        if start is not None:
+            params['start'] = start
+        
+        return self.client.call_api_method('crm.product.list', params)
     
-    def sync_products_to_local(self, limit=50):
+    def iter_products(self, filter_params=None, select_fields=None):
         """
-        Синхронизировать товары из Битрикс24 в локальную базу
+        Обойти весь каталог Битрикс24 постранично.
+        
+        Первая страница запрашивается обычным вызовом, чтобы узнать total,
+        остальные страницы упаковываются по BATCH_MAX_COMMANDS в batch-запросы.
         """
-        response = self.get_products(
-            select_fields=['ID', 'NAME', 'DESCRIPTION', 'PRICE', 'CURRENCY_ID', 'SORT'],
-            order={'NAME': 'ASC'}
-        )
+        order = {'ID': 'ASC'}
+        response = self.get_products(filter_params=filter_params, select_fields=select_fields, order=order, start=0)
         
         if 'result' not in response:
             raise Exception("Неверный ответ API Битрикс24")
         
-        products = response['result']
-        created_count = 0
-        updated_count = 0
+        self.last_total = int(response.get('total') or 0)
+        yield from response['result']
         
-        for product_data in products[:limit]:
-            bitrix_id = int(product_data['ID'])
+        next_start = response.get('next')
+        if next_start is None:
+            return
+        
+        params = {'order': order}
+        if filter_params:
+            params['filter'] = filter_params
+        if select_fields:
+            params['select'] = select_fields
+        
+        # Первая страница начинается с 0, поэтому next равен размеру страницы
+        starts = list(range(next_start, self.last_total, next_start))
+        envelopes = [starts[offset:offset + BATCH_MAX_COMMANDS] for offset in range(0, len(starts), BATCH_MAX_COMMANDS)]
+        
+        def fetch_envelope(envelope):
+            batch = BitrixBatch(self.client)
+            calls = [batch.add('crm.product.list', dict(params, start=start)) for start in envelope]
+            batch.execute()
+            return [call.get() for call in calls]
+        
+        # Конверты страниц независимы, поэтому запрашиваются параллельно в пределах лимита
+        for pages in self.client.map(fetch_envelope, envelopes):
+            for page in pages:
+                yield from page
+    
+    def sync_products_to_local(self, full=False, chunk_size=SYNC_CHUNK_SIZE, progress=None):
+        """
+        Синхронизировать товары из Битрикс24 в локальную базу.
+        
+        По умолчанию запрашиваются только товары, измененные после прошлой
+        успешной синхронизации (водяной знак по DATE_MODIFY). Раз в
+        PRODUCT_RECONCILE_INTERVAL дополнительно выполняется сверка по ID,
+        которая деактивирует удаленные в Битрикс24 товары.
+        
+        progress - необязательный callable, получающий счетчики после каждой пачки.
+        """
+        state, _ = ProductSyncState.objects.get_or_create(portal_domain=self.portal_domain)
+        started_at = timezone.now()
+        report = progress or (lambda **values: None)
+        
+        filter_params = None
+        if state.last_modified and not full:
+            watermark = state.last_modified - SYNC_WATERMARK_OVERLAP
+            filter_params = {'>DATE_MODIFY': timezone.localtime(watermark).isoformat()}
+        
+        counters = {'created': 0, 'updated': 0, 'rows_done': 0}
+        last_modified = state.last_modified
+        chunk = []
+        
+        def save_chunk():
+            created, updated = self._save_products_chunk(chunk)
+            counters['created'] += created
+            counters['updated'] += updated
+            counters['rows_done'] += len(chunk)
+            report(
+                stage='products',
+                pages_done=-(-counters['rows_done'] // BITRIX_PAGE_SIZE),
+                pages_total=-(-self.last_total // BITRIX_PAGE_SIZE),
+                **counters,
+            )
+        
+        report(stage='products', pages_done=0, pages_total=None, deactivated=0, **counters)
+        for product_data in self.iter_products(filter_params=filter_params, select_fields=PRODUCT_SYNC_SELECT):
+            modified = parse_datetime(product_data.get('DATE_MODIFY') or '')
+            if modified and (last_modified is None or modified > last_modified):
+                last_modified = modified
             
-            try:
-                product = Product.objects.get(bitrix_id=bitrix_id)
-                product.name = product_data.get('NAME', '')
-                product.description = product_data.get('DESCRIPTION', '')
-                product.price = float(product_data.get('PRICE', 0))
-                product.currency = product_data.get('CURRENCY_ID', 'RUB')
-                product.sort_order = int(product_data.get('SORT', 500))
-                product.save()
+            chunk.append(product_data)
+            if len(chunk) >= chunk_size:
+                save_chunk()
+                chunk = []
+        
+        if chunk:
+            save_chunk()
+        
+        if full or not state.last_reconciled_at or started_at - state.last_reconciled_at >= PRODUCT_RECONCILE_INTERVAL:
+            report(stage='reconcile')
+            report(deactivated=self.reconcile_deleted_products(chunk_size=chunk_size))
+            state.last_reconciled_at = started_at
+        
+        # Водяной знак сдвигается только после успешного завершения всего прохода.
+        # Страницы идут по ID, поэтому товар с уже пройденной страницы, измененный
+        # во время прохода, может оказаться старше максимума DATE_MODIFY; знак не
+        # выходит за начало прохода, и такие правки попадут в следующую дельту
+        if last_modified is not None and last_modified > started_at:
+            last_modified = started_at
+        state.last_modified = last_modified
+        state.last_synced_at = started_at
+        state.save(update_fields=['last_modified', 'last_synced_at', 'last_reconciled_at'])
+        report(stage='done')
+        
+        return counters['created'], counters['updated']
+    
+    def reconcile_deleted_products(self, chunk_size=SYNC_CHUNK_SIZE):
+        """
+        Деактивировать локальные товары, которых больше нет в Битрикс24.
+        
+        Запрашиваются только ID. Оба списка упорядочены по ID, поэтому
+        сравнение идет слиянием двух потоков и не держит каталог в памяти.
+        
+        Страницы списка выбираются по смещению, и удаление товара во время
+        обхода сдвигает следующие страницы, так что часть живых ID может
+        не попасть в выборку. Поэтому кандидаты на деактивацию перед записью
+        перепроверяются через crm.product.get.
+        """
+        remote_ids = (int(product_data['ID']) for product_data in self.iter_products(select_fields=['ID']))
+        local_ids = (
+            Product.objects.filter(is_active=True)
+            .order_by('bitrix_id')
+            .values_list('bitrix_id', flat=True)
+            .iterator(chunk_size=chunk_size)
+        )
+        
+        deactivated_count = 0
+        missing = []
+        remote_id = next(remote_ids, None)
+        for local_id in local_ids:
+            while remote_id is not None and remote_id < local_id:
+                remote_id = next(remote_ids, None)
+            if remote_id == local_id:
+                continue
+            
+            missing.append(local_id)
+            if len(missing) >= chunk_size:
+                deactivated_count += self.deactivate_products(self._confirm_deleted(missing))
+                missing = []
+        
+        if missing:
+            deactivated_count += self.deactivate_products(self._confirm_deleted(missing))
+        
+        return deactivated_count
+    
+    def _confirm_deleted(self, bitrix_ids):
+        """Оставить из bitrix_ids только товары, которых действительно нет в Битрикс24"""
+        products = self.get_products_by_id(bitrix_ids)
+        return [bitrix_id for bitrix_id in bitrix_ids if products[bitrix_id] is None]
+    
+    @staticmethod
+    def deactivate_products(bitrix_ids):
+        """Снять с публикации товары по списку bitrix_id"""
+        count = Product.objects.filter(bitrix_id__in=bitrix_ids, is_active=True).update(
+            is_active=False,
+            updated_at=timezone.now(),
+        )
+        if count:
+            products_changed.send(sender=Product, bitrix_ids=list(bitrix_ids))
+        return count
+    
+    def upsert_products(self, products_data):
+        """
+        Записать карточки товаров, полученные вне синхронизации (по событиям).
+        
+        Как и при синхронизации, пишутся только товары с изменившимся
+        content_hash, поэтому повторное событие не сдвигает updated_at и не
+        сбрасывает кеши. Возвращает (создано, обновлено).
+        """
+        return self._save_products_chunk(products_data)
+    
+    @staticmethod
+    def _product_fields(product_data):
+        """Преобразовать строку crm.product.list в поля модели Product"""
+        return {
+            'name': product_data.get('NAME') or '',
+            'description': product_data.get('DESCRIPTION') or '',
+            'price': Decimal(str(product_data.get('PRICE') or 0)),
+            'currency': product_data.get('CURRENCY_ID') or 'RUB',
+            'sort_order': int(product_data.get('SORT') or 500),
+            'is_active': True,
+        }
+    
+    def _save_products_chunk(self, chunk):
+        """
+        Записать пачку товаров: один запрос на выборку существующих bitrix_id,
+        затем bulk_create для новых и bulk_update только для изменившихся.
+        
+        Изменения определяются по content_hash, а обновляются только те
+        колонки, значения которых действительно поменялись. Если пачка не
+        содержит изменений, в базу не пишется ничего.
+        
+        Тот же товар может одновременно записывать поток событий run_jobs,
+        поэтому вставка новых идет как upsert по bitrix_id.
+        """
+        rows = {}
+        for product_data in chunk:
+            fields = self._product_fields(product_data)
+            fields['content_hash'] = product_content_hash(fields)
+            rows[int(product_data['ID'])] = fields
+        
+        existing = (
+            Product.objects.only('id', 'bitrix_id', 'content_hash', *PRODUCT_SYNC_MODEL_FIELDS)
+            .in_bulk(list(rows), field_name='bitrix_id')
+        )
+        
+        # bulk_update не вызывает pre_save, поэтому auto_now проставляем сами
+        now = timezone.now()
+        to_create = []
+        to_update = {}
+        updated_count = 0
+        for bitrix_id, fields in rows.items():
+            product = existing.get(bitrix_id)
+            if product is None:
+                to_create.append(Product(bitrix_id=bitrix_id, **fields))
+                continue
+            
+            if product.content_hash == fields['content_hash'] and product.is_active:
+                continue
+            
+            changed = tuple(
+                name for name in PRODUCT_SYNC_MODEL_FIELDS
+                if getattr(product, name) != fields[name]
+            )
+            for name, value in fields.items():
+                setattr(product, name, value)
+            
+            update_fields = ('content_hash',)
+            if changed:
+                # Пустой changed означает, что у строки просто еще не было хеша
+                product.updated_at = now
+                update_fields = changed + ('content_hash', 'updated_at')
                 updated_count += 1
-                
-            except Product.DoesNotExist:
-                Product.objects.create(
-                    bitrix_id=bitrix_id,
-                    name=product_data.get('NAME', ''),
-                    description=product_data.get('DESCRIPTION', ''),
-                    price=float(product_data.get('PRICE', 0)),
-                    currency=product_data.get('CURRENCY_ID', 'RUB'),
-                    sort_order=int(product_data.get('SORT', 500))
-                )
-                created_count += 1
-        
-        return created_count, updated_count
\ No newline at end of file
+            to_update.setdefault(update_fields, []).append(product)
+        
+        if to_create or to_update:
+            with transaction.atomic():
+                if to_create:
+                    Product.objects.bulk_create(
+                        to_create,
+                        update_conflicts=True,
+                        unique_fields=['bitrix_id'],
+                        update_fields=PRODUCT_SYNC_MODEL_FIELDS + ['content_hash', 'updated_at'],
+                    )
+                for update_fields, products in to_update.items():
+                    Product.objects.bulk_update(products, list(update_fields))
+        
+        changed_ids = [product.bitrix_id for product in to_create]
+        changed_ids += [
+            product.bitrix_id
+            for update_fields, products in to_update.items() if 'updated_at' in update_fields
+            for product in products
+        ]
+        if changed_ids:
+            products_changed.send(sender=Product, bitrix_ids=changed_ids)
+        
+        return len(to_create), updated_count
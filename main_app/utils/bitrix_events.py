@@ -0,0 +1,105 @@
+"""
+Обработка исходящих событий Битрикс24 по товарам (ONCRMPRODUCTADD/UPDATE/DELETE)
+"""
+import hmac
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from main_app.models import PendingProductEvent
+
+
+# Сколько ждать после последнего события по товару, прежде чем применить его.
+# За это время серия событий по одному ID схлопывается в одну запись.
+EVENT_COALESCE_WINDOW = timedelta(seconds=2)
+
+# Сколько событий применять за один проход воркера
+EVENT_BATCH_SIZE = 500
+
+# Как часто воркер проверяет очередь событий, с
+EVENT_POLL_INTERVAL = 1
+
+logger = logging.getLogger(__name__)
+
+
+def is_valid_application_token(application_token):
+    """Проверить application_token из события против токена, выданного при установке приложения"""
+    expected = getattr(settings, 'BITRIX_APPLICATION_TOKEN', None)
+    if not expected or not application_token:
+        return False
+    return hmac.compare_digest(str(expected), str(application_token))
+
+
+def record_product_event(portal_domain, bitrix_id, event):
+    """Запомнить событие; предыдущее необработанное событие по тому же товару заменяется"""
+    PendingProductEvent.objects.update_or_create(
+        portal_domain=portal_domain,
+        bitrix_id=bitrix_id,
+        defaults={'event': event, 'received_at': timezone.now()},
+    )
+
+
+def apply_pending_product_events(batch_size=EVENT_BATCH_SIZE):
+    """
+    Применить накопившиеся события к локальным товарам.
+    
+    Удаление деактивирует товар, добавление и изменение перечитывают карточку
+    товара (crm.product.get через batch) и записывают только изменившиеся.
+    События порталов без действующего токена администратора применить
+    нельзя; они удаляются, а изменения догонит синхронизация после
+    повторной установки приложения.
+    Возвращает количество обработанных событий.
+    """
+    from .bitrix_api import BitrixProductService, get_portal_token
+    
+    tokens = {}
+    for portal_domain in PendingProductEvent.objects.values_list('portal_domain', flat=True).distinct():
+        user_token = get_portal_token(portal_domain)
+        if user_token is not None:
+            tokens[portal_domain] = user_token
+            continue
+        dropped, _ = PendingProductEvent.objects.filter(portal_domain=portal_domain).delete()
+        logger.warning("Битрикс24: нет токена администратора портала %s, пропущено событий: %s", portal_domain, dropped)
+    
+    if not tokens:
+        return 0
+    
+    cutoff = timezone.now() - EVENT_COALESCE_WINDOW
+    events = list(
+        PendingProductEvent.objects
+        .filter(portal_domain__in=list(tokens), received_at__lte=cutoff)
+        .order_by('received_at')[:batch_size]
+    )
+    
+    by_portal = {}
+    for event in events:
+        by_portal.setdefault(event.portal_domain, []).append(event)
+    
+    processed = 0
+    for portal_domain, portal_events in by_portal.items():
+        service = BitrixProductService(tokens[portal_domain])
+        deleted_ids = [event.bitrix_id for event in portal_events if event.event == PendingProductEvent.EVENT_DELETE]
+        changed_ids = [event.bitrix_id for event in portal_events if event.event != PendingProductEvent.EVENT_DELETE]
+        
+        changed = []
+        for bitrix_id, product_data in service.get_products_by_id(changed_ids).items():
+            if product_data is None:
+                deleted_ids.append(bitrix_id)
+            else:
+                changed.append(product_data)
+        
+        if changed:
+            service.upsert_products(changed)
+        if deleted_ids:
+            service.deactivate_products(deleted_ids)
+        
+        # Событие, пришедшее во время обработки, сдвинуло received_at и останется в очереди
+        PendingProductEvent.objects.filter(
+            id__in=[event.id for event in portal_events],
+            received_at__lte=cutoff,
+        ).delete()
+        processed += len(portal_events)
+    
+    return processed
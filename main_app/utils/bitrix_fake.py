@@ -0,0 +1,233 @@
+"""
+Локальная замена REST API Битрикс24 для измерений и отладки без живого портала.
+
+FakeBitrixPortal реализует call_api_method для crm.product.list,
+crm.product.get, crm.product.add и batch, поэтому его можно передать в
+BitrixProductService вместо BitrixUserToken.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class FakeBitrixApiError(Exception):
+    """Ошибка в том же виде, в каком ее отдает BitrixUserToken.call_api_method"""
+    
+    def __init__(self, error, description=''):
+        self.error = error
+        self.description = description
+        super().__init__(f"{error}: {description}")
+
+
+def parse_query(query):
+    """Разобрать строку команды batch обратно во вложенные параметры (обратно build_query)"""
+    params = {}
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        node = params
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _lists_from_dicts(params)
+
+
+def _lists_from_dicts(value):
+    """{'0': 'ID', '1': 'NAME'} -> ['ID', 'NAME'], как это делает PHP"""
+    if not isinstance(value, dict):
+        return value
+    value = {key: _lists_from_dicts(item) for key, item in value.items()}
+    if value and all(key.isdigit() for key in value):
+        return [value[key] for key in sorted(value, key=int)]
+    return value
+
+
+class FakeBitrixPortal:
+    """
+    Портал Битрикс24 в памяти.
+    
+    catalog_size - количество товаров (генерируются по ID, в памяти хранятся только изменения);
+    latency - задержка одного HTTP-запроса, с;
+    command_latency - дополнительная задержка на каждую команду внутри batch, с;
+    page_size - размер страницы списочных методов;
+    rate, burst - лимит запросов в секунду и размер запаса, при превышении
+    отдается QUERY_LIMIT_EXCEEDED (None - без ограничений).
+    """
+    
+    def __init__(self, catalog_size=1000, latency=0.0, command_latency=0.0, page_size=50,
+                 rate=None, burst=50, domain='fake.bitrix24.local'):
+        self.catalog_size = catalog_size
+        self.latency = latency
+        self.command_latency = command_latency
+        self.page_size = page_size
+        self.rate = rate
+        self.burst = burst
+        
+        # Совместимость с BitrixUserToken: BitrixProductService берет домен из user.portal.domain
+        self.user = SimpleNamespace(portal=SimpleNamespace(domain=domain))
+        
+        self.base_modified = (timezone.now() - timedelta(days=30)).replace(microsecond=0)
+        self.overrides = {}
+        self.deleted = set()
+        self.last_id = catalog_size
+        self._ids = None
+        
+        self.calls = 0
+        self.method_calls = Counter()
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.tokens_updated = time.monotonic()
+    
+    # Изменение каталога
+    
+    def touch(self, bitrix_id, **fields):
+        """Изменить товар, как если бы его отредактировали в Битрикс24"""
+        product = self._product(bitrix_id)
+        product.update(fields)
+        product['DATE_MODIFY'] = timezone.localtime().isoformat()
+        self.overrides[bitrix_id] = product
+    
+    def delete(self, bitrix_id):
+        """Удалить товар"""
+        self.deleted.add(bitrix_id)
+        self.overrides.pop(bitrix_id, None)
+        self._ids = None
+    
+    # REST API
+    
+    def call_api_method(self, method, params=None):
+        with self.lock:
+            self.calls += 1
+            self.method_calls[method] += 1
+            self._take_token()
+        
+        if self.latency:
+            time.sleep(self.latency)
+        
+        if method == 'batch':
+            return self._batch(params or {})
+        result, extra = self._call(method, params or {})
+        return {'result': result, **extra}
+    
+    def _take_token(self):
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.tokens_updated) * self.rate)
+        self.tokens_updated = now
+        if self.tokens < 1:
+            self.throttled += 1
+            raise FakeBitrixApiError('QUERY_LIMIT_EXCEEDED', 'Too many requests')
+        self.tokens -= 1
+    
+    def _batch(self, params):
+        results, errors, totals, nexts = {}, {}, {}, {}
+        for key, command in (params.get('cmd') or {}).items():
+            method, _, query = command.partition('?')
+            with self.lock:
+                self.method_calls[method] += 1
+            if self.command_latency:
+                time.sleep(self.command_latency)
+            
+            try:
+                result, extra = self._call(method, parse_query(query))
+            except FakeBitrixApiError as e:
+                errors[key] = {'error': e.error, 'error_description': e.description}
+                if str(params.get('halt')) == '1':
+                    break
+                continue
+            
+            results[key] = result
+            if 'total' in extra:
+                totals[key] = extra['total']
+            if 'next' in extra:
+                nexts[key] = extra['next']
+        
+        # PHP отдает пустые массивы списком
+        return {'result': {
+            'result': results or [],
+            'result_error': errors or [],
+            'result_total': totals or [],
+            'result_next': nexts or [],
+        }}
+    
+    def _call(self, method, params):
+        if method == 'crm.product.list':
+            return self._list(params)
+        if method == 'crm.product.get':
+            bitrix_id = int(params.get('id') or 0)
+            if not self._exists(bitrix_id):
+                raise FakeBitrixApiError('NOT_FOUND', 'Not found')
+            return self._product(bitrix_id), {}
+        if method == 'crm.product.add':
+            with self.lock:
+                self.last_id += 1
+                bitrix_id = self.last_id
+                self._ids = None
+            self.touch(bitrix_id, **(params.get('fields') or {}))
+            return bitrix_id, {}
+        raise FakeBitrixApiError('ERROR_METHOD_NOT_FOUND', f'Method not found: {method}')
+    
+    def _list(self, params):
+        ids = self._sorted_ids()
+        
+        watermark = (params.get('filter') or {}).get('>DATE_MODIFY')
+        if watermark:
+            # Нетронутые товары имеют DATE_MODIFY = base_modified + ID секунд,
+            # поэтому под фильтр попадает хвост списка ID
+            watermark = parse_datetime(watermark)
+            first_id = int((watermark - self.base_modified).total_seconds()) + 1
+            ids = set(ids[bisect_left(ids, first_id):]) - set(self.overrides)
+            ids.update(
+                bitrix_id for bitrix_id, product in self.overrides.items()
+                if parse_datetime(product['DATE_MODIFY']) > watermark
+            )
+            ids = sorted(ids)
+        
+        start = int(params.get('start') or 0)
+        select = params.get('select')
+        page = [self._product(bitrix_id, select) for bitrix_id in ids[start:start + self.page_size]]
+        
+        extra = {'total': len(ids)}
+        if start + self.page_size < len(ids):
+            extra['next'] = start + self.page_size
+        return page, extra
+    
+    def _sorted_ids(self):
+        with self.lock:
+            if self._ids is None:
+                ids = range(1, self.last_id + 1)
+                if self.deleted:
+                    ids = (bitrix_id for bitrix_id in ids if bitrix_id not in self.deleted)
+                self._ids = list(ids)
+            return self._ids
+    
+    def _exists(self, bitrix_id):
+        return 0 < bitrix_id <= self.last_id and bitrix_id not in self.deleted
+    
+    def _product(self, bitrix_id, select=None):
+        product = self.overrides.get(bitrix_id)
+        if product is None:
+            product = {
+                'ID': str(bitrix_id),
+                'NAME': f'Товар {bitrix_id}',
+                'DESCRIPTION': f'Описание товара {bitrix_id}',
+                'PRICE': f'{bitrix_id % 10000}.{bitrix_id % 100:02d}',
+                'CURRENCY_ID': 'RUB',
+                'SORT': str(500 + bitrix_id % 10),
+                'DATE_MODIFY': timezone.localtime(self.base_modified + timedelta(seconds=bitrix_id)).isoformat(),
+            }
+        else:
+            product = dict(product)
+        
+        if select:
+            product = {key: value for key, value in product.items() if key in select}
+        return product
@@ -0,0 +1,59 @@
+"""
+Потокобезопасный LRU-кеш в памяти процесса с ограничением времени жизни записей
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """LRU на maxsize записей; записи старше ttl секунд считаются отсутствующими"""
+    
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or (item[1] is not None and item[1] < time.monotonic()):
+                if item is not None:
+                    del self.data[key]
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+    
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+        return default if item is None else item[0]
+    
+    def discard_if(self, predicate):
+        """Удалить записи, значение которых удовлетворяет predicate"""
+        with self.lock:
+            keys = [key for key, (value, _) in self.data.items() if predicate(value)]
+            for key in keys:
+                del self.data[key]
+        return len(keys)
+    
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+    
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,93 @@
+"""
+Раскладка медиафайлов по шардам и поиск файлов без ссылок из базы.
+
+Файлы кладутся в каталоги по первым символам хеша: qr_codes/ab/cd/<hash>.png,
+поэтому ни в одном каталоге не набирается сотен тысяч файлов и листинг,
+бэкап и rsync остаются быстрыми.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.utils.deconstruct import deconstructible
+
+
+QR_CODES_PREFIX = 'qr_codes'
+PRODUCTS_PREFIX = 'products'
+
+# Файловые поля, ссылающиеся на медиафайлы: (каталог, модель, поле)
+MEDIA_REFERENCES = [
+    (QR_CODES_PREFIX, 'main_app.QRImage', 'image'),
+    (QR_CODES_PREFIX, 'main_app.QRCodeLink', 'qr_code_image'),
+    (PRODUCTS_PREFIX, 'main_app.Product', 'detail_image'),
+]
+
+SHARDED_NAME = re.compile(r'^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$')
+
+
+def shard_name(prefix, key, ext):
+    """Имя файла в шарде: prefix/ab/cd/<key><ext>, key - hex-хеш"""
+    return f'{prefix}/{key[:2]}/{key[2:4]}/{key}{ext.lower()}'
+
+
+def is_sharded(name):
+    return bool(SHARDED_NAME.match(name))
+
+
+def name_key(name):
+    """Стабильный ключ шарда для уже сохраненного файла (для переноса в шарды)"""
+    return hashlib.sha1(name.encode()).hexdigest()
+
+
+@deconstructible
+class ShardedUploadTo:
+    """
+    upload_to для файловых полей. У QRImage ключом служит digest, поэтому
+    одинаковые QR-коды попадают в одно и то же место; остальным файлам
+    достается случайный ключ.
+    """
+    
+    def __init__(self, prefix):
+        self.prefix = prefix
+    
+    def __call__(self, instance, filename):
+        key = getattr(instance, 'digest', None) or uuid.uuid4().hex
+        return shard_name(self.prefix, key, os.path.splitext(filename)[1])
+    
+    def __eq__(self, other):
+        return isinstance(other, ShardedUploadTo) and self.prefix == other.prefix
+
+
+def walk_storage(storage, prefix):
+    """Имена всех файлов под каталогом хранилища, без загрузки всего списка в память"""
+    try:
+        directories, files = storage.listdir(prefix)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f'{prefix}/{name}'
+    for directory in directories:
+        yield from walk_storage(storage, f'{prefix}/{directory}')
+
+
+def referenced_names(names):
+    """Какие из переданных имен файлов упоминаются в базе"""
+    from django.apps import apps
+    
+    referenced = set()
+    for _, model_label, field in MEDIA_REFERENCES:
+        model = apps.get_model(model_label)
+        referenced.update(model.objects.filter(**{f'{field}__in': names}).values_list(field, flat=True))
+    return referenced
+
+
+def delete_file_on_commit(storage, name):
+    """Удалить файл после фиксации транзакции, если на него больше никто не ссылается"""
+    from django.db import transaction
+    
+    def delete():
+        if name and not referenced_names([name]):
+            storage.delete(name)
+    
+    transaction.on_commit(delete)
@@ -0,0 +1,245 @@
+"""
+Метрики производительности запросов в памяти процесса.
+
+PerformanceMiddleware (main_app.middleware) для выбранной доли запросов
+(METRICS_SAMPLE_RATE) заводит RequestMetrics в contextvar, и все, что
+выполняется внутри запроса, дописывает в него свое время: SQL-запросы
+(execute_wrapper на соединениях), отрисовка шаблонов (TimedDjangoTemplates),
+вызовы REST API Битрикс24 и отрисовка QR-кодов (timed). После ответа данные
+сливаются в registry по имени URL и отдаются в текстовом формате Prometheus.
+
+Вне выбранного запроса timed и обертки только проверяют contextvar; при
+METRICS_SAMPLE_RATE = 0 middleware и обертка SQL не подключаются вовсе.
+
+Счетчики свои у каждого процесса (воркера gunicorn/uvicorn).
+"""
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+
+# Доля запросов, для которых собираются метрики: 0 - выключено, 1 - все
+METRICS_SAMPLE_RATE = getattr(settings, 'METRICS_SAMPLE_RATE', 0)
+
+# Запросы дольше стольких миллисекунд пишутся в лог вместе с самыми долгими SQL; None - не писать
+METRICS_SLOW_REQUEST_MS = getattr(settings, 'METRICS_SLOW_REQUEST_MS', None)
+
+# Сколько SQL-выражений показывать в записи о медленном запросе
+METRICS_SLOW_TOP_SQL = 5
+
+# Границы корзин гистограммы длительности запросов, с
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Участки запроса, время которых считается отдельно
+SECTIONS = ('template', 'bitrix', 'qr')
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Время одного запроса по участкам; statements - SQL-выражения для лога медленных запросов"""
+    
+    def __init__(self, collect_statements=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.sections = {name: [0, 0.0] for name in SECTIONS}
+        self.statements = {} if collect_statements else None
+    
+    def add_query(self, sql, elapsed):
+        self.queries += 1
+        self.query_time += elapsed
+        if self.statements is not None:
+            stat = self.statements.setdefault(sql, [0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+    
+    def add(self, section, elapsed):
+        stat = self.sections[section]
+        stat[0] += 1
+        stat[1] += elapsed
+    
+    def top_statements(self, limit=METRICS_SLOW_TOP_SQL):
+        """Самые долгие SQL-выражения: (суммарное время, число выполнений, текст)"""
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [(seconds, count, sql) for sql, (count, seconds) in ranked[:limit]]
+
+
+def start_request(collect_statements=False):
+    metrics = RequestMetrics(collect_statements)
+    return metrics, _current.set(metrics)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'section', 'started')
+    
+    def __init__(self, metrics, section):
+        self.metrics = metrics
+        self.section = section
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+    
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.section, time.perf_counter() - self.started)
+
+
+class _NoTimer:
+    __slots__ = ()
+    
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+def timed(section):
+    """Контекстный менеджер: засчитать время блока участку section текущего запроса"""
+    metrics = _current.get()
+    if metrics is None:
+        return _no_timer
+    return _Timer(metrics, section)
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def _install_on_connection(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def install_query_timer():
+    """
+    Подключить обертку SQL ко всем соединениям, в том числе открываемым
+    позже в других потоках (sync_to_async, пул потоков)
+    """
+    connection_created.connect(_install_on_connection, dispatch_uid='main_app.metrics')
+    for connection in connections.all(initialized_only=True):
+        _install_on_connection(connection)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django, засчитывающий время отрисовки шаблонов текущему запросу"""
+    
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+    
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class MetricsRegistry:
+    """Накопленные метрики по именам URL"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+    
+    def record(self, view, elapsed, metrics):
+        with self.lock:
+            stat = self.views.get(view)
+            if stat is None:
+                stat = self.views[view] = {
+                    'buckets': [0] * len(LATENCY_BUCKETS),
+                    'count': 0,
+                    'sum': 0.0,
+                    'queries': 0,
+                    'query_time': 0.0,
+                    'sections': {name: [0, 0.0] for name in SECTIONS},
+                }
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    stat['buckets'][index] += 1
+            stat['count'] += 1
+            stat['sum'] += elapsed
+            stat['queries'] += metrics.queries
+            stat['query_time'] += metrics.query_time
+            for name, (calls, seconds) in metrics.sections.items():
+                stat['sections'][name][0] += calls
+                stat['sections'][name][1] += seconds
+    
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: dict(stat, buckets=list(stat['buckets']), sections={
+                    name: list(values) for name, values in stat['sections'].items()
+                })
+                for view, stat in self.views.items()
+            }
+    
+    def exposition(self):
+        """Метрики в текстовом формате Prometheus"""
+        views = sorted(self.snapshot().items())
+        lines = [
+            '# HELP app_metrics_sample_rate Share of requests measured by this process.',
+            '# TYPE app_metrics_sample_rate gauge',
+            f'app_metrics_sample_rate {_number(METRICS_SAMPLE_RATE)}',
+            '# HELP app_http_request_duration_seconds Request latency by URL name.',
+            '# TYPE app_http_request_duration_seconds histogram',
+        ]
+        for view, stat in views:
+            label = f'view="{_escape(view)}"'
+            for bound, count in zip(LATENCY_BUCKETS, stat['buckets']):
+                lines.append(f'app_http_request_duration_seconds_bucket{{{label},le="{_number(bound)}"}} {count}')
+            lines.append(f'app_http_request_duration_seconds_bucket{{{label},le="+Inf"}} {stat["count"]}')
+            lines.append(f'app_http_request_duration_seconds_sum{{{label}}} {_number(stat["sum"])}')
+            lines.append(f'app_http_request_duration_seconds_count{{{label}}} {stat["count"]}')
+        
+        counters = [
+            ('app_db_queries_total', 'SQL queries executed.', lambda stat: stat['queries']),
+            ('app_db_query_seconds_total', 'Time spent in SQL queries.', lambda stat: stat['query_time']),
+            ('app_template_render_seconds_total', 'Time spent rendering templates.', lambda stat: stat['sections']['template'][1]),
+            ('app_bitrix_api_calls_total', 'Bitrix24 REST API calls.', lambda stat: stat['sections']['bitrix'][0]),
+            ('app_bitrix_api_seconds_total', 'Time spent in Bitrix24 REST API calls.', lambda stat: stat['sections']['bitrix'][1]),
+            ('app_qr_renders_total', 'QR codes rendered.', lambda stat: stat['sections']['qr'][0]),
+            ('app_qr_render_seconds_total', 'Time spent rendering QR codes.', lambda stat: stat['sections']['qr'][1]),
+        ]
+        for name, help_text, value in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for view, stat in views:
+                lines.append(f'{name}{{view="{_escape(view)}"}} {_number(value(stat))}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,36 @@
+"""
+Кеш отрисованной публичной страницы товара.
+
+Ключ содержит ID товара и его updated_at, поэтому любое изменение товара
+дает новый ключ, а старые версии просто вытесняются по таймауту.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+QR_PAGE_CACHE_TIMEOUT = getattr(settings, 'QR_PAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def product_page_version(resolved):
+    return f'{resolved.product_id}:{int(resolved.product_updated_at.timestamp() * 1000000)}'
+
+
+def product_page_etag(resolved):
+    """ETag страницы: версия товара и состояние QR-ссылки"""
+    return f'"{product_page_version(resolved)}:{resolved.qr_link_id or 0}:{int(resolved.link_active)}"'
+
+
+def get_cached_product_page(resolved):
+    return cache.get(f'product_page:{product_page_version(resolved)}')
+
+
+def cache_product_page(resolved, html):
+    cache.set(f'product_page:{product_page_version(resolved)}', html, QR_PAGE_CACHE_TIMEOUT)
+
+
+async def aget_cached_product_page(resolved):
+    return await cache.aget(f'product_page:{product_page_version(resolved)}')
+
+
+async def acache_product_page(resolved, html):
+    await cache.aset(f'product_page:{product_page_version(resolved)}', html, QR_PAGE_CACHE_TIMEOUT)
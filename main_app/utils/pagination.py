@@ -0,0 +1,163 @@
+"""
+Постраничный вывод по ключу (keyset) вместо OFFSET.
+
+Следующая страница выбирается условием "строго после последней строки" по
+полям сортировки, поэтому глубокие страницы стоят столько же, сколько
+первая, а COUNT(*) по всей выборке не нужен: для заголовка берется оценка
+из статистики PostgreSQL.
+
+Курсор - подписанные значения полей сортировки граничной строки и
+направление; подделанный или устаревший курсор дает первую страницу.
+Поля сортировки не должны содержать NULL, последним полем должен идти
+уникальный id.
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django.core import signing
+from django.db import connection
+from django.db.models import Q
+
+
+CURSOR_SALT = 'main_app.pagination'
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class KeysetPage:
+    """Страница выдачи: строки, наличие соседних страниц и курсоры к ним"""
+    
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next = has_next
+        self.has_previous = has_previous
+    
+    def __iter__(self):
+        return iter(self.object_list)
+    
+    def __len__(self):
+        return len(self.object_list)
+    
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+    
+    @property
+    def next_cursor(self):
+        return self.paginator.cursor(self.object_list[-1], FORWARD) if self.has_next else None
+    
+    @property
+    def previous_cursor(self):
+        return self.paginator.cursor(self.object_list[0], BACKWARD) if self.has_previous else None
+    
+    @property
+    def last_cursor(self):
+        return self.paginator.last_cursor()
+
+
+class KeysetPaginator:
+    """
+    ordering - поля сортировки, как в order_by: ('sort_order', 'name', 'id')
+    или ('-created_at', '-id'). Поддерживаются и аннотации queryset.
+    """
+    
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+    
+    def get_page(self, cursor=None):
+        direction, values = self.decode(cursor)
+        ordering = self.ordering if direction == FORWARD else [_reverse(field) for field in self.ordering]
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(_after(ordering, values))
+        
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == FORWARD:
+            return KeysetPage(rows, self, has_next=has_more, has_previous=values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, has_next=values is not None, has_previous=has_more)
+    
+    def cursor(self, row, direction):
+        values = [_value(row, field.lstrip('-')) for field in self.ordering]
+        return signing.dumps([direction, [_encode(value) for value in values]], salt=CURSOR_SALT)
+    
+    def last_cursor(self):
+        return signing.dumps([BACKWARD, None], salt=CURSOR_SALT)
+    
+    def decode(self, cursor):
+        if not cursor:
+            return FORWARD, None
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            return FORWARD, None
+        if direction not in (FORWARD, BACKWARD) or (values is not None and len(values) != len(self.ordering)):
+            return FORWARD, None
+        return direction, values
+    
+    @property
+    def approximate_count(self):
+        return approximate_count(self.queryset)
+
+
+def _reverse(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def _value(row, field):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+def _encode(value):
+    """Значение поля для курсора; даты - с микросекундами, иначе граничная строка не совпадет"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def _after(ordering, values):
+    """Условие "строго после строки с values" для сортировки ordering"""
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def approximate_count(queryset):
+    """
+    Примерное число строк выборки. На PostgreSQL - оценка планировщика
+    (без фильтров - reltuples из статистики таблицы), на остальных базах - COUNT(*).
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    
+    queryset = queryset.order_by()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return row[0]
+            return queryset.count()
+        sql, params = queryset.values('pk').query.sql_with_params()
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
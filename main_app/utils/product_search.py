@@ -0,0 +1,185 @@
+"""
+Поиск товаров по названию и описанию с учетом опечаток и ранжированием.
+
+На PostgreSQL используются триграммы pg_trgm: условие word_similarity и
+ILIKE обслуживаются GIN-индексами (миграции 0014 и 0016), поэтому время ответа
+автокомплита не растет вместе с каталогом. На остальных базах (SQLite в
+разработке и тестах) работает инвертированный индекс триграмм в памяти
+процесса, который перестраивается при изменении каталога.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, Count, FloatField, Max, Q, Value, When
+from django.db.models.functions import Greatest
+
+
+# Вес совпадения в описании относительно совпадения в названии
+DESCRIPTION_WEIGHT = 0.5
+
+# Минимальная доля триграмм запроса, найденных в поле, чтобы считать товар совпадением
+MIN_SIMILARITY = 0.5
+
+# Сколько лучших совпадений ранжировать в резервном индексе
+FALLBACK_CANDIDATES = 500
+
+WORD = re.compile(r'\w+')
+
+
+def trigrams(text):
+    """Триграммы слов как в pg_trgm: нижний регистр, слово дополнено пробелами"""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = f'  {word} '
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+def similarity(query_grams, lowered, name, name_grams, description_grams):
+    """
+    Релевантность товара в резервном индексе: доля триграмм запроса, найденных
+    в поле (близко к word_similarity в pg_trgm); запрос целиком в названии - 1.0
+    """
+    score = max(
+        len(query_grams & name_grams) / len(query_grams),
+        len(query_grams & description_grams) / len(query_grams) * DESCRIPTION_WEIGHT,
+    )
+    if lowered in name:
+        score = max(score, 1.0)
+    return score
+
+
+def best_matches_in_memory(query, rows, limit):
+    """
+    Начало выдачи search_products для query, отобранное из полного списка
+    совпадений более короткого префикса (строки с ключами id, name, sort_order),
+    или None, если без базы его не восстановить.
+    
+    На PostgreSQL релевантность считает pg_trgm, в памяти ее не повторить.
+    В резервном индексе наибольшая релевантность 1.0 достается только по
+    названию, а такие товары всегда есть в списке префикса. Если их хватает
+    на limit строк, выдача совпадает с поиском в базе: порядок внутри
+    одинаковой релевантности задают sort_order, name, id.
+    """
+    if connection.vendor == 'postgresql':
+        return None
+    query_grams = trigrams(query)
+    if not query_grams:
+        return None
+    lowered = query.lower()
+    rows = sorted(
+        (
+            row for row in rows
+            if similarity(query_grams, lowered, row['name'].lower(), trigrams(row['name']), set()) >= 1.0
+        ),
+        key=lambda row: (row['sort_order'], row['name'], row['id']),
+    )
+    return rows if len(rows) >= limit else None
+
+
+def search_products(queryset, query):
+    """Отфильтровать товары по запросу и упорядочить по релевантности"""
+    query = query.strip()
+    if not query:
+        return queryset
+    if connection.vendor == 'postgresql':
+        return _search_postgres(queryset, query)
+    return _search_fallback(queryset, query)
+
+
+def _search_postgres(queryset, query):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    
+    rank = Greatest(
+        TrigramWordSimilarity(query, 'name'),
+        TrigramWordSimilarity(query, 'description') * DESCRIPTION_WEIGHT,
+    )
+    return queryset.filter(
+        Q(name__icontains=query)
+        | Q(name__trigram_word_similar=query)
+        | Q(description__icontains=query)
+        | Q(description__trigram_word_similar=query)
+    ).annotate(search_rank=rank).order_by('-search_rank', 'sort_order', 'name')
+
+
+def _search_fallback(queryset, query):
+    ranked = product_index.search(query, FALLBACK_CANDIDATES)
+    if not ranked:
+        return queryset.none()
+    rank = Case(
+        *[When(id=product_id, then=Value(score)) for product_id, score in ranked],
+        output_field=FloatField(),
+    )
+    return queryset.filter(id__in=[product_id for product_id, _ in ranked]).annotate(
+        search_rank=rank,
+    ).order_by('-search_rank', 'sort_order', 'name')
+
+
+class TrigramIndex:
+    """
+    Инвертированный индекс триграмм по названиям и описаниям товаров.
+    
+    Индекс строится целиком и заменяется атомарно; актуальность проверяется
+    дешевым агрегатом (число товаров и последний updated_at), поэтому
+    изменения из других процессов тоже подхватываются.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        # (postings, documents) заменяются одним присваиванием, чтобы поиск не видел половину нового индекса
+        self.state = ({}, {})
+    
+    def search(self, query, limit):
+        self.refresh()
+        postings, documents = self.state
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        
+        # Кандидаты - товары, содержащие хотя бы одну триграмму запроса
+        hits = defaultdict(int)
+        for gram in query_grams:
+            for product_id in postings.get(gram, ()):
+                hits[product_id] += 1
+        threshold = MIN_SIMILARITY * len(query_grams)
+        
+        lowered = query.lower()
+        scored = []
+        for product_id, shared in hits.items():
+            if shared < threshold:
+                continue
+            score = similarity(query_grams, lowered, *documents[product_id])
+            if score >= MIN_SIMILARITY * DESCRIPTION_WEIGHT:
+                scored.append((product_id, score))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+    
+    def refresh(self):
+        from main_app.models import Product
+        
+        signature = tuple(Product.objects.aggregate(count=Count('id'), updated=Max('updated_at')).values())
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            postings = defaultdict(set)
+            documents = {}
+            for product_id, name, description in Product.objects.values_list('id', 'name', 'description').iterator():
+                name_grams, description_grams = trigrams(name), trigrams(description or '')
+                for gram in name_grams | description_grams:
+                    postings[gram].add(product_id)
+                documents[product_id] = (name.lower(), name_grams, description_grams)
+            self.state = (dict(postings), documents)
+            self.signature = signature
+    
+    def clear(self):
+        with self.lock:
+            self.signature = None
+            self.state = ({}, {})
+
+
+product_index = TrigramIndex()
@@ -0,0 +1,240 @@
+"""
+Массовая генерация QR-кодов для выборки товаров (фоновая задача qr_bulk).
+
+Ссылки создаются окнами через bulk_create (товары с действующей ссылкой
+получают ее же, см. qr_store.reusable_links), картинки рисуются в пуле
+процессов (qrcode и Pillow упираются в GIL), результат пишется потоком в
+ZIP или многостраничный PDF с листами наклеек. В памяти одновременно
+находится только одно окно, поэтому 50 тысяч кодов не требуют 50 тысяч
+картинок в памяти.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .qr_encoder import matrix_to_image, qr_matrix
+from .product_search import search_products
+from .qr_generator import generate_product_qr_url, generate_qr_code
+from .qr_store import reusable_links
+from .signer import signer
+
+
+QR_BULK_WORKERS = getattr(settings, 'QR_BULK_WORKERS', None) or os.cpu_count()
+
+# Сколько хранить готовые архивы и PDF; потом файл удаляется, задача остается в истории
+QR_BULK_OUTPUT_TTL = getattr(settings, 'QR_BULK_OUTPUT_TTL', timedelta(days=7))
+
+# Сколько кодов создавать и рисовать за одно окно
+QR_BULK_WINDOW = 1000
+
+OUTPUT_ZIP = 'zip'
+OUTPUT_PDF = 'pdf'
+
+SCOPE_IDS = 'ids'
+SCOPE_QUERY = 'query'
+SCOPE_ACTIVE = 'active'
+
+# Лист наклеек: A4 при 150 dpi, 4 x 6 наклеек
+LABEL_PAGE_SIZE = (1240, 1754)
+LABEL_COLUMNS = 4
+LABEL_ROWS = 6
+LABEL_MARGIN = 40
+LABELS_PER_PAGE = LABEL_COLUMNS * LABEL_ROWS
+LABEL_PAGE_DPI = 150
+
+# Шрифт подписей; без кириллического TrueType-шрифта Pillow возьмет встроенный
+QR_LABEL_FONT = getattr(settings, 'QR_LABEL_FONT', 'DejaVuSans.ttf')
+
+logger = logging.getLogger(__name__)
+
+
+def select_products(scope, bitrix_ids=None, query=None):
+    """Выборка товаров для массовой генерации"""
+    from main_app.models import Product
+    
+    products = Product.objects.filter(is_active=True)
+    if scope == SCOPE_IDS:
+        products = products.filter(bitrix_id__in=bitrix_ids or [])
+    elif scope == SCOPE_QUERY:
+        # Тот же поиск, что и в списке товаров, иначе выгрузка разойдется с тем, что видел пользователь
+        products = search_products(products, query or '')
+    return products
+
+
+def render_pool():
+    """
+    Пул процессов отрисовки. Процессы запускаются через spawn: у воркера
+    run_jobs уже работают потоки событий и счетчиков и открыто соединение
+    с базой, а fork скопировал бы их в дочерние процессы.
+    """
+    return ProcessPoolExecutor(
+        max_workers=QR_BULK_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+def render_qr_png(payload):
+    """Нарисовать один QR-код (выполняется в процессе пула)"""
+    return generate_qr_code(payload).getvalue()
+
+
+def render_label_page(labels):
+    """Нарисовать лист наклеек [(payload, подпись), ...] (выполняется в процессе пула)"""
+    from PIL import Image, ImageDraw, ImageFont
+    
+    try:
+        font = ImageFont.truetype(QR_LABEL_FONT, 18)
+    except OSError:
+        font = ImageFont.load_default()
+    
+    # Лист 1-битный: в PDF страница занимает десятки килобайт вместо сотен
+    page = Image.new('1', LABEL_PAGE_SIZE, 1)
+    draw = ImageDraw.Draw(page)
+    cell_width = (LABEL_PAGE_SIZE[0] - 2 * LABEL_MARGIN) // LABEL_COLUMNS
+    cell_height = (LABEL_PAGE_SIZE[1] - 2 * LABEL_MARGIN) // LABEL_ROWS
+    qr_side = min(cell_width, cell_height) - 50
+    
+    for index, (payload, caption) in enumerate(labels):
+        left = LABEL_MARGIN + (index % LABEL_COLUMNS) * cell_width
+        top = LABEL_MARGIN + (index // LABEL_COLUMNS) * cell_height
+        # Картинка берется прямо из матрицы, без промежуточного PNG
+        qr = matrix_to_image(qr_matrix(payload, border=2), 1)
+        qr = qr.resize((qr_side, qr_side), Image.NEAREST)
+        page.paste(qr, (left + (cell_width - qr_side) // 2, top))
+        draw.text((left + cell_width // 2, top + qr_side + 8), caption, fill=0, font=font, anchor='ma')
+    return page
+
+
+def label_caption(name, bitrix_id):
+    name = name if len(name) <= 28 else name[:27] + '…'
+    return f'{name} ({bitrix_id})'
+
+
+def generate_bulk(params, output_name, progress):
+    """
+    Создать QR-ссылки для выборки товаров и собрать архив или PDF.
+    Возвращает имя файла в default_storage.
+    """
+    from main_app.models import QRCodeLink
+    
+    products = select_products(params['scope'], params.get('bitrix_ids'), params.get('query'))
+    total = products.count()
+    output_format = params.get('output', OUTPUT_ZIP)
+    window = QR_BULK_WINDOW if output_format == OUTPUT_ZIP else LABELS_PER_PAGE * 10
+    progress(stage='render', done=0, total=total)
+    
+    with tempfile.NamedTemporaryFile(suffix=f'.{output_format}') as output, render_pool() as executor:
+        writer = ZipWriter(output) if output_format == OUTPUT_ZIP else PdfWriter(output)
+        done = 0
+        last_id = 0
+        while True:
+            rows = list(
+                products.filter(id__gt=last_id).order_by('id').values_list('id', 'bitrix_id', 'name')[:window]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            existing = {}
+            for link in reusable_links([row[0] for row in rows]).only('id', 'product_id', 'signed_token'):
+                existing.setdefault(link.product_id, link)
+            missing = [row[0] for row in rows if row[0] not in existing]
+            if missing:
+                with transaction.atomic():
+                    created = QRCodeLink.objects.bulk_create([QRCodeLink(product_id=product_id) for product_id in missing])
+                    for link in created:
+                        link.signed_token = signer.create_link_token(link.id)
+                    QRCodeLink.objects.bulk_update(created, ['signed_token'])
+                existing.update((link.product_id, link) for link in created)
+            links = [existing[row[0]] for row in rows]
+            
+            labels = [
+                (generate_product_qr_url(link.signed_token), bitrix_id, name, link.id)
+                for link, (_, bitrix_id, name) in zip(links, rows)
+            ]
+            writer.write(executor, labels)
+            
+            done += len(rows)
+            progress(stage='render', done=done, total=total)
+        writer.close()
+        
+        output.seek(0)
+        progress(stage='save', done=done, total=total)
+        return default_storage.save(output_name, File(output))
+
+
+def expire_bulk_outputs():
+    """Удалить файлы результатов, хранящиеся дольше QR_BULK_OUTPUT_TTL"""
+    from main_app.models import BackgroundJob
+    
+    jobs = BackgroundJob.objects.filter(
+        kind=BackgroundJob.KIND_QR_BULK,
+        status=BackgroundJob.STATUS_DONE,
+        finished_at__lt=timezone.now() - QR_BULK_OUTPUT_TTL,
+        progress__has_key='output',
+    )
+    expired = 0
+    for job in jobs.iterator():
+        output = job.progress.pop('output')
+        if output:
+            default_storage.delete(output)
+        job.progress['expired'] = True
+        BackgroundJob.objects.filter(id=job.id).update(progress=job.progress)
+        expired += 1
+    if expired:
+        logger.info("Удалено устаревших результатов массовой генерации: %s", expired)
+    return expired
+
+
+class ZipWriter:
+    """Архив PNG-файлов; PNG уже сжат, поэтому записи хранятся без сжатия"""
+    
+    def __init__(self, output):
+        self.archive = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+    
+    def write(self, executor, labels):
+        images = executor.map(render_qr_png, [payload for payload, _, _, _ in labels], chunksize=32)
+        for (_, bitrix_id, _, qr_link_id), image in zip(labels, images):
+            self.archive.writestr(f'qr_{bitrix_id}_{qr_link_id}.png', image)
+    
+    def close(self):
+        self.archive.close()
+
+
+class PdfWriter:
+    """Многостраничный PDF: каждое окно дописывается к файлу, страницы не копятся в памяти"""
+    
+    def __init__(self, output):
+        self.path = output.name
+        self.started = False
+    
+    def write(self, executor, labels):
+        pages = [
+            [(payload, label_caption(name, bitrix_id)) for payload, bitrix_id, name, _ in labels[offset:offset + LABELS_PER_PAGE]]
+            for offset in range(0, len(labels), LABELS_PER_PAGE)
+        ]
+        images = list(executor.map(render_label_page, pages))
+        images[0].save(
+            self.path,
+            format='PDF',
+            resolution=LABEL_PAGE_DPI,
+            save_all=True,
+            append_images=images[1:],
+            append=self.started,
+        )
+        self.started = True
+    
+    def close(self):
+        pass
@@ -0,0 +1,167 @@
+"""
+Быстрый кодировщик QR: матрица модулей и 1-битный PNG без лишней работы.
+
+qrcode при make() восемь раз целиком строит матрицу (по разу на каждую
+маску), чтобы выбрать маску с наименьшим штрафом. Расположение модулей
+данных зависит только от версии, поэтому здесь оно вычисляется один раз на
+версию, а кандидаты масок собираются наложением заранее посчитанных масок
+на биты данных. Выбранная маска и итоговая матрица совпадают с qrcode.
+
+Картинка собирается прямо из матрицы: 1 пиксель на модуль в режиме '1',
+затем масштабирование без сглаживания и PNG с заданным уровнем сжатия.
+"""
+import re
+import threading
+from io import BytesIO
+
+import qrcode
+from qrcode import util
+from PIL import Image
+
+
+# Уровень zlib для PNG: для 1-битных QR-кодов выше 6 файл почти не уменьшается, а время растет
+QR_PNG_COMPRESS_LEVEL = 6
+
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def _layout(version):
+    """
+    Заготовка версии: матрица без данных, позиции модулей данных в порядке
+    укладки, строки заготовки битами и биты каждой маски в позициях данных
+    """
+    layout = _layouts.get(version)
+    if layout is not None:
+        return layout
+    
+    qr = qrcode.QRCode(version=version)
+    count = qr.modules_count = version * 4 + 17
+    qr.modules = [[None] * count for _ in range(count)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(count - 7, 0)
+    qr.setup_position_probe_pattern(0, count - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    # При подборе маски qrcode оценивает матрицу с пустой служебной информацией (test=True)
+    qr.setup_type_info(True, 0)
+    if version >= 7:
+        qr.setup_type_number(True)
+    skeleton = qr.modules
+    
+    # Тот же обход змейкой по парам столбцов, что и в QRCode.map_data
+    positions = []
+    row, step = count - 1, -1
+    for col in range(count - 1, 0, -2):
+        if col <= 6:
+            col -= 1
+        while True:
+            for c in (col, col - 1):
+                if skeleton[row][c] is None:
+                    positions.append((row, c))
+            row += step
+            if row < 0 or row >= count:
+                row -= step
+                step = -step
+                break
+    
+    # Строка матрицы - целое число, старший бит - левый модуль
+    skeleton_rows = [
+        sum(1 << (count - 1 - c) for c, dark in enumerate(cells) if dark) for cells in skeleton
+    ]
+    masks = []
+    for pattern in range(8):
+        mask = util.mask_func(pattern)
+        rows = [0] * count
+        for r, c in positions:
+            if mask(r, c):
+                rows[r] |= 1 << (count - 1 - c)
+        masks.append(rows)
+    
+    layout = (count, positions, skeleton_rows, masks)
+    with _layouts_lock:
+        _layouts[version] = layout
+    return layout
+
+
+_RUN = re.compile(r'0{5,}|1{5,}')
+
+
+def lost_point(rows, count):
+    """
+    Штраф матрицы по правилам ISO/IEC 18004 в точности как qrcode.util.lost_point,
+    но по строкам-битам: серии, блоки 2x2, шаблоны 1:1:3:1:1 и баланс темных модулей
+    """
+    lines = [format(row, f'0{count}b') for row in rows]
+    flat = ''.join(lines)
+    columns = [flat[col::count] for col in range(count)]
+    
+    # Перевод строки разделяет линии: ни серия, ни шаблон через него не проходят
+    text = '\n'.join(lines + columns)
+    runs = _RUN.findall(text)
+    # Шаблоны не перекрываются сами с собой, поэтому str.count считает их точно
+    finder_like = text.count('10111010000') + text.count('00001011101')
+    lost = sum(map(len, runs)) - 2 * len(runs) + 40 * finder_like
+    
+    full = (1 << count) - 1
+    inner = (1 << (count - 1)) - 1
+    for upper, lower in zip(rows, rows[1:]):
+        same = ~(upper ^ lower) & full
+        blocks = same & (same >> 1) & ~(upper ^ (upper >> 1)) & inner
+        lost += 3 * bin(blocks).count('1')
+    
+    dark = flat.count('1')
+    lost += int(abs(dark * 100 / count ** 2 - 50) / 5) * 10
+    return lost
+
+
+def best_mask_pattern(version, data):
+    """Маска с наименьшим штрафом (как QRCode.best_mask_pattern, но без 8 полных построений)"""
+    count, positions, skeleton_rows, masks = _layout(version)
+    data_rows = [0] * count
+    data_bits = len(data) * 8
+    for index, (r, c) in enumerate(positions[:data_bits]):
+        if (data[index >> 3] >> (7 - (index & 7))) & 1:
+            data_rows[r] |= 1 << (count - 1 - c)
+    
+    best_pattern, best_lost = 0, None
+    for pattern, mask_rows in enumerate(masks):
+        rows = [base | (bits ^ mask) for base, bits, mask in zip(skeleton_rows, data_rows, mask_rows)]
+        lost = lost_point(rows, count)
+        if best_lost is None or lost < best_lost:
+            best_pattern, best_lost = pattern, lost
+    return best_pattern
+
+
+def qr_matrix(payload, border=4, error_correction=qrcode.constants.ERROR_CORRECT_L):
+    """Матрица модулей QR-кода (True - темный модуль), включая рамку"""
+    qr = qrcode.QRCode(error_correction=error_correction, border=border)
+    qr.add_data(payload)
+    # Версия подбирается один раз двоичным поиском по таблице емкостей
+    qr.best_fit()
+    qr.data_cache = util.create_data(qr.version, qr.error_correction, qr.data_list)
+    qr.makeImpl(False, best_mask_pattern(qr.version, qr.data_cache))
+    return qr.get_matrix()
+
+
+def matrix_to_image(matrix, size):
+    """1-битная картинка из матрицы: size пикселей на модуль"""
+    side = len(matrix)
+    padding = '0' * (-side % 8)
+    row_bytes = (side + len(padding)) // 8
+    # В режиме '1' бит 1 - белый пиксель
+    raw = b''.join(
+        int(''.join('0' if dark else '1' for dark in row) + padding, 2).to_bytes(row_bytes, 'big')
+        for row in matrix
+    )
+    image = Image.frombytes('1', (side, side), raw)
+    if size != 1:
+        image = image.resize((side * size, side * size), Image.NEAREST)
+    return image
+
+
+def matrix_to_png(matrix, size, compress_level=QR_PNG_COMPRESS_LEVEL):
+    buffer = BytesIO()
+    matrix_to_image(matrix, size).save(buffer, format='PNG', compress_level=compress_level)
+    buffer.seek(0)
+    return buffer
@@ -6,27 +6,60 @@ from io import BytesIO
 from django.core.files.base import ContentFile
 from django.conf import settings
 
+from .metrics import timed
+from .qr_encoder import matrix_to_image, matrix_to_png, qr_matrix
 
-def generate_qr_code(url, size=10, border=4):
+
+ERROR_CORRECTION_LEVELS = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+def generate_qr_code(url, size=10, border=4, error_correction='L', image_format='PNG'):
     """
-    Генерировать QR-код для URL
+    Генерировать QR-код для URL: 1-битная картинка прямо из матрицы модулей
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=size,
-        border=border,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    img_buffer = BytesIO()
-    img.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
+    with timed('qr'):
+        matrix = qr_matrix(url, border=border, error_correction=ERROR_CORRECTION_LEVELS[error_correction])
+        if image_format.upper() == 'PNG':
+            return matrix_to_png(matrix, size)
+        
+        img_buffer = BytesIO()
+        matrix_to_image(matrix, size).save(img_buffer, format=image_format)
+        img_buffer.seek(0)
+        
+        return img_buffer
+
+
+def generate_qr_svg(url, size=10, border=4, error_correction='L'):
+    """
+    Генерировать QR-код в SVG: один path из горизонтальных отрезков модулей,
+    size - размер модуля в пикселях
+    """
+    with timed('qr'):
+        matrix = qr_matrix(url, border=border, error_correction=ERROR_CORRECTION_LEVELS[error_correction])
+        segments = []
+        for y, row in enumerate(matrix):
+            x = 0
+            while x < len(row):
+                if not row[x]:
+                    x += 1
+                    continue
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                segments.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
     
-    return img_buffer
+    side = len(matrix)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{side * size}" height="{side * size}" '
+        f'viewBox="0 0 {side} {side}" shape-rendering="crispEdges">'
+        f'<rect width="{side}" height="{side}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(segments)}"/></svg>'
+    ).encode()
 
 
 def create_qr_code_file(url, filename=None):
@@ -0,0 +1,47 @@
+"""
+Отрисовка QR-кодов по запросу вместо хранения файлов.
+
+Результат зависит только от параметров отрисовки, поэтому ETag - это хеш
+параметров (тот же, что у хранилища QRImage), а последние отрисовки
+хранятся в небольшом LRU в памяти процесса.
+"""
+from django.conf import settings
+
+from .lru import LRUCache
+from .qr_generator import generate_qr_code, generate_qr_svg
+from .qr_store import qr_image_digest
+
+
+QR_RENDER_CACHE_SIZE = getattr(settings, 'QR_RENDER_CACHE_SIZE', 256)
+
+# Хранить ли PNG-файл для каждой новой QR-ссылки; без файлов картинки рисуются по запросу
+QR_STORE_FILES = getattr(settings, 'QR_STORE_FILES', True)
+
+QR_RENDER_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Допустимые размеры модуля и рамки, чтобы запросом нельзя было заказать гигантскую картинку
+QR_RENDER_SIZES = range(1, 41)
+QR_RENDER_BORDERS = range(0, 11)
+
+
+render_cache = LRUCache(maxsize=QR_RENDER_CACHE_SIZE)
+
+
+def render_etag(payload, image_format, size, border):
+    return f'"{qr_image_digest(payload, size, border, "L", image_format)}"'
+
+
+def render_qr(payload, image_format='png', size=10, border=4):
+    """Байты картинки QR-кода (из LRU или свежая отрисовка)"""
+    key = (payload, image_format, size, border)
+    data = render_cache.get(key)
+    if data is None:
+        if image_format == 'svg':
+            data = generate_qr_svg(payload, size=size, border=border)
+        else:
+            data = generate_qr_code(payload, size=size, border=border).getvalue()
+        render_cache.set(key, data)
+    return data
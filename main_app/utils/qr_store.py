@@ -0,0 +1,88 @@
+"""
+Хранилище файлов QR-кодов, адресуемых по содержимому.
+
+Ключ - sha256 от всех параметров отрисовки, поэтому одинаковый QR-код
+рисуется и хранится один раз. Данные кода - URL с токеном ссылки, поэтому
+повторная генерация для товара переиспользует его действующую ссылку
+(reusable_links) вместе с токеном и файлом, а не выпускает новую.
+Файл удаляется, когда на него не остается ссылок.
+"""
+import hashlib
+import json
+
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .qr_generator import generate_qr_code
+
+
+def qr_image_digest(payload, size=10, border=4, error_correction='L', image_format='PNG'):
+    params = json.dumps([payload, size, border, error_correction, image_format.upper()], ensure_ascii=False)
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def acquire_qr_image(payload, size=10, border=4, error_correction='L', image_format='PNG'):
+    """
+    Получить QRImage для параметров, увеличив его счетчик ссылок.
+    Отрисовка выполняется только если такого файла еще нет.
+    """
+    from main_app.models import QRImage
+    
+    digest = qr_image_digest(payload, size, border, error_correction, image_format)
+    qr_image = _reference(digest)
+    if qr_image is not None:
+        return qr_image
+    
+    buffer = generate_qr_code(payload, size=size, border=border, error_correction=error_correction, image_format=image_format)
+    qr_image = QRImage(digest=digest, ref_count=1)
+    qr_image.image.save(f'qr_{digest[:16]}.{image_format.lower()}', ContentFile(buffer.getvalue()), save=False)
+    try:
+        with transaction.atomic():
+            qr_image.save()
+    except IntegrityError:
+        # Параллельный запрос успел сохранить такой же файл - берем его, свою копию удаляем
+        qr_image.image.delete(save=False)
+        qr_image = _reference(digest)
+        if qr_image is None:
+            raise
+    return qr_image
+
+
+def _reference(digest):
+    from main_app.models import QRImage
+    
+    if not QRImage.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+        return None
+    return QRImage.objects.get(digest=digest)
+
+
+def reusable_links(product_ids):
+    """Действующие ссылки товаров с компактным токеном, новые первыми"""
+    from main_app.models import QRCodeLink
+    
+    return (
+        QRCodeLink.objects
+        .filter(product_id__in=product_ids, is_active=True, signed_token__isnull=False)
+        .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+        .order_by('product_id', '-created_at', '-id')
+    )
+
+
+def release_qr_image(qr_image_id):
+    """Уменьшить счетчик ссылок и удалить файл, на который больше никто не ссылается"""
+    from main_app.models import QRImage
+    
+    with transaction.atomic():
+        QRImage.objects.filter(id=qr_image_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        # Строка блокируется, чтобы параллельный acquire_qr_image не взял удаляемый файл
+        orphan = QRImage.objects.select_for_update().filter(id=qr_image_id, ref_count=0).first()
+        if orphan is None or orphan.qr_links.exists():
+            return False
+        
+        name = orphan.image.name
+        storage = orphan.image.storage
+        orphan.delete()
+        transaction.on_commit(lambda: storage.delete(name))
+    return True
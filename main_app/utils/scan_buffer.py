@@ -0,0 +1,186 @@
+"""
+Буферизация счетчиков сканирований QR-ссылок.
+
+Публичная страница только увеличивает счетчик в памяти процесса. Фоновый
+поток раз в QR_SCAN_FLUSH_INTERVAL секунд сбрасывает накопленное одним
+UPDATE ... SET access_count = access_count + n, дописывает сканирования в
+журнал QRScanEvent одним INSERT на пачку и сливает скетчи уникальных
+посетителей (utils.visitors) с дневными строками QRScanSketch.
+
+Остаток сбрасывается при завершении процесса (atexit; в gunicorn можно
+дополнительно вызвать scan_counter.flush() в хуке worker_exit).
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, DateTimeField, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from .hll import HLL_REGISTERS, add_hash, merge_registers
+from .visitors import flush_sketches
+
+
+# Как часто сбрасывать счетчики в базу, с
+QR_SCAN_FLUSH_INTERVAL = getattr(settings, 'QR_SCAN_FLUSH_INTERVAL', 5)
+
+# При таком количестве ссылок в буфере сброс запускается не дожидаясь интервала
+QR_SCAN_FLUSH_THRESHOLD = 1000
+
+# Сколько ссылок обновлять одним UPDATE
+QR_SCAN_UPDATE_BATCH = 500
+
+# При таком количестве сканирований в журнале буфера сброс тоже запускается досрочно
+QR_SCAN_EVENT_FLUSH_THRESHOLD = 5000
+
+# Больше стольких несохраненных сканирований буфер не хранит
+QR_SCAN_EVENT_BUFFER_LIMIT = 100000
+
+# Сколько сканирований вставлять одним INSERT
+QR_SCAN_EVENT_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class ScanCounterBuffer:
+    """Счетчики обращений к QR-ссылкам, копящиеся в памяти до периодического сброса"""
+    
+    def __init__(self, flush_interval=QR_SCAN_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.events = []
+        self.sketches = {}
+        self.wakeup = threading.Event()
+        self.pid = None
+        self.thread = None
+    
+    def record(self, qr_link_id, when=None, product_id=None, visitor=None):
+        """
+        Учесть одно обращение к ссылке; запись в базу происходит позже.
+        Если передан product_id, сканирование попадает и в журнал QRScanEvent,
+        а хеш посетителя visitor - в дневной скетч уникальных посетителей.
+        """
+        when = when or timezone.now()
+        self._ensure_started()
+        with self.lock:
+            count, _ = self.pending.get(qr_link_id, (0, None))
+            self.pending[qr_link_id] = (count + 1, when)
+            if product_id is not None:
+                self.events.append((qr_link_id, product_id, when))
+                if visitor is not None:
+                    key = (qr_link_id, product_id, timezone.localdate(when))
+                    registers = self.sketches.get(key)
+                    if registers is None:
+                        registers = self.sketches[key] = bytearray(HLL_REGISTERS)
+                    add_hash(registers, visitor)
+            overflow = (
+                len(self.pending) >= QR_SCAN_FLUSH_THRESHOLD
+                or len(self.sketches) >= QR_SCAN_FLUSH_THRESHOLD
+                or len(self.events) >= QR_SCAN_EVENT_FLUSH_THRESHOLD
+            )
+        if overflow:
+            self.wakeup.set()
+    
+    def flush(self):
+        """Записать накопленные счетчики в базу атомарными инкрементами"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            events, self.events = self.events, []
+            sketches, self.sketches = self.sketches, {}
+        self._flush_events(events)
+        self._flush_sketches(sketches)
+        if not pending:
+            return 0
+        
+        from main_app.models import QRCodeLink
+        
+        items = list(pending.items())
+        for offset in range(0, len(items), QR_SCAN_UPDATE_BATCH):
+            batch = items[offset:offset + QR_SCAN_UPDATE_BATCH]
+            try:
+                QRCodeLink.objects.filter(id__in=[qr_link_id for qr_link_id, _ in batch]).update(
+                    access_count=F('access_count') + Case(
+                        *[When(id=qr_link_id, then=Value(count)) for qr_link_id, (count, _) in batch],
+                        default=Value(0),
+                        output_field=PositiveIntegerField(),
+                    ),
+                    last_accessed=Case(
+                        *[When(id=qr_link_id, then=Value(when)) for qr_link_id, (_, when) in batch],
+                        default=F('last_accessed'),
+                        output_field=DateTimeField(),
+                    ),
+                )
+            except Exception:
+                logger.exception("Не удалось сбросить счетчики сканирований QR-ссылок")
+                self._restore(dict(items[offset:]))
+                return 0
+        
+        return sum(count for count, _ in pending.values())
+    
+    def _flush_events(self, events):
+        """Дописать сканирования в журнал; при ошибке вернуть несохраненные в буфер"""
+        from main_app.models import QRScanEvent
+        
+        for offset in range(0, len(events), QR_SCAN_EVENT_BATCH):
+            try:
+                QRScanEvent.objects.bulk_create([
+                    QRScanEvent(qr_link_id=qr_link_id, product_id=product_id, scanned_at=when)
+                    for qr_link_id, product_id, when in events[offset:offset + QR_SCAN_EVENT_BATCH]
+                ])
+            except Exception:
+                logger.exception("Не удалось записать журнал сканирований QR-ссылок")
+                with self.lock:
+                    self.events[:0] = events[offset:]
+                    # Пока база недоступна, журнал не должен съесть память процесса: самые старые
+                    # сканирования отбрасываются (счетчики access_count при этом не теряются)
+                    del self.events[:-QR_SCAN_EVENT_BUFFER_LIMIT]
+                return
+    
+    def _flush_sketches(self, sketches):
+        """Слить скетчи посетителей с базой; при ошибке вернуть их в буфер"""
+        if not sketches:
+            return
+        try:
+            flush_sketches(sketches)
+        except Exception:
+            logger.exception("Не удалось сохранить скетчи уникальных посетителей QR-ссылок")
+            with self.lock:
+                for key, registers in sketches.items():
+                    current = self.sketches.get(key)
+                    self.sketches[key] = registers if current is None else merge_registers(current, registers)
+    
+    def _restore(self, pending):
+        """Вернуть несброшенные счетчики в буфер, чтобы не потерять обращения"""
+        with self.lock:
+            for qr_link_id, (count, when) in pending.items():
+                current_count, current_when = self.pending.get(qr_link_id, (0, when))
+                self.pending[qr_link_id] = (current_count + count, max(when, current_when))
+    
+    def _ensure_started(self):
+        # После fork (gunicorn --preload) поток родителя в процессе не существует
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.pending = {}
+            self.events = []
+            self.sketches = {}
+            self.thread = threading.Thread(target=self._run, name='qr-scan-flusher', daemon=True)
+            self.thread.start()
+        atexit.register(self.flush)
+    
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            connection.close()
+
+
+scan_counter = ScanCounterBuffer()
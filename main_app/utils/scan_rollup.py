@@ -0,0 +1,191 @@
+"""
+Свертка журнала сканирований QRScanEvent в почасовые и дневные итоги.
+
+Каждый запуск пересчитывает итоги заново (абсолютными значениями) только за
+часы начиная с QRScanRollupState.rolled_up_to, поэтому повторный запуск
+безопасен, а стоимость не зависит от накопленного объема. Графики в
+интерфейсе читают только таблицы итогов.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+
+# Сканирование попадает в журнал не сразу (буфер сбрасывается раз в несколько
+# секунд), поэтому последние часы пересчитываются еще раз на следующем запуске
+QR_SCAN_ROLLUP_LAG = timedelta(minutes=5)
+
+# Сколько хранить сырые сканирования и почасовые итоги; дневные итоги хранятся всегда
+QR_SCAN_EVENT_RETENTION_DAYS = getattr(settings, 'QR_SCAN_EVENT_RETENTION_DAYS', 7)
+QR_SCAN_HOURLY_RETENTION_DAYS = getattr(settings, 'QR_SCAN_HOURLY_RETENTION_DAYS', 90)
+
+# Дневные скетчи уникальных посетителей (2 КБ на ссылку в день) хранятся дольше года,
+# чтобы можно было сравнивать с тем же периодом прошлого года
+QR_SCAN_SKETCH_RETENTION_DAYS = getattr(settings, 'QR_SCAN_SKETCH_RETENTION_DAYS', 400)
+
+# Как часто воркер run_jobs запускает свертку, с
+QR_SCAN_ROLLUP_INTERVAL = getattr(settings, 'QR_SCAN_ROLLUP_INTERVAL', 60)
+
+ROLLUP_BATCH = 1000
+PRUNE_BATCH = 10000
+
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_scans(now=None):
+    """
+    Пересчитать итоги за часы, которые еще могли измениться.
+    Возвращает количество записанных почасовых строк.
+    """
+    from main_app.models import QRScanEvent, QRScanRollupState
+    
+    now = now or timezone.now()
+    state, _ = QRScanRollupState.objects.get_or_create(id=1)
+    start = state.rolled_up_to
+    if start is None:
+        first = QRScanEvent.objects.order_by('scanned_at').values_list('scanned_at', flat=True).first()
+        if first is None:
+            return 0
+        start = floor_hour(first)
+    
+    hours = rollup_hourly(start)
+    rollup_daily(start)
+    
+    state.rolled_up_to = max(start, floor_hour(now - QR_SCAN_ROLLUP_LAG))
+    state.save(update_fields=['rolled_up_to', 'updated_at'])
+    return hours
+
+
+def rollup_hourly(start):
+    from main_app.models import QRScanEvent, QRScanHourly
+    
+    rows = (
+        QRScanEvent.objects.filter(scanned_at__gte=start)
+        .annotate(bucket=TruncHour('scanned_at'))
+        .values('qr_link_id', 'product_id', 'bucket')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    return _upsert(
+        QRScanHourly,
+        (
+            QRScanHourly(qr_link_id=row['qr_link_id'], product_id=row['product_id'], hour=row['bucket'], count=row['total'])
+            for row in rows.iterator()
+        ),
+        unique_fields=['qr_link', 'hour'],
+    )
+
+
+def rollup_daily(start):
+    """Пересчитать дневные итоги из почасовых за все дни, затронутые с момента start"""
+    from main_app.models import QRScanDaily, QRScanHourly
+    
+    day_start = timezone.localtime(start).replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = (
+        QRScanHourly.objects.filter(hour__gte=day_start)
+        .annotate(bucket=TruncDate('hour'))
+        .values('qr_link_id', 'product_id', 'bucket')
+        .annotate(total=Sum('count'))
+        .order_by()
+    )
+    return _upsert(
+        QRScanDaily,
+        (
+            QRScanDaily(qr_link_id=row['qr_link_id'], product_id=row['product_id'], day=row['bucket'], count=row['total'])
+            for row in rows.iterator()
+        ),
+        unique_fields=['qr_link', 'day'],
+    )
+
+
+def _upsert(model, objects, unique_fields):
+    written = 0
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= ROLLUP_BATCH:
+            written += _upsert_batch(model, batch, unique_fields)
+            batch = []
+    if batch:
+        written += _upsert_batch(model, batch, unique_fields)
+    return written
+
+
+def _upsert_batch(model, batch, unique_fields):
+    model.objects.bulk_create(batch, update_conflicts=True, unique_fields=unique_fields, update_fields=['count'])
+    return len(batch)
+
+
+def prune_scan_events(now=None):
+    """
+    Удалить сырые сканирования старше срока хранения (только уже свернутые)
+    и устаревшие почасовые итоги и скетчи. Возвращает количество удаленных сканирований.
+    """
+    from main_app.models import QRScanEvent, QRScanHourly, QRScanRollupState, QRScanSketch
+    
+    now = now or timezone.now()
+    rolled_up_to = QRScanRollupState.objects.filter(id=1).values_list('rolled_up_to', flat=True).first()
+    if rolled_up_to is None:
+        return 0
+    
+    cutoff = min(now - timedelta(days=QR_SCAN_EVENT_RETENTION_DAYS), rolled_up_to)
+    deleted = 0
+    while True:
+        # Удаление пачками, чтобы не держать одну огромную транзакцию
+        ids = list(QRScanEvent.objects.filter(scanned_at__lt=cutoff).values_list('id', flat=True)[:PRUNE_BATCH])
+        if not ids:
+            break
+        deleted += QRScanEvent.objects.filter(id__in=ids).delete()[0]
+    
+    QRScanHourly.objects.filter(hour__lt=now - timedelta(days=QR_SCAN_HOURLY_RETENTION_DAYS)).delete()
+    QRScanSketch.objects.filter(day__lt=timezone.localdate(now) - timedelta(days=QR_SCAN_SKETCH_RETENTION_DAYS)).delete()
+    return deleted
+
+
+def daily_series(qr_link_ids, days=30, today=None):
+    """Сканирования по дням за последние days дней: {id ссылки: [count, ...]}"""
+    from main_app.models import QRScanDaily
+    
+    return _series(QRScanDaily.objects.filter(qr_link_id__in=qr_link_ids), 'qr_link_id', qr_link_ids, days, today)
+
+
+def product_daily_series(product_ids, days=30, today=None):
+    """Сканирования всех ссылок товара по дням: {id товара: [count, ...]}"""
+    from main_app.models import QRScanDaily
+    
+    return _series(QRScanDaily.objects.filter(product_id__in=product_ids), 'product_id', product_ids, days, today)
+
+
+def _series(queryset, key, ids, days, today):
+    today = today or timezone.localdate()
+    first_day = today - timedelta(days=days - 1)
+    series = {object_id: [0] * days for object_id in ids}
+    rows = (
+        queryset.filter(day__gte=first_day, day__lte=today)
+        .values(key, 'day')
+        .annotate(total=Sum('count'))
+        .order_by()
+    )
+    for row in rows:
+        series[row[key]][(row['day'] - first_day).days] = row['total']
+    return series
+
+
+def hourly_series(qr_link_id, hours=48, now=None):
+    """Сканирования ссылки по часам за последние hours часов"""
+    from main_app.models import QRScanHourly
+    
+    last_hour = floor_hour(now or timezone.now())
+    first_hour = last_hour - timedelta(hours=hours - 1)
+    series = [0] * hours
+    rows = QRScanHourly.objects.filter(
+        qr_link_id=qr_link_id, hour__gte=first_hour, hour__lte=last_hour,
+    ).values_list('hour', 'count')
+    for hour, count in rows:
+        series[int((hour - first_hour).total_seconds() // 3600)] = count
+    return series
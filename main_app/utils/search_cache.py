@@ -0,0 +1,146 @@
+"""
+Кеш результатов автокомплита товаров по префиксам запроса.
+
+Ключ - нормализованный запрос и поколение каталога. Поколение растет при
+каждом изменении товаров (синхронизация, создание, события Битрикс24),
+поэтому старые результаты не нужно удалять: они просто перестают
+читаться и вытесняются по таймауту.
+
+Товары меняет и воркер run_jobs, а кеш Django по умолчанию свой у каждого
+процесса, поэтому поколение хранится в базе (CatalogGeneration). Процесс
+перечитывает его не чаще раза в CATALOG_GENERATION_TTL секунд.
+
+Если для более короткого префикса в кеше лежит полный список совпадений,
+более длинный запрос отбирается из него в памяти без запроса к базе - там,
+где порядок выдачи можно повторить в памяти (см.
+product_search.best_matches_in_memory).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .lru import LRUCache
+from .product_search import best_matches_in_memory
+
+
+SEARCH_CACHE_TIMEOUT = getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60 * 10)
+
+# Сколько совпадений хранить на запрос; если их меньше, список считается полным
+SEARCH_CACHE_ROWS = 100
+
+# Сколько секунд браузер может не переспрашивать одинаковый запрос
+SEARCH_BROWSER_MAX_AGE = getattr(settings, 'SEARCH_BROWSER_MAX_AGE', 60)
+
+# Запросы короче не ищутся
+SEARCH_MIN_LENGTH = 2
+
+# Сколько секунд процесс может не перечитывать поколение каталога из базы
+CATALOG_GENERATION_TTL = getattr(settings, 'CATALOG_GENERATION_TTL', 1)
+
+CATALOG_GENERATION_ID = 1
+
+_generation = LRUCache(maxsize=1, ttl=CATALOG_GENERATION_TTL)
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def _generation_query():
+    from main_app.models import CatalogGeneration
+    
+    return CatalogGeneration.objects.filter(id=CATALOG_GENERATION_ID).values_list('generation', flat=True)
+
+
+def catalog_generation():
+    generation = _generation.get(CATALOG_GENERATION_ID)
+    if generation is None:
+        generation = _generation_query().first() or 0
+        _generation.set(CATALOG_GENERATION_ID, generation)
+    return generation
+
+
+async def acatalog_generation():
+    generation = _generation.get(CATALOG_GENERATION_ID)
+    if generation is None:
+        generation = await _generation_query().afirst() or 0
+        _generation.set(CATALOG_GENERATION_ID, generation)
+    return generation
+
+
+def bump_catalog_generation():
+    from main_app.models import CatalogGeneration
+    
+    if not CatalogGeneration.objects.filter(id=CATALOG_GENERATION_ID).update(generation=F('generation') + 1):
+        CatalogGeneration.objects.get_or_create(id=CATALOG_GENERATION_ID)
+        CatalogGeneration.objects.filter(id=CATALOG_GENERATION_ID).update(generation=F('generation') + 1)
+    # В своем процессе новое поколение видно сразу, в остальных - через CATALOG_GENERATION_TTL
+    _generation.clear()
+
+
+def search_etag(generation, normalized):
+    return f'"{generation}:{hashlib.sha1(normalized.encode()).hexdigest()[:16]}"'
+
+
+def _key(generation, normalized):
+    # v2: строки выдачи содержат sort_order вместо search_text
+    return f'product_search:v2:{generation}:{hashlib.sha1(normalized.encode()).hexdigest()}'
+
+
+def cached_search(normalized, fetch, limit, generation):
+    """
+    Результаты запроса из кеша, из кешированного короткого префикса или от
+    fetch(normalized, rows) - списка словарей с ключами id, name и sort_order.
+    """
+    key = _key(generation, normalized)
+    entry = cache.get(key)
+    if entry is None:
+        entry = _narrow_prefix(cache.get_many(_prefix_keys(normalized, generation)), normalized, limit, generation)
+        if entry is None:
+            entry = _entry(fetch(normalized, SEARCH_CACHE_ROWS))
+        cache.set(key, entry, SEARCH_CACHE_TIMEOUT)
+    return entry['rows'][:limit]
+
+
+async def acached_search(normalized, fetch, limit, generation):
+    """Асинхронный cached_search; fetch - корутина"""
+    key = _key(generation, normalized)
+    entry = await cache.aget(key)
+    if entry is None:
+        prefixes = await cache.aget_many(_prefix_keys(normalized, generation))
+        entry = _narrow_prefix(prefixes, normalized, limit, generation)
+        if entry is None:
+            entry = _entry(await fetch(normalized, SEARCH_CACHE_ROWS))
+        await cache.aset(key, entry, SEARCH_CACHE_TIMEOUT)
+    return entry['rows'][:limit]
+
+
+def _entry(rows):
+    return {'complete': len(rows) < SEARCH_CACHE_ROWS, 'rows': rows}
+
+
+def _prefix_keys(normalized, generation):
+    return [_key(generation, normalized[:length]) for length in range(len(normalized) - 1, SEARCH_MIN_LENGTH - 1, -1)]
+
+
+def _narrow_prefix(entries, normalized, limit, generation):
+    """
+    Отобрать выдачу из полного списка для самого длинного закешированного
+    префикса (entries - результат get_many по _prefix_keys).
+    Отбираются только лучшие совпадения, остальные совпадения запроса в
+    списке префикса могут отсутствовать, поэтому результат не считается
+    полным и сам для сужения не используется.
+    """
+    for key in _prefix_keys(normalized, generation):
+        entry = entries.get(key)
+        if entry is None:
+            continue
+        if not entry['complete']:
+            return None
+        rows = best_matches_in_memory(normalized, entry['rows'], limit)
+        if rows is None:
+            return None
+        return {'complete': False, 'rows': rows}
+    return None
@@ -1,19 +1,39 @@
 """
 Утилиты для создания и проверки подписанных токенов с Django TimestampSigner
 """
+import base64
+import binascii
+import hmac
 import json
+import struct
+import time
 from datetime import timedelta
 from django.core.signing import TimestampSigner
 from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+
+# Срок действия токена
+TOKEN_MAX_AGE = timedelta(days=365)
+
+# Компактный токен: версия и тип (1 байт), ID QR-ссылки (4 байта), время выпуска (4 байта)
+# и усеченный HMAC-SHA256 (6 байт). 15 байт дают ровно 20 символов base64url без '='.
+COMPACT_TOKEN_VERSION = 1
+COMPACT_TOKEN_TYPE_PRODUCT_VIEW = 1
+COMPACT_TOKEN_PAYLOAD = struct.Struct('>BII')
+COMPACT_TOKEN_MAC_SIZE = 6
+COMPACT_TOKEN_LENGTH = 20
 
 
 class TokenSigner:
     """Класс для создания и проверки подписанных токенов с Django TimestampSigner"""
     
     def __init__(self, secret_key=None):
-        self.signer = TimestampSigner(key=secret_key or getattr(settings, 'SECRET_KEY', 'default-secret-key'))
+        self.secret_key = secret_key or getattr(settings, 'SECRET_KEY', 'default-secret-key')
+        self.signer = TimestampSigner(key=self.secret_key)
     
     def create_product_token(self, product_id):
+        """Токен старого формата (подписанный JSON); сейчас выпускаются компактные токены"""
         data = {
             'product_id': product_id,
             'type': 'product_view'
@@ -25,7 +45,7 @@ class TokenSigner:
     
     def verify_product_token(self, token):
         try:
-            json_data = self.signer.unsign(token, max_age=timedelta(days=365))
+            json_data = self.signer.unsign(token, max_age=TOKEN_MAX_AGE)
             data = json.loads(json_data)
             
             if data.get('type') != 'product_view':
@@ -35,6 +55,47 @@ class TokenSigner:
             
         except Exception:
             return None
+    
+    def create_link_token(self, qr_link_id, issued_at=None):
+        """Компактный токен QR-ссылки (20 символов base64url)"""
+        issued = int(issued_at.timestamp() if issued_at else time.time())
+        payload = COMPACT_TOKEN_PAYLOAD.pack(
+            COMPACT_TOKEN_VERSION << 4 | COMPACT_TOKEN_TYPE_PRODUCT_VIEW,
+            qr_link_id,
+            issued,
+        )
+        raw = payload + self._mac(payload)
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    def verify_link_token(self, token):
+        """Проверить компактный токен и вернуть ID QR-ссылки или None"""
+        if len(token) != COMPACT_TOKEN_LENGTH:
+            return None
+        
+        try:
+            raw = base64.urlsafe_b64decode(token.encode('ascii'))
+        except (binascii.Error, UnicodeEncodeError, ValueError):
+            return None
+        
+        payload, mac = raw[:COMPACT_TOKEN_PAYLOAD.size], raw[COMPACT_TOKEN_PAYLOAD.size:]
+        if not hmac.compare_digest(mac, self._mac(payload)):
+            return None
+        
+        header, qr_link_id, issued = COMPACT_TOKEN_PAYLOAD.unpack(payload)
+        if header != COMPACT_TOKEN_VERSION << 4 | COMPACT_TOKEN_TYPE_PRODUCT_VIEW:
+            return None
+        if time.time() - issued > TOKEN_MAX_AGE.total_seconds():
+            return None
+        
+        return qr_link_id
+    
+    def _mac(self, payload):
+        return salted_hmac(
+            'main_app.compact_token',
+            payload,
+            secret=self.secret_key,
+            algorithm='sha256',
+        ).digest()[:COMPACT_TOKEN_MAC_SIZE]
 
 
 signer = TokenSigner()
@@ -0,0 +1,132 @@
+"""
+Кеш проверенных токенов публичных ссылок на товары.
+
+Горячий токен сразу сопоставляется с проверенным кортежем ResolvedToken,
+без проверки подписи и поиска QR-ссылки. Кеш живет в памяти процесса:
+записи сбрасываются при изменении ссылки или товара (main_app.receivers),
+а в соседних процессах устаревают за QR_TOKEN_CACHE_TTL секунд.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .lru import LRUCache
+from .signer import signer
+
+
+QR_TOKEN_CACHE_SIZE = getattr(settings, 'QR_TOKEN_CACHE_SIZE', 10000)
+QR_TOKEN_CACHE_TTL = getattr(settings, 'QR_TOKEN_CACHE_TTL', 60)
+
+
+ResolvedToken = namedtuple('ResolvedToken', [
+    'product_id', 'qr_link_id', 'link_active', 'expires_at', 'product_active', 'product_updated_at',
+])
+
+
+def link_queryset(**lookup):
+    from main_app.models import QRCodeLink
+    
+    return QRCodeLink.objects.filter(**lookup).values(
+        'id', 'product_id', 'is_active', 'expires_at', 'product__is_active', 'product__updated_at',
+    )
+
+
+def product_queryset(product_id):
+    from main_app.models import Product
+    
+    return Product.objects.filter(id=product_id).values('id', 'is_active', 'updated_at')
+
+
+def link_product(link):
+    """Поля товара из строки link_queryset"""
+    if link is None:
+        return None
+    return {'id': link['product_id'], 'is_active': link['product__is_active'], 'updated_at': link['product__updated_at']}
+
+
+class TokenCache:
+    """Ограниченный по размеру и времени жизни кеш token -> ResolvedToken"""
+    
+    def __init__(self, maxsize=QR_TOKEN_CACHE_SIZE, ttl=QR_TOKEN_CACHE_TTL):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+    
+    def resolve(self, token):
+        """Проверить токен (или взять результат из кеша); None для неверного токена"""
+        resolved = self.cache.get(token)
+        if resolved is not None:
+            return resolved
+        
+        qr_link_id = signer.verify_link_token(token)
+        if qr_link_id:
+            # Компактный токен: ссылка и товар читаются одним запросом по первичному ключу
+            link = link_queryset(id=qr_link_id).first()
+            product = link_product(link)
+        else:
+            # Токен старого формата: товар берется из подписи, ссылка ищется по тексту токена
+            product_id = signer.verify_product_token(token)
+            if not product_id:
+                return None
+            product = product_queryset(product_id).first()
+            link = link_queryset(legacy_token=token).first() if product else None
+        
+        return self.build(token, link, product)
+    
+    async def aresolve(self, token):
+        """Асинхронный вариант resolve для ASGI-представлений"""
+        resolved = self.cache.get(token)
+        if resolved is not None:
+            return resolved
+        
+        qr_link_id = signer.verify_link_token(token)
+        if qr_link_id:
+            link = await link_queryset(id=qr_link_id).afirst()
+            product = link_product(link)
+        else:
+            product_id = signer.verify_product_token(token)
+            if not product_id:
+                return None
+            product = await product_queryset(product_id).afirst()
+            link = await link_queryset(legacy_token=token).afirst() if product else None
+        
+        return self.build(token, link, product)
+    
+    def build(self, token, link, product):
+        if product is None:
+            return None
+        resolved = ResolvedToken(
+            product_id=product['id'],
+            qr_link_id=link['id'] if link else None,
+            link_active=bool(link and link['is_active']),
+            expires_at=link['expires_at'] if link else None,
+            product_active=product['is_active'],
+            product_updated_at=product['updated_at'],
+        )
+        self.remember(token, resolved)
+        return resolved
+    
+    def remember(self, token, resolved):
+        ttl = self.ttl
+        if resolved.expires_at:
+            remaining = (resolved.expires_at - timezone.now()).total_seconds()
+            # Уже истекшая ссылка хранится полный срок: ответ для нее не изменится
+            if remaining > 0:
+                ttl = min(ttl, remaining)
+        self.cache.set(token, resolved, ttl=ttl)
+    
+    def invalidate_products(self, product_ids):
+        """Сбросить записи для товаров"""
+        product_ids = set(product_ids)
+        self.cache.discard_if(lambda resolved: resolved.product_id in product_ids)
+    
+    def invalidate_links(self, qr_link_ids):
+        """Сбросить записи для QR-ссылок"""
+        qr_link_ids = set(qr_link_ids)
+        self.cache.discard_if(lambda resolved: resolved.qr_link_id in qr_link_ids)
+    
+    def clear(self):
+        self.cache.clear()
+
+
+token_cache = TokenCache()
@@ -0,0 +1,96 @@
+"""
+Уникальные посетители QR-ссылок на скетчах HyperLogLog.
+
+Посетитель определяется соленым хешем IP-адреса и User-Agent; сам ключ
+нигде не сохраняется. Скетчи копятся в буфере сканирований и сливаются с
+дневными строками QRScanSketch при его сбросе.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.crypto import salted_hmac
+
+from .hll import HLL_REGISTERS, merge_all, merge_registers
+
+
+VISITOR_KEY_SALT = 'main_app.visitor'
+
+SKETCH_FLUSH_BATCH = 500
+
+# Сколько обратных прокси перед приложением дописывают адрес в X-Forwarded-For.
+# 0 - заголовок не читается: его присылает клиент, и он может подставить любой адрес
+TRUSTED_PROXY_COUNT = getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+
+
+def client_address(request):
+    """
+    Адрес клиента: REMOTE_ADDR или, за доверенными прокси, адрес, дописанный
+    в X-Forwarded-For самым внешним из них. Более левые элементы заголовка
+    присылает сам клиент, им верить нельзя.
+    """
+    if TRUSTED_PROXY_COUNT:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_COUNT:
+            return forwarded[-TRUSTED_PROXY_COUNT]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def visitor_hash(request):
+    """64-битный соленый хеш посетителя для скетча"""
+    address = client_address(request)
+    key = f"{address}|{request.META.get('HTTP_USER_AGENT', '')}"
+    return int.from_bytes(salted_hmac(VISITOR_KEY_SALT, key, algorithm='sha256').digest()[:8], 'big')
+
+
+def flush_sketches(sketches):
+    """
+    Слить накопленные скетчи {(id ссылки, id товара, день): регистры} с
+    дневными строками в базе. Строки блокируются на время слияния, поэтому
+    параллельный сброс из другого процесса не затрет регистры.
+    """
+    items = list(sketches.items())
+    for offset in range(0, len(items), SKETCH_FLUSH_BATCH):
+        _flush_batch(dict(items[offset:offset + SKETCH_FLUSH_BATCH]))
+
+
+def _flush_batch(sketches):
+    from main_app.models import QRScanSketch
+    
+    empty = bytes(HLL_REGISTERS)
+    with transaction.atomic():
+        # Сначала гарантируем, что строки есть, затем сливаем регистры под блокировкой
+        QRScanSketch.objects.bulk_create(
+            [
+                QRScanSketch(qr_link_id=qr_link_id, product_id=product_id, day=day, registers=empty)
+                for qr_link_id, product_id, day in sketches
+            ],
+            ignore_conflicts=True,
+        )
+        pending = {(qr_link_id, day): registers for (qr_link_id, _, day), registers in sketches.items()}
+        rows = QRScanSketch.objects.select_for_update().filter(
+            qr_link_id__in={qr_link_id for qr_link_id, _ in pending},
+            day__in={day for _, day in pending},
+        )
+        changed = []
+        for row in rows:
+            registers = pending.get((row.qr_link_id, row.day))
+            if registers is None:
+                continue
+            row.registers = bytes(merge_registers(bytes(row.registers), registers))
+            changed.append(row)
+        QRScanSketch.objects.bulk_update(changed, ['registers'])
+
+
+def unique_visitors(qr_link_ids, first_day, last_day):
+    """Оценка уникальных посетителей ссылок за период (дни включительно)"""
+    from main_app.models import QRScanSketch
+    
+    rows = QRScanSketch.objects.filter(qr_link_id__in=qr_link_ids, day__gte=first_day, day__lte=last_day)
+    return merge_all(rows.values_list('registers', flat=True).iterator()).count()
+
+
+def product_unique_visitors(product_id, first_day, last_day):
+    """Оценка уникальных посетителей всех ссылок товара за период"""
+    from main_app.models import QRScanSketch
+    
+    rows = QRScanSketch.objects.filter(product_id=product_id, day__gte=first_day, day__lte=last_day)
+    return merge_all(rows.values_list('registers', flat=True).iterator()).count()
@@ -1,16 +1,52 @@
+import hmac
+import os
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.http import JsonResponse, Http404
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, JsonResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
 from django.views.generic import View
-from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.utils import timezone
 from integration_utils.bitrix24.bitrix_user_auth.main_auth import main_auth
 
-from .models import Product, QRCodeLink
-from .forms import ProductSearchForm, ProductCreateForm, QRCodeGenerateForm
+from .models import Product, QRCodeLink, BackgroundJob, PendingProductEvent
+from .forms import ProductSearchForm, ProductCreateForm, QRCodeGenerateForm, QRBulkGenerateForm
+from .jobs import enqueue_job, product_sync_lock_key
 from .utils.signer import signer
-from .utils.qr_generator import create_qr_code_file, generate_product_qr_url
+from .utils.qr_generator import generate_product_qr_url
+from .utils.qr_store import acquire_qr_image, reusable_links
+from .utils.qr_render import QR_RENDER_BORDERS, QR_RENDER_FORMATS, QR_RENDER_SIZES, QR_STORE_FILES, render_etag, render_qr
+from .utils.bitrix_api import get_portal_domain
+from .utils.bitrix_events import is_valid_application_token, record_product_event
+from .utils.metrics import METRICS_SAMPLE_RATE, registry as metrics_registry
+from .utils.scan_buffer import scan_counter
+from .utils.scan_rollup import daily_series, hourly_series, product_daily_series
+from .utils.token_cache import token_cache
+from .utils.visitors import product_unique_visitors, unique_visitors, visitor_hash
+from .utils.pagination import KeysetPaginator
+from .utils.product_search import search_products
+from .utils.search_cache import (
+    SEARCH_BROWSER_MAX_AGE, SEARCH_MIN_LENGTH, acached_search, acatalog_generation, cached_search, catalog_generation,
+    normalize_query, search_etag,
+)
+from .utils.page_cache import (
+    acache_product_page, aget_cached_product_page, cache_product_page, get_cached_product_page, product_page_etag,
+)
+
+
+# Порядок списков для постраничного вывода по ключу; индексы - в Meta.indexes моделей
+PRODUCT_LIST_ORDERING = ['sort_order', 'name', 'id']
+QR_LIST_ORDERING = ['-created_at', '-id']
 
 
 @main_auth(on_cookies=True)
@@ -36,16 +72,22 @@ def product_list(request):
             except ValueError:
                 products = products.none()
         elif search_type == 'name':
-            products = products.filter(name__icontains=search_query)
+            # Поиск по названию и описанию с опечатками, результаты по релевантности
+            products = search_products(products, search_query)
     
-    paginator = Paginator(products.order_by('sort_order', 'name'), 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Результаты поиска идут по релевантности, каталог - в обычном порядке
+    ordering = PRODUCT_LIST_ORDERING
+    if 'search_rank' in products.query.annotations:
+        ordering = ['-search_rank'] + ordering
+    paginator = KeysetPaginator(products, ordering, 20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'search_form': search_form,
         'page_obj': page_obj,
         'products': page_obj,
+        'approximate_count': paginator.approximate_count,
+        'sync_job': _last_sync_job(request),
     }
     return render(request, 'main_app/product_list.html', context)
 
@@ -97,21 +139,30 @@ def qr_generate(request):
             product = form.cleaned_data['product']
             
             try:
-                token = signer.create_product_token(product.id)
+                with transaction.atomic():
+                    # Повторная генерация отдает действующую ссылку товара с тем же токеном и файлом
+                    qr_link = reusable_links([product.id]).first()
+                    created = qr_link is None
+                    update_fields = []
+                    if created:
+                        # Компактный токен содержит ID ссылки, поэтому ссылка создается первой
+                        qr_link = QRCodeLink.objects.create(product=product)
+                        qr_link.signed_token = signer.create_link_token(qr_link.id)
+                        update_fields.append('signed_token')
+                    
+                    if QR_STORE_FILES and qr_link.qr_image_id is None and not qr_link.qr_code_image:
+                        qr_link.qr_image = acquire_qr_image(generate_product_qr_url(qr_link.signed_token))
+                        qr_link.qr_code_image = qr_link.qr_image.image.name
+                        update_fields += ['qr_image', 'qr_code_image']
+                    if update_fields:
+                        qr_link.save(update_fields=update_fields)
                 
-                qr_url = generate_product_qr_url(token)
-                
-                qr_file = create_qr_code_file(qr_url)
-                
-                qr_link = QRCodeLink.objects.create(
-                    product=product,
-                    signed_token=token
-                )
-                qr_link.qr_code_image.save(f"qr_{product.bitrix_id}_{qr_link.id}.png", qr_file, save=True)
-                
-                messages.success(request, 'QR-код успешно сгенерирован!')
+                if created:
+                    messages.success(request, 'QR-код успешно сгенерирован!')
+                else:
+                    messages.info(request, 'У товара уже есть действующий QR-код')
                 return redirect('main_app:qr_result', qr_link_id=qr_link.id)
-                
+            
             except Exception as e:
                 messages.error(request, f'Ошибка генерации QR-кода: {str(e)}')
     else:
@@ -123,6 +174,79 @@ def qr_generate(request):
     return render(request, 'main_app/qr_generate.html', context)
 
 
+@main_auth(on_cookies=True)
+def qr_image(request, qr_link_id, image_format):
+    """Картинка QR-кода ссылки, отрисованная по запросу (?size=&border=)"""
+    if image_format not in QR_RENDER_FORMATS:
+        raise Http404("Неизвестный формат")
+    
+    try:
+        size = int(request.GET.get('size', 10))
+        border = int(request.GET.get('border', 4))
+    except ValueError:
+        return HttpResponseBadRequest('Неверные параметры size или border')
+    if size not in QR_RENDER_SIZES or border not in QR_RENDER_BORDERS:
+        return HttpResponseBadRequest('Параметры size или border вне допустимого диапазона')
+    
+    signed_token = QRCodeLink.objects.filter(id=qr_link_id).values_list('signed_token', flat=True).first()
+    if not signed_token:
+        raise Http404("QR-ссылка не найдена")
+    
+    payload = generate_product_qr_url(signed_token)
+    etag = render_etag(payload, image_format, size, border)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(render_qr(payload, image_format, size, border), content_type=QR_RENDER_FORMATS[image_format])
+    
+    # Картинка для этих параметров никогда не меняется
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
+
+
+@main_auth(on_cookies=True)
+def qr_bulk_generate(request):
+    """Массовая генерация QR-кодов для выборки товаров (выполняется в фоне)"""
+    if request.method == 'POST':
+        form = QRBulkGenerateForm(request.POST)
+        if form.is_valid():
+            job, _ = enqueue_job(
+                BackgroundJob.KIND_QR_BULK,
+                user_token=request.bitrix_user_token,
+                **form.cleaned_data,
+            )
+            messages.success(request, f'Задача #{job.id} поставлена в очередь')
+            return redirect('main_app:qr_bulk_generate')
+    else:
+        form = QRBulkGenerateForm()
+    
+    jobs = BackgroundJob.objects.filter(kind=BackgroundJob.KIND_QR_BULK).order_by('-created_at')[:10]
+    context = {
+        'form': form,
+        'jobs': jobs,
+        'has_active_jobs': any(job.is_active for job in jobs),
+    }
+    return render(request, 'main_app/qr_bulk.html', context)
+
+
+@main_auth(on_cookies=True)
+def qr_bulk_status(request, job_id):
+    """Состояние задачи массовой генерации (для индикатора прогресса)"""
+    job = get_object_or_404(BackgroundJob, id=job_id, kind=BackgroundJob.KIND_QR_BULK)
+    return JsonResponse(_job_payload(job))
+
+
+@main_auth(on_cookies=True)
+def qr_bulk_download(request, job_id):
+    """Скачать результат массовой генерации (файл отдается потоком)"""
+    job = get_object_or_404(BackgroundJob, id=job_id, kind=BackgroundJob.KIND_QR_BULK, status=BackgroundJob.STATUS_DONE)
+    output = job.progress.get('output')
+    if not output or not default_storage.exists(output):
+        raise Http404("Файл результата не найден")
+    
+    return FileResponse(default_storage.open(output, 'rb'), as_attachment=True, filename=os.path.basename(output))
+
+
 @main_auth(on_cookies=True)
 def qr_result(request, qr_link_id):
     """Результат генерации QR-кода"""
@@ -135,10 +259,18 @@ def qr_result(request, qr_link_id):
     token_part = qr_link.signed_token
     display_url = f"{base_url}/product/{token_part}/"
     
+    # Графики строятся только по таблицам итогов, журнал сканирований не читается
+    today = timezone.localdate()
     context = {
         'qr_link': qr_link,
         'qr_url': qr_url,
         'display_url': display_url,
+        'scans_daily': daily_series([qr_link.id])[qr_link.id],
+        'scans_hourly': hourly_series(qr_link.id),
+        'product_scans_daily': product_daily_series([qr_link.product_id])[qr_link.product_id],
+        'unique_visitors_7d': unique_visitors([qr_link.id], today - timedelta(days=6), today),
+        'unique_visitors_30d': unique_visitors([qr_link.id], today - timedelta(days=29), today),
+        'product_unique_visitors_30d': product_unique_visitors(qr_link.product_id, today - timedelta(days=29), today),
     }
     return render(request, 'main_app/qr_result.html', context)
 
@@ -146,81 +278,245 @@ def qr_result(request, qr_link_id):
 @main_auth(on_cookies=True)
 def qr_list(request):
     """Список сгенерированных QR-кодов"""
-    qr_links = QRCodeLink.objects.select_related('product').order_by('-created_at')
+    qr_links = QRCodeLink.objects.select_related('product')
+    
+    paginator = KeysetPaginator(qr_links, QR_LIST_ORDERING, 20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
-    paginator = Paginator(qr_links, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    scans = daily_series([qr_link.id for qr_link in page_obj])
+    for qr_link in page_obj:
+        qr_link.scans_daily = scans[qr_link.id]
     
     context = {
         'page_obj': page_obj,
         'qr_links': page_obj,
+        'approximate_count': paginator.approximate_count,
     }
     return render(request, 'main_app/qr_list.html', context)
 
 
 def product_view_by_token(request, token):
     """Публичная страница товара по токену (без авторизации)"""
-    product_id = signer.verify_product_token(token)
-    if not product_id:
+    resolved = token_cache.resolve(token)
+    etag, last_modified, response = _product_page_precheck(request, resolved)
+    if response is None:
+        html = get_cached_product_page(resolved)
+        if html is None:
+            try:
+                product = Product.objects.get(id=resolved.product_id, is_active=True)
+            except Product.DoesNotExist:
+                raise Http404("Товар не найден")
+            html = render_to_string('main_app/product_view.html', {'product': product})
+            cache_product_page(resolved, html)
+        response = HttpResponse(html)
+    
+    return _product_page_headers(response, etag, last_modified)
+
+
+async def aproduct_view_by_token(request, token):
+    """Асинхронный вариант product_view_by_token для ASGI (см. PUBLIC_VIEWS_ASYNC)"""
+    resolved = await token_cache.aresolve(token)
+    etag, last_modified, response = _product_page_precheck(request, resolved)
+    if response is None:
+        html = await aget_cached_product_page(resolved)
+        if html is None:
+            try:
+                product = await Product.objects.aget(id=resolved.product_id, is_active=True)
+            except Product.DoesNotExist:
+                raise Http404("Товар не найден")
+            html = render_to_string('main_app/product_view.html', {'product': product})
+            await acache_product_page(resolved, html)
+        response = HttpResponse(html)
+    
+    return _product_page_headers(response, etag, last_modified)
+
+
+def _product_page_precheck(request, resolved):
+    """
+    Общая часть публичной страницы: проверка токена, учет сканирования и
+    условный GET. Возвращает (etag, last_modified, ответ 304 или None).
+    """
+    # У ссылки с прошедшим сроком действия сканирование не учитывается
+    if not resolved or (resolved.expires_at and resolved.expires_at <= timezone.now()):
         raise Http404("Неверная или истекшая ссылка")
     
-    try:
-        product = Product.objects.get(id=product_id, is_active=True)
-    except Product.DoesNotExist:
+    if not resolved.product_active:
         raise Http404("Товар не найден")
     
-    try:
-        qr_link = QRCodeLink.objects.get(signed_token=token, is_active=True)
-        qr_link.increment_access()
-    except QRCodeLink.DoesNotExist:
-        qr_link = None
+    # Сканирование учитывается и для ответа 304, и для страницы из кеша.
+    # Счетчик копится в памяти и сбрасывается фоновым потоком, запрос его не ждет
+    if resolved.link_active:
+        scan_counter.record(resolved.qr_link_id, product_id=resolved.product_id, visitor=visitor_hash(request))
     
-    context = {
-        'product': product,
-        'qr_link': qr_link,
-    }
-    return render(request, 'main_app/product_view.html', context)
+    etag = product_page_etag(resolved)
+    last_modified = resolved.product_updated_at.timestamp()
+    return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _product_page_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Браузер переспрашивает сервер при каждом сканировании, иначе сканы не будут учтены
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _last_sync_job(request):
+    """Последняя задача синхронизации товаров для портала текущего пользователя"""
+    lock_key = product_sync_lock_key(get_portal_domain(request.bitrix_user_token))
+    return BackgroundJob.objects.filter(lock_key=lock_key).order_by('-created_at').first()
 
 
 @main_auth(on_cookies=True)
 def sync_products(request):
-    """Синхронизация товаров с Битрикс24"""
+    """Постановка синхронизации товаров с Битрикс24 в очередь фоновых задач"""
     if request.method == 'POST':
-        try:
-            from .utils.bitrix_api import BitrixProductService
-            service = BitrixProductService(request.bitrix_user_token)
-            created, updated = service.sync_products_to_local()
-            messages.success(request, f'Синхронизация завершена. Создано: {created}, обновлено: {updated}')
-        except Exception as e:
-            messages.error(request, f'Ошибка синхронизации: {str(e)}')
+        portal_domain = get_portal_domain(request.bitrix_user_token)
+        job, created = enqueue_job(
+            BackgroundJob.KIND_PRODUCT_SYNC,
+            lock_key=product_sync_lock_key(portal_domain),
+            user_token=request.bitrix_user_token,
+            full=bool(request.POST.get('full')),
+        )
+        if created:
+            messages.success(request, 'Синхронизация запущена в фоне')
+        else:
+            messages.info(request, 'Синхронизация уже выполняется')
     
     return redirect('main_app:product_list')
 
 
+@main_auth(on_cookies=True)
+def sync_status(request):
+    """Состояние последней синхронизации товаров (для индикатора прогресса)"""
+    job = _last_sync_job(request)
+    if job is None:
+        return JsonResponse({'status': None})
+    
+    return JsonResponse(_job_payload(job))
+
+
+def _job_payload(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'is_active': job.is_active,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+
+@csrf_exempt
+@require_POST
+def bitrix_product_event(request):
+    """Прием исходящих событий Битрикс24 по товарам (добавление, изменение, удаление)"""
+    if not is_valid_application_token(request.POST.get('auth[application_token]')):
+        return HttpResponseForbidden('Неверный application_token')
+    
+    event = request.POST.get('event', '').upper()
+    if event not in dict(PendingProductEvent.EVENT_CHOICES):
+        return JsonResponse({'result': 'ignored'})
+    
+    try:
+        bitrix_id = int(request.POST.get('data[FIELDS][ID]'))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest('Не передан ID товара')
+    
+    portal_domain = request.POST.get('auth[domain]') or settings.APP_SETTINGS.portal_domain
+    record_product_event(portal_domain, bitrix_id, event)
+    
+    return JsonResponse({'result': 'ok'})
+
+
+# Без METRICS_TOKEN метрики отдаются только локальному сборщику
+METRICS_LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def metrics(request):
+    """Метрики производительности процесса в текстовом формате Prometheus"""
+    if not METRICS_SAMPLE_RATE:
+        raise Http404("Метрики выключены")
+    
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return HttpResponseForbidden('Неверный токен')
+    elif request.META.get('REMOTE_ADDR') not in METRICS_LOCAL_ADDRESSES:
+        return HttpResponseForbidden('Метрики доступны только локально')
+    
+    response = HttpResponse(metrics_registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    patch_cache_control(response, no_store=True)
+    return response
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class ProductSearchAPI(View):
-    """API для поиска товаров (для автокомплита)"""
+    """
+    API для поиска товаров (для автокомплита).
+    Результаты кешируются по префиксам запроса до следующего изменения каталога.
+    """
+    
+    limit = 10
     
     def get(self, request):
-        query = request.GET.get('q', '')
-        if len(query) < 2:
+        normalized = normalize_query(request.GET.get('q', ''))
+        if len(normalized) < SEARCH_MIN_LENGTH:
             return JsonResponse({'results': []})
         
-        products = Product.objects.filter(
-            is_active=True,
-            name__icontains=query
-        ).values('id', 'bitrix_id', 'name', 'price')[:10]
-        
-        results = [
-            {
-                'id': p['id'],
-                'bitrix_id': p['bitrix_id'],
-                'name': p['name'],
-                'price': str(p['price']),
-                'text': f"{p['name']} (ID: {p['bitrix_id']}, {p['price']} руб.)"
-            }
-            for p in products
-        ]
+        generation = catalog_generation()
+        etag = search_etag(generation, normalized)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            products = cached_search(normalized, self.fetch, self.limit, generation)
+            response = JsonResponse({'results': [self.serialize(p) for p in products]})
+        return self.patch_headers(response, etag)
+    
+    def get_queryset(self, query):
+        products = search_products(Product.objects.filter(is_active=True), query)
+        return products.values('id', 'bitrix_id', 'name', 'price', 'sort_order')
+    
+    def fetch(self, query, rows):
+        return list(self.get_queryset(query)[:rows])
+    
+    def patch_headers(self, response, etag):
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=SEARCH_BROWSER_MAX_AGE)
+        return response
+    
+    def serialize(self, p):
+        return {
+            'id': p['id'],
+            'bitrix_id': p['bitrix_id'],
+            'name': p['name'],
+            'price': str(p['price']),
+            'text': f"{p['name']} (ID: {p['bitrix_id']}, {p['price']} руб.)"
+        }
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncProductSearchAPI(ProductSearchAPI):
+    """Асинхронный вариант ProductSearchAPI для ASGI (см. PUBLIC_VIEWS_ASYNC)"""
+    
+    async def get(self, request):
+        normalized = normalize_query(request.GET.get('q', ''))
+        if len(normalized) < SEARCH_MIN_LENGTH:
+            return JsonResponse({'results': []})
         
-        return JsonResponse({'results': results})
+        generation = await acatalog_generation()
+        etag = search_etag(generation, normalized)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            products = await acached_search(normalized, self.afetch, self.limit, generation)
+            response = JsonResponse({'results': [self.serialize(p) for p in products]})
+        return self.patch_headers(response, etag)
+    
+    async def afetch(self, query, rows):
+        if connection.vendor != 'postgresql':
+            # Резервный индекс триграмм в памяти синхронный (проверяет актуальность запросом к базе)
+            return await sync_to_async(self.fetch)(query, rows)
+        return [p async for p in self.get_queryset(query)[:rows]]
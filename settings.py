@@ -19,6 +19,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'integration_utils.bitrix24',
     'integration_utils.its_utils.app_gitpull',
     'start',
@@ -26,6 +27,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы в длительность запроса вошли остальные middleware
+    'main_app.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,7 +42,7 @@ ROOT_URLCONF = 'urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main_app.utils.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -54,6 +57,23 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'wsgi.application'
+ASGI_APPLICATION = 'tz2.asgi.application'
+
+# Асинхронные версии публичной страницы товара и API поиска (для запуска под ASGI, см. deploy/)
+PUBLIC_VIEWS_ASYNC = False
+
+# Сохранять PNG-файл для каждой новой QR-ссылки; при False картинки рисуются по запросу (main_app:qr_image)
+QR_STORE_FILES = True
+
+# Сколько обратных прокси (nginx) дописывают адрес клиента в X-Forwarded-For; 0 - брать REMOTE_ADDR
+TRUSTED_PROXY_COUNT = 0
+
+# Метрики производительности (/app/metrics/): доля измеряемых запросов, 0 - выключено
+METRICS_SAMPLE_RATE = 0
+# Запросы дольше стольких мс пишутся в лог main_app.slow_requests с самыми долгими SQL; None - не писать
+METRICS_SLOW_REQUEST_MS = None
+# Токен для заголовка Authorization: Bearer <токен>; без него метрики отдаются только на 127.0.0.1
+METRICS_TOKEN = None
 
 DATABASES = {
     'default': {
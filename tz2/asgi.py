@@ -1,5 +1,5 @@
 import os
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tz2.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
 application = get_asgi_application()
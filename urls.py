@@ -8,7 +8,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('app/', include('main_app.urls')),
     path('', include('start.urls')),
-    path('product/<str:token>/', views.product_view_by_token, name='product_view_by_token'),
+    path(
+        'product/<str:token>/',
+        views.aproduct_view_by_token if settings.PUBLIC_VIEWS_ASYNC else views.product_view_by_token,
+        name='product_view_by_token',
+    ),
 ]
 
 if settings.DEBUG: